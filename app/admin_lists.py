@@ -0,0 +1,147 @@
+"""
+Admin listings (/admin/users, /admin/books): one bounded page at a time.
+- keyset pagination, newest first: (created_at, user_id) / (created_at, id)
+- filters run in PostgREST: pending approval, email/name search, low stock,
+  title/author/code search
+- only the columns the pages show (no select=*)
+- optional streamed HTML (off by default; ADMIN_STREAM_HTML=1 or ?stream=1): the
+  page goes out in chunks while the template renders (gzip flushes per chunk,
+  see PageGZipMiddleware), so big pages start arriving right away
+"""
+import os
+import json
+import base64
+from typing import Iterator
+from urllib.parse import urlencode, quote
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from app.catalog import _quote_value
+from app.templating import templates
+
+ADMIN_PAGE_SIZES = (50, 100, 250, 1000)
+ADMIN_DEFAULT_PAGE_SIZE = 50
+# "low stock" = at most this many copies left on the shelf
+ADMIN_LOW_STOCK = int(os.getenv("ADMIN_LOW_STOCK", "1"))
+ADMIN_STREAM_HTML = os.getenv("ADMIN_STREAM_HTML", "0") == "1"
+# rendered template output is flushed in chunks of about this size
+ADMIN_STREAM_CHUNK = int(os.getenv("ADMIN_STREAM_CHUNK", str(16 * 1024)))
+
+USER_COLUMNS = "user_id,email,full_name,is_approved,approved_at,created_at"
+ADMIN_BOOK_COLUMNS = (
+    "id,title,author,code,image_url,image_variants,created_at,copies_total,copies_borrowed,available_copies"
+)
+
+
+def parse_admin_page_size(raw: str | None) -> int:
+    try:
+        n = int(raw or ADMIN_DEFAULT_PAGE_SIZE)
+    except ValueError:
+        return ADMIN_DEFAULT_PAGE_SIZE
+    return n if n in ADMIN_PAGE_SIZES else ADMIN_DEFAULT_PAGE_SIZE
+
+
+def encode_admin_cursor(created_at, key) -> str:
+    raw = json.dumps([created_at, key], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_admin_cursor(raw: str | None) -> tuple[str, str] | None:
+    """Cursor = last (created_at, key) of the previous page. Bad cursor => first page."""
+    if not raw:
+        return None
+    try:
+        padded = raw + "=" * (-len(raw) % 4)
+        created_at, key = json.loads(base64.urlsafe_b64decode(padded))
+        return str(created_at), str(key)
+    except (ValueError, TypeError):
+        return None
+
+
+def _search_term(q: str) -> str:
+    return q.replace("*", "").replace("%", "").strip()
+
+
+def _keyset(after: tuple[str, str] | None, key: str, key_value: str) -> str | None:
+    if not after:
+        return None
+    ts = _quote_value(after[0])
+    return f"or(created_at.lt.{ts},and(created_at.eq.{ts},{key}.lt.{key_value}))"
+
+
+def users_path(q: str = "", pending: bool = False, after: tuple[str, str] | None = None,
+               limit: int = ADMIN_DEFAULT_PAGE_SIZE) -> str:
+    """One page of user_profiles, newest first (limit+1 rows: the extra one means "next page")."""
+    params: list[tuple[str, str]] = [("select", USER_COLUMNS)]
+    trees: list[str] = []
+    term = _search_term(q)
+    if term:
+        like = _quote_value(f"*{term}*")
+        trees.append(f"or(email.ilike.{like},full_name.ilike.{like})")
+    if pending:
+        trees.append("or(is_approved.is.false,is_approved.is.null)")
+    if after:
+        trees.append(_keyset(after, "user_id", _quote_value(after[1])))
+    if trees:
+        params.append(("and", f"({','.join(trees)})"))
+    params.append(("order", "created_at.desc,user_id.desc"))
+    params.append(("limit", str(int(limit) + 1)))
+    return "/rest/v1/user_profiles?" + urlencode(params, quote_via=quote, safe=",.()*:")
+
+
+def admin_books_path(q: str = "", low_stock: bool = False, after: tuple[str, str] | None = None,
+                     limit: int = ADMIN_DEFAULT_PAGE_SIZE) -> str:
+    """One page of books (books_with_ratings: it has available_copies), newest first, limit+1 rows."""
+    params: list[tuple[str, str]] = [("select", ADMIN_BOOK_COLUMNS)]
+    trees: list[str] = []
+    term = _search_term(q)
+    if term:
+        like = _quote_value(f"*{term}*")
+        trees.append(f"or(title.ilike.{like},author.ilike.{like},code.ilike.{like})")
+    if after:
+        try:
+            trees.append(_keyset(after, "id", str(int(after[1]))))
+        except ValueError:
+            pass
+    if trees:
+        params.append(("and", f"({','.join(trees)})"))
+    if low_stock:
+        params.append(("available_copies", f"lte.{ADMIN_LOW_STOCK}"))
+    params.append(("order", "created_at.desc,id.desc"))
+    params.append(("limit", str(int(limit) + 1)))
+    return "/rest/v1/books_with_ratings?" + urlencode(params, quote_via=quote, safe=",.()*:")
+
+
+def split_page(rows: list[dict], limit: int, key: str) -> tuple[list[dict], str | None]:
+    """(rows of this page, cursor of the next page or None)."""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_admin_cursor(rows[-1].get("created_at"), rows[-1].get(key))
+
+
+def render_chunks(name: str, context: dict) -> Iterator[str]:
+    """Template output via Jinja generate(), regrouped into ~ADMIN_STREAM_CHUNK pieces."""
+    buf: list[str] = []
+    size = 0
+    for piece in templates.get_template(name).generate(context):
+        buf.append(piece)
+        size += len(piece)
+        if size >= ADMIN_STREAM_CHUNK:
+            yield "".join(buf)
+            buf, size = [], 0
+    if buf:
+        yield "".join(buf)
+
+
+def wants_stream(request: Request) -> bool:
+    raw = request.query_params.get("stream")
+    return ADMIN_STREAM_HTML if raw is None else raw == "1"
+
+
+def admin_page(request: Request, name: str, context: dict, headers: dict | None = None):
+    """Streamed (headers first, rows as they render) or one-shot TemplateResponse."""
+    if wants_stream(request):
+        return StreamingResponse(render_chunks(name, context), media_type="text/html; charset=utf-8", headers=headers)
+    return templates.TemplateResponse(name, context, headers=headers)
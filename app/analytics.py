@@ -0,0 +1,318 @@
+"""
+Admin analytics from aggregates kept in memory (no scan per dashboard view).
+
+- borrow / return / rate update the counters as they happen (main.action_response)
+- every ANALYTICS_RECONCILE_SECONDS the aggregates are rebuilt from Supabase
+  (books_with_ratings, borrow_history, ratings; keyset pages, service key) and
+  swapped in: drift from other workers' events or missed events is bounded by
+  that interval
+- without the service key there is no reconcile (borrow_history / ratings are
+  per-user under RLS, an admin token would only see its own rows): the counters
+  are this worker's events only and the dashboard labels them partial
+- top lists are sorted indexes kept up to date per event (bisect), totals are
+  running counters: a dashboard read is O(ANALYTICS_TOP), not O(catalog);
+  overdue count is a bisect over the sorted due dates of active borrows
+- per-book table as CSV, streamed in ANALYTICS_CSV_CHUNK-row chunks
+"""
+import io
+import os
+import csv
+import time
+import bisect
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import AsyncIterator
+from urllib.parse import urlencode, quote
+
+from app.catalog import catalog_path, _quote_value
+from app.search import search_index
+from app.tracing import log_event
+from app.supabase_client import sb_get, SUPABASE_SERVICE_ROLE_KEY
+
+ANALYTICS_RECONCILE_SECONDS = float(os.getenv("ANALYTICS_RECONCILE_SECONDS", "600"))
+ANALYTICS_PAGE = int(os.getenv("ANALYTICS_PAGE", "1000"))
+ANALYTICS_CSV_CHUNK = int(os.getenv("ANALYTICS_CSV_CHUNK", "500"))
+# rows in the dashboard's top lists
+ANALYTICS_TOP = 10
+
+CSV_COLUMNS = (
+    "book_id", "code", "title", "copies_total", "copies_borrowed", "utilization",
+    "borrows_total", "rating_count", "rating_avg", "r1", "r2", "r3", "r4", "r5",
+)
+
+
+def _ts(raw) -> float | None:
+    try:
+        ts = datetime.fromisoformat(raw)
+    except (TypeError, ValueError):
+        return None
+    return (ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)).timestamp()
+
+
+class Aggregates:
+    def __init__(self):
+        self.books: dict[int, dict] = {}  # id -> title, code, copies_total, copies_borrowed
+        self.borrows: dict[int, int] = {}  # id -> borrows ever
+        self.ratings: dict[int, list[int]] = {}  # id -> [count of 1★, ..., 5★]
+        self.rating_hist = [0] * 5
+        self.active_by_user: dict[str, int] = {}
+        self.active_dues: list[float] = []  # sorted due timestamps of active borrows
+        self.active_pairs: dict[tuple[str, int], list[float]] = {}  # (user, book) -> due timestamps
+        self.borrows_total = 0
+        # sorted indexes for the top lists: (-borrows, id) / (-utilization, -copies_borrowed, id)
+        self.by_borrows: list[tuple] = []
+        self.by_utilization: list[tuple] = []
+        self._keys: dict[int, tuple] = {}  # id -> (borrows key, utilization key) currently indexed
+        self.reconciled_at: float | None = None
+        self.version = 0
+
+    # ---------- indexes ----------
+    def _index_keys(self, book_id: int) -> tuple:
+        meta = self.books.get(book_id, {})
+        borrows = self.borrows.get(book_id, 0)
+        total = int(meta.get("copies_total") or 1)
+        borrowed = int(meta.get("copies_borrowed") or 0)
+        return (
+            (-borrows, book_id) if borrows else None,
+            (-round(borrowed / total, 3), -borrowed, book_id) if borrowed else None,
+        )
+
+    def _reindex(self, book_id: int):
+        """Move one book in the top-list indexes (O(log n) search + a list shift)."""
+        old = self._keys.get(book_id, (None, None))
+        new = self._index_keys(book_id)
+        for index, before, after in ((self.by_borrows, old[0], new[0]), (self.by_utilization, old[1], new[1])):
+            if before == after:
+                continue
+            if before is not None:
+                i = bisect.bisect_left(index, before)
+                if i < len(index) and index[i] == before:
+                    del index[i]
+            if after is not None:
+                bisect.insort(index, after)
+        self._keys[book_id] = new
+
+    # ---------- events ----------
+    def _book(self, book: dict) -> dict:
+        book_id = int(book["id"])
+        meta = self.books.get(book_id)
+        if meta is None:
+            summary = (search_index.summaries([book_id]) or [{}])[0]
+            meta = self.books[book_id] = {"title": summary.get("title"), "code": summary.get("code")}
+        for k in ("title", "code", "copies_total", "copies_borrowed"):
+            if book.get(k) is not None:
+                meta[k] = book[k]
+        return meta
+
+    def _add_active(self, user_id: str, book_id: int, due: float):
+        bisect.insort(self.active_dues, due)
+        self.active_pairs.setdefault((user_id, book_id), []).append(due)
+        self.active_by_user[user_id] = self.active_by_user.get(user_id, 0) + 1
+
+    def borrowed(self, user_id: str, book: dict):
+        self._book(book)
+        book_id = int(book["id"])
+        self.borrows[book_id] = self.borrows.get(book_id, 0) + 1
+        self.borrows_total += 1
+        self._reindex(book_id)
+        due = _ts(book.get("my_due_date"))
+        if due is not None:
+            self._add_active(user_id, book_id, due)
+        self.version += 1
+
+    def returned(self, user_id: str, book: dict):
+        self._book(book)
+        self._reindex(int(book["id"]))
+        dues = self.active_pairs.get((user_id, int(book["id"])))
+        if dues:
+            due = min(dues)  # the RPC returns the oldest borrow first
+            dues.remove(due)
+            if not dues:
+                del self.active_pairs[(user_id, int(book["id"]))]
+            i = bisect.bisect_left(self.active_dues, due)
+            if i < len(self.active_dues) and self.active_dues[i] == due:
+                del self.active_dues[i]
+            left = self.active_by_user.get(user_id, 1) - 1
+            if left > 0:
+                self.active_by_user[user_id] = left
+            else:
+                self.active_by_user.pop(user_id, None)
+        self.version += 1
+
+    def rated(self, book: dict, rating: int):
+        if not 1 <= int(rating) <= 5:
+            return
+        self._book(book)
+        self._reindex(int(book["id"]))
+        self.ratings.setdefault(int(book["id"]), [0] * 5)[int(rating) - 1] += 1
+        self.rating_hist[int(rating) - 1] += 1
+        self.version += 1
+
+    # ---------- rebuild ----------
+    @classmethod
+    def build(cls, books: list[dict], borrows: list[dict], ratings: list[dict]) -> "Aggregates":
+        """From full Supabase pages (safe in a thread: touches nothing shared)."""
+        agg = cls()
+        for b in books:
+            agg.books[int(b["id"])] = {k: b.get(k) for k in ("title", "code", "copies_total", "copies_borrowed")}
+        for h in borrows:
+            book_id = int(h["book_id"])
+            agg.borrows[book_id] = agg.borrows.get(book_id, 0) + 1
+            due = _ts(h.get("due_date"))
+            if h.get("status") == "borrowed" and due is not None:
+                agg.active_dues.append(due)
+                agg.active_pairs.setdefault((h["user_id"], book_id), []).append(due)
+                agg.active_by_user[h["user_id"]] = agg.active_by_user.get(h["user_id"], 0) + 1
+        agg.active_dues.sort()
+        agg.borrows_total = sum(agg.borrows.values())
+        for book_id in set(agg.books) | set(agg.borrows):
+            agg._keys[book_id] = keys = agg._index_keys(book_id)
+            if keys[0] is not None:
+                agg.by_borrows.append(keys[0])
+            if keys[1] is not None:
+                agg.by_utilization.append(keys[1])
+        agg.by_borrows.sort()
+        agg.by_utilization.sort()
+        for r in ratings:
+            rating = int(r.get("rating") or 0)
+            if 1 <= rating <= 5:
+                agg.ratings.setdefault(int(r["book_id"]), [0] * 5)[rating - 1] += 1
+                agg.rating_hist[rating - 1] += 1
+        agg.reconciled_at = time.time()
+        return agg
+
+    def replace_with(self, other: "Aggregates"):
+        """Swap in rebuilt aggregates (from the event loop: atomic for requests)."""
+        version = self.version
+        self.__dict__.update(other.__dict__)
+        self.version = version + 1
+
+    # ---------- reading ----------
+    def book_row(self, book_id: int) -> dict:
+        meta = self.books.get(book_id, {})
+        hist = self.ratings.get(book_id, [0] * 5)
+        count = sum(hist)
+        total = int(meta.get("copies_total") or 1)
+        borrowed = int(meta.get("copies_borrowed") or 0)
+        return {
+            "book_id": book_id,
+            "code": meta.get("code") or "",
+            "title": meta.get("title") or "",
+            "copies_total": total,
+            "copies_borrowed": borrowed,
+            "utilization": round(borrowed / total, 3) if total else 0.0,
+            "borrows_total": self.borrows.get(book_id, 0),
+            "rating_count": count,
+            "rating_avg": round(sum((i + 1) * n for i, n in enumerate(hist)) / count, 2) if count else 0.0,
+            **{f"r{i + 1}": n for i, n in enumerate(hist)},
+        }
+
+    def summary(self) -> dict:
+        """Dashboard numbers from the running totals + the head of the sorted indexes."""
+        rated = sum(self.rating_hist)
+        return {
+            "books": len(self.books),
+            "borrows_total": self.borrows_total,
+            "active_borrows": len(self.active_dues),
+            "active_borrowers": len(self.active_by_user),
+            "ratings_total": rated,
+            "rating_avg": round(sum((i + 1) * n for i, n in enumerate(self.rating_hist)) / rated, 2) if rated else 0.0,
+            "rating_hist": [
+                {"stars": i + 1, "count": n, "pct": round(100 * n / rated) if rated else 0}
+                for i, n in enumerate(self.rating_hist)
+            ],
+            "top_borrowed": [self.book_row(key[-1]) for key in self.by_borrows[:ANALYTICS_TOP]],
+            "top_utilized": [self.book_row(key[-1]) for key in self.by_utilization[:ANALYTICS_TOP]],
+            "overdue": bisect.bisect_left(self.active_dues, time.time()),
+            "reconciled_at": self.reconciled_at,
+        }
+
+    async def csv_chunks(self) -> AsyncIterator[str]:
+        """Per-book CSV (most borrowed first), ANALYTICS_CSV_CHUNK rows per chunk."""
+        ids = sorted(set(self.books) | set(self.borrows), key=lambda i: (-self.borrows.get(i, 0), i))
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+        for n, book_id in enumerate(ids, start=1):
+            writer.writerow(self.book_row(book_id))
+            if n % ANALYTICS_CSV_CHUNK == 0:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+                await asyncio.sleep(0)  # let other requests run between chunks
+        if buf.tell():
+            yield buf.getvalue()
+
+
+# one per worker
+analytics = Aggregates()
+
+
+# =========================
+# Reconciliation
+# =========================
+async def _pages(table: str, select: str, keys: tuple[str, ...], token: str) -> list[dict]:
+    """Whole table, keyset-paged on one or two ascending columns."""
+    rows: list[dict] = []
+    last = None
+    while True:
+        params = [("select", select), ("order", ",".join(f"{k}.asc" for k in keys)), ("limit", str(ANALYTICS_PAGE))]
+        if last is not None and len(keys) == 1:
+            params.append((keys[0], f"gt.{last[0]}"))
+        elif last is not None:
+            a, b = _quote_value(last[0]), _quote_value(last[1])
+            params.append(("or", f"({keys[0]}.gt.{a},and({keys[0]}.eq.{a},{keys[1]}.gt.{b}))"))
+        r = await sb_get(f"/rest/v1/{table}?" + urlencode(params, quote_via=quote, safe=",.()*:"), access_token=token)
+        if r.status_code >= 400:
+            raise RuntimeError(f"{table}: {r.status_code} {r.text[:200]}")
+        page = r.json()
+        rows += page
+        if len(page) < ANALYTICS_PAGE:
+            return rows
+        last = tuple(page[-1][k] for k in keys)
+
+
+async def _books(token: str) -> list[dict]:
+    rows: list[dict] = []
+    after = None
+    while True:
+        r = await sb_get(catalog_path(after=after, limit=ANALYTICS_PAGE), access_token=token)
+        if r.status_code >= 400:
+            raise RuntimeError(f"books_with_ratings: {r.status_code} {r.text[:200]}")
+        page = r.json()
+        rows += page[:ANALYTICS_PAGE]
+        if len(page) <= ANALYTICS_PAGE:
+            return rows
+        after = (rows[-1]["created_at"], rows[-1]["id"])
+
+
+async def reconcile(token: str = SUPABASE_SERVICE_ROLE_KEY) -> Aggregates:
+    started = time.perf_counter()
+    books, borrows, ratings = await asyncio.gather(
+        _books(token),
+        _pages("borrow_history", "id,user_id,book_id,status,due_date", ("id",), token),
+        _pages("ratings", "book_id,user_id,rating", ("book_id", "user_id"), token),
+    )
+    analytics.replace_with(await asyncio.to_thread(Aggregates.build, books, borrows, ratings))
+    log_event(
+        "analytics_reconciled",
+        books=len(books), borrows=len(borrows), ratings=len(ratings),
+        duration_ms=round((time.perf_counter() - started) * 1000, 1),
+    )
+    return analytics
+
+
+async def _reconcile_quietly(token: str):
+    try:
+        await reconcile(token)
+    except Exception as e:
+        log_event("analytics_reconcile_error", level=logging.WARNING, error=repr(e))
+
+
+async def reconcile_loop():
+    """Lifespan task (service key only): rebuild now, then every ANALYTICS_RECONCILE_SECONDS."""
+    while True:
+        await _reconcile_quietly(SUPABASE_SERVICE_ROLE_KEY)
+        await asyncio.sleep(ANALYTICS_RECONCILE_SECONDS)
+
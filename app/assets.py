@@ -0,0 +1,185 @@
+"""
+Build-free static pipeline (runs once at startup):
+- every file in app/static gets a content-hashed name: styles.css -> styles.<hash>.css
+- text assets are precompressed (gzip, and brotli when the module is installed)
+- hashed URLs are served with Cache-Control: immutable; plain names still work
+  (revalidated with an ETag) so old links and bookmarks don't break
+Templates use {{ static_url("styles.css") }}.
+"""
+import io
+import gzip
+import hashlib
+import mimetypes
+import os
+from dataclasses import dataclass
+
+from starlette.middleware.gzip import GZipMiddleware, GZipResponder
+from starlette.datastructures import Headers
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = "app/static"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+
+# worth compressing (images/fonts are already compressed)
+_COMPRESSIBLE = {".css", ".js", ".svg", ".json", ".txt", ".html", ".map"}
+
+
+@dataclass
+class Asset:
+    name: str
+    hashed_name: str
+    content_type: str
+    etag: str
+    body: bytes
+    gzip: bytes | None = None
+    br: bytes | None = None
+
+
+def _hashed(name: str, digest: str) -> str:
+    stem, dot, ext = name.rpartition(".")
+    return f"{stem}.{digest}.{ext}" if dot else f"{name}.{digest}"
+
+
+def build_assets(directory: str = STATIC_DIR) -> dict[str, Asset]:
+    assets: dict[str, Asset] = {}
+    for root, _, files in os.walk(directory):
+        for filename in files:
+            full = os.path.join(root, filename)
+            name = os.path.relpath(full, directory).replace(os.sep, "/")
+            with open(full, "rb") as f:
+                body = f.read()
+
+            digest = hashlib.blake2b(body, digest_size=5).hexdigest()
+            content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            if content_type.startswith("text/") or content_type == "application/javascript":
+                content_type += "; charset=utf-8"
+
+            asset = Asset(
+                name=name,
+                hashed_name=_hashed(name, digest),
+                content_type=content_type,
+                etag=f'"{digest}"',
+                body=body,
+            )
+            if os.path.splitext(name)[1].lower() in _COMPRESSIBLE:
+                asset.gzip = gzip.compress(body, compresslevel=9, mtime=0)
+                if brotli is not None:
+                    asset.br = brotli.compress(body, quality=11)
+            assets[name] = asset
+    return assets
+
+
+ASSETS = build_assets()
+_BY_HASHED_NAME = {a.hashed_name: a for a in ASSETS.values()}
+
+# changes whenever any static file changes (part of page ETags: pages embed hashed URLs)
+ASSETS_VERSION = hashlib.blake2b(
+    "".join(sorted(a.hashed_name for a in ASSETS.values())).encode(), digest_size=8
+).hexdigest()
+
+
+def static_url(name: str) -> str:
+    asset = ASSETS.get(name)
+    return f"/static/{asset.hashed_name if asset else name}"
+
+
+def _strip_hash(path: str) -> str | None:
+    """styles.<old hash>.css -> styles.css (a page rendered before a deploy)."""
+    head, _, ext = path.rpartition(".")
+    stem, dot, _digest = head.rpartition(".")
+    return f"{stem}.{ext}" if dot else None
+
+
+class StaticAssets:
+    """ASGI app mounted at /static, serving the prebuilt ASSETS from memory."""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        response = self.get_response(scope)
+        await response(scope, receive, send)
+
+    def get_response(self, scope) -> Response:
+        if scope["method"] not in ("GET", "HEAD"):
+            return Response("Method Not Allowed", status_code=405, headers={"Allow": "GET, HEAD"})
+
+        # path inside the mount (root_path already includes "/static")
+        path = scope["path"]
+        root_path = scope.get("root_path", "")
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        path = path.lstrip("/")
+        headers = dict((k.decode().lower(), v.decode()) for k, v in scope["headers"])
+
+        asset = _BY_HASHED_NAME.get(path)
+        cache_control = IMMUTABLE_CACHE_CONTROL
+        if asset is None:
+            asset = ASSETS.get(path) or ASSETS.get(_strip_hash(path) or "")
+            cache_control = REVALIDATE_CACHE_CONTROL
+        if asset is None:
+            return Response("Not Found", status_code=404)
+
+        out_headers = {"Cache-Control": cache_control, "ETag": asset.etag}
+        if asset.gzip is not None:
+            out_headers["Vary"] = "Accept-Encoding"
+
+        if headers.get("if-none-match") == asset.etag:
+            return Response(status_code=304, headers=out_headers)
+
+        accept = headers.get("accept-encoding", "")
+        body = asset.body
+        if asset.br is not None and "br" in accept:
+            body, out_headers["Content-Encoding"] = asset.br, "br"
+        elif asset.gzip is not None and "gzip" in accept:
+            body, out_headers["Content-Encoding"] = asset.gzip, "gzip"
+
+        if scope["method"] == "HEAD":
+            out_headers["Content-Length"] = str(len(body))
+            body = b""
+        return Response(body, media_type=asset.content_type, headers=out_headers)
+
+
+class _FlushingGzipFile(gzip.GzipFile):
+    """Sync-flushes after every write: each streamed chunk leaves compressed right away."""
+
+    def write(self, data):
+        n = super().write(data)
+        if n:
+            self.flush()
+        return n
+
+
+class _StreamingGZipResponder(GZipResponder):
+    def __init__(self, app, minimum_size: int, compresslevel: int = 9):
+        super().__init__(app, minimum_size, compresslevel=compresslevel)
+        # fresh buffer: the parent's GzipFile already wrote its header into the old one
+        self.gzip_buffer = io.BytesIO()
+        self.gzip_file = _FlushingGzipFile(mode="wb", fileobj=self.gzip_buffer, compresslevel=compresslevel)
+
+
+class PageGZipMiddleware(GZipMiddleware):
+    """
+    GZip for pages only: /static is precompressed (or not worth compressing).
+    Streamed pages (more_body) are flushed per chunk instead of sitting in the
+    compressor's buffer, so streaming still gets the first bytes out early.
+    """
+
+    def __init__(self, app, minimum_size: int = 500, compresslevel: int = 9, exclude_prefixes=("/static/",)):
+        super().__init__(app, minimum_size=minimum_size, compresslevel=compresslevel)
+        self.exclude_prefixes = tuple(exclude_prefixes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith(self.exclude_prefixes):
+            await self.app(scope, receive, send)
+            return
+        if scope["type"] == "http" and "gzip" in Headers(scope=scope).get("Accept-Encoding", ""):
+            responder = _StreamingGZipResponder(self.app, self.minimum_size, compresslevel=self.compresslevel)
+            await responder(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
@@ -1,8 +1,21 @@
+import os
+import json
+import time
+import base64
+
 from itsdangerous import URLSafeSerializer, BadSignature
-from app.supabase_client import SECRET_KEY
+from app.cache import TTLCache
+from app.supabase_client import SECRET_KEY, sb_post
 
 _COOKIE_NAME = "session"
 
+# refresh the access token this many seconds before it expires
+TOKEN_REFRESH_MARGIN = float(os.getenv("TOKEN_REFRESH_MARGIN", "120"))
+
+# refresh_token -> new token payload; shared by concurrent requests of the same user
+# (Supabase refresh tokens are single-use, so parallel requests must not each refresh)
+_refreshes = TTLCache(ttl=30, maxsize=1000)
+
 serializer = URLSafeSerializer(SECRET_KEY, salt="class-library-session")
 
 
@@ -13,6 +26,12 @@ def set_session_cookie(response, access_token: str, refresh_token: str, user_id:
         "user_id": user_id,
         "email": email,
     }
+    write_session_cookie(response, payload)
+
+
+def write_session_cookie(response, sess: dict):
+    """(Re)write the cookie from a session dict; keys starting with "_" stay server-side."""
+    payload = {k: v for k, v in sess.items() if not k.startswith("_")}
     value = serializer.dumps(payload)
     response.set_cookie(
         key=_COOKIE_NAME,
@@ -29,6 +48,12 @@ def clear_session_cookie(response):
     response.delete_cookie(_COOKIE_NAME, path="/")
 
 
+def session_cookie_written(response) -> bool:
+    """The handler already set or cleared the session cookie on this response (login/logout)."""
+    prefix = f"{_COOKIE_NAME}=".encode()
+    return any(k == b"set-cookie" and v.startswith(prefix) for k, v in response.raw_headers)
+
+
 def read_session_cookie(request):
     raw = request.cookies.get(_COOKIE_NAME)
     if not raw:
@@ -37,3 +62,61 @@ def read_session_cookie(request):
         return serializer.loads(raw)
     except BadSignature:
         return None
+
+
+def token_expiry(access_token: str | None) -> float | None:
+    """`exp` claim of a Supabase JWT, decoded locally (no signature check, no network)."""
+    try:
+        payload = access_token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenRefreshError(Exception):
+    def __init__(self, status: int, rejected: bool):
+        super().__init__(status)
+        self.status = status
+        # auth refused the grant itself (bad / used / revoked refresh token)
+        self.rejected = rejected
+
+
+async def _refresh_tokens(refresh_token: str) -> dict:
+    async def load():
+        r = await sb_post("/auth/v1/token?grant_type=refresh_token", json={"refresh_token": refresh_token})
+        if r.status_code >= 400:
+            # 400/401 (invalid_grant, refresh_token_not_found, ...) = the grant is bad;
+            # 5xx / 429 / the breaker's 503 = auth is having trouble, the grant may be fine
+            raise TokenRefreshError(r.status_code, rejected=r.status_code in (400, 401))
+        return r.json()
+
+    return await _refreshes.get_or_load(refresh_token, load)
+
+
+async def ensure_fresh_session(sess: dict) -> dict | None:
+    """
+    Refresh the session's access token shortly before it expires.
+    - returns the (maybe updated, marked "_dirty") session
+    - returns None once the token is expired and auth rejects the refresh token (or there is none)
+    - any other failure (5xx, timeout, open breaker) keeps the session as is:
+      the next request tries again, an upstream incident logs nobody out
+    """
+    exp = token_expiry(sess.get("access_token"))
+    if exp is None or exp - time.time() > TOKEN_REFRESH_MARGIN:
+        return sess
+
+    refresh_token = sess.get("refresh_token")
+    if not refresh_token:
+        return sess if exp > time.time() else None
+    try:
+        data = await _refresh_tokens(refresh_token)
+    except TokenRefreshError as e:
+        return None if e.rejected and exp <= time.time() else sess
+    except Exception:
+        return sess
+
+    sess["access_token"] = data["access_token"]
+    sess["refresh_token"] = data.get("refresh_token") or refresh_token
+    sess["_dirty"] = True
+    return sess
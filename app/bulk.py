@@ -0,0 +1,337 @@
+"""
+Admin batch operations:
+- CSV import (title, author, code, description, copies_total, cover):
+  rows are streamed from the upload, validated, and inserted IMPORT_BATCH_SIZE
+  at a time with one PostgREST bulk insert (on_conflict=code, duplicates
+  ignored and reported from the returned rows); covers come from an optional
+  zip and are read + uploaded with bounded concurrency, and deleted again for
+  rows that were not inserted
+- the whole file is checked (header, UTF-8, IMPORT_MAX_ROWS) before the first insert
+- bulk copies: "code,copies_total" lines applied by one bulk_update_copies RPC
+"""
+import io
+import os
+import csv
+import uuid
+import asyncio
+import zipfile
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import BinaryIO, Iterator
+
+from app.catalog import _quote_value
+from app.images import BUCKET
+from app.uploads import sniff_image_type, UPLOAD_MAX_BYTES
+from app.supabase_client import sb_get, sb_post, sb_delete, sb_upload_file, storage_public_url
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+# codes per existing-codes lookup (code=in.(...) lives in the URL: keep it short)
+IMPORT_LOOKUP_CHUNK = 100
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", "20000"))
+COVER_UPLOAD_CONCURRENCY = int(os.getenv("COVER_UPLOAD_CONCURRENCY", "8"))
+# the import runs inside the request: it gets a longer budget than page requests
+IMPORT_BUDGET_SECONDS = float(os.getenv("IMPORT_BUDGET_SECONDS", "600"))
+# rejected rows listed on the page (the counts always cover every row)
+IMPORT_SHOW_ROWS = 1000
+
+REQUIRED_COLUMNS = ("title", "author", "code")
+MAX_FIELD_LENGTH = {"title": 300, "author": 200, "code": 64, "description": 2000}
+
+
+@dataclass
+class RowResult:
+    line: int  # line in the CSV (header = 1)
+    code: str
+    title: str
+    status: str  # created / invalid / duplicate / error
+    detail: str = ""
+
+
+class BulkImportError(Exception):
+    """The file itself is unusable (not the rows): shown as the page message."""
+
+
+# =========================
+# CSV import
+# =========================
+def read_csv_rows(f: BinaryIO) -> Iterator[tuple[int, dict]]:
+    """(line, row) from an uploaded CSV, read as a stream (utf-8, BOM tolerated)."""
+    text = io.TextIOWrapper(f, encoding="utf-8-sig", newline="")
+    try:
+        reader = csv.DictReader(text)
+        header = [h.strip().lower() for h in (reader.fieldnames or [])]
+        missing = [c for c in REQUIRED_COLUMNS if c not in header]
+        if missing:
+            raise BulkImportError(f"missing column(s): {', '.join(missing)}")
+        reader.fieldnames = header
+        for row in reader:
+            yield reader.line_num, {k: (v or "").strip() for k, v in row.items() if k}
+    except UnicodeDecodeError:
+        raise BulkImportError("the file is not UTF-8 text")
+    finally:
+        text.detach()  # leave the upload's file open (FastAPI closes it)
+
+
+def check_csv(f: BinaryIO):
+    """
+    Whole-file checks before the first insert (header, UTF-8, IMPORT_MAX_ROWS), then
+    back to the start: a file rejected here leaves nothing half-imported.
+    """
+    count = 0
+    for _ in read_csv_rows(f):
+        count += 1
+        if count > IMPORT_MAX_ROWS:
+            raise BulkImportError(f"more than {IMPORT_MAX_ROWS} rows")
+    f.seek(0)
+
+
+def validate_row(row: dict) -> tuple[dict | None, str]:
+    """(books payload, "") or (None, reason)."""
+    for col in REQUIRED_COLUMNS:
+        if not row.get(col):
+            return None, f"{col} is empty"
+    for col, limit in MAX_FIELD_LENGTH.items():
+        if len(row.get(col) or "") > limit:
+            return None, f"{col} longer than {limit}"
+
+    raw_copies = row.get("copies_total") or "1"
+    try:
+        copies = int(raw_copies)
+    except ValueError:
+        return None, f"copies_total is not a number: {raw_copies[:20]}"
+    if copies < 1:
+        return None, "copies_total must be >= 1"
+
+    return {
+        "title": row["title"],
+        "author": row["author"],
+        "code": row["code"],
+        "description": row.get("description") or "",
+        "image_url": None,  # bulk inserts need the same keys on every row
+        "copies_total": copies,
+        "copies_borrowed": 0,
+    }, ""
+
+
+class CoverArchive:
+    """Covers zip: members looked up by file name (folders ignored, case-insensitive)."""
+
+    def __init__(self, f: BinaryIO):
+        try:
+            self.zip = zipfile.ZipFile(f)
+        except zipfile.BadZipFile:
+            raise BulkImportError("the covers file is not a zip")
+        self.members = {
+            os.path.basename(info.filename).lower(): info
+            for info in self.zip.infolist()
+            if not info.is_dir()
+        }
+
+    def read(self, name: str) -> bytes | None:
+        info = self.members.get(os.path.basename(name).lower())
+        if info is None:
+            return None
+        if info.file_size > UPLOAD_MAX_BYTES:
+            raise ValueError("cover too large")
+        return self.zip.read(info)
+
+
+async def _existing_codes(codes: list[str], access_token: str) -> set[str]:
+    """
+    Codes already in books, looked up IMPORT_LOOKUP_CHUNK at a time (only to skip
+    their covers: the insert itself ignores and reports duplicates). A failed
+    lookup just means no skipping.
+    """
+    chunks = [codes[i:i + IMPORT_LOOKUP_CHUNK] for i in range(0, len(codes), IMPORT_LOOKUP_CHUNK)]
+    responses = await asyncio.gather(*(
+        sb_get(
+            f"/rest/v1/books?select=code&code=in.({','.join(_quote_value(c) for c in chunk)})",
+            access_token=access_token,
+        )
+        for chunk in chunks
+    ), return_exceptions=True)
+    existing: set[str] = set()
+    for r in responses:
+        if not isinstance(r, BaseException) and r.status_code < 400:
+            existing |= {row["code"] for row in r.json()}
+    return existing
+
+
+# insert, skip rows whose code exists, answer with the rows actually inserted
+_INSERT_PATH = "/rest/v1/books?on_conflict=code&select=code"
+_INSERT_PREFER = "resolution=ignore-duplicates,return=representation"
+
+
+async def _upload_cover(archive: CoverArchive, name: str, sem: asyncio.Semaphore, access_token: str) -> str:
+    """Storage path of the uploaded cover; raises ValueError with a row-level reason."""
+    # slot first: at most COVER_UPLOAD_CONCURRENCY covers are in memory at a time
+    async with sem:
+        data = await asyncio.to_thread(archive.read, name)
+        if data is None:
+            raise ValueError(f"cover {name} not in the zip")
+        sniffed = sniff_image_type(data[:64])
+        if not sniffed:
+            raise ValueError(f"cover {name} is not a supported image")
+        content_type, ext = sniffed
+        path = f"{uuid.uuid4().hex}.{ext}"
+        up = await sb_upload_file(BUCKET, path, data, content_type, access_token=access_token)
+    if up.status_code >= 400:
+        raise ValueError(f"cover upload failed ({up.status_code})")
+    return path
+
+
+async def _drop_covers(paths: list[str], sem: asyncio.Semaphore, access_token: str):
+    """Best effort: covers uploaded for rows that were not inserted (no orphans in the bucket)."""
+    async def drop(path: str):
+        async with sem:
+            await sb_delete(f"/storage/v1/object/{BUCKET}/{path}", access_token=access_token)
+
+    await asyncio.gather(*(drop(p) for p in paths), return_exceptions=True)
+
+
+async def _import_batch(
+    batch: list[tuple[int, dict, str]],
+    archive: CoverArchive | None,
+    sem: asyncio.Semaphore,
+    access_token: str,
+) -> list[RowResult]:
+    results: list[RowResult] = []
+
+    existing = await _existing_codes([p["code"] for _, p, _ in batch], access_token)
+    todo = []
+    for line, payload, cover in batch:
+        if payload["code"] in existing:
+            results.append(RowResult(line, payload["code"], payload["title"], "duplicate", "code already exists"))
+        else:
+            todo.append((line, payload, cover))
+
+    # covers first (the rows carry their URL); code -> storage path, to clean up rows that don't make it
+    uploaded: dict[str, str] = {}
+
+    async def with_cover(item):
+        line, payload, cover = item
+        if cover and archive is not None:
+            path = await _upload_cover(archive, cover, sem, access_token)
+            uploaded[payload["code"]] = path
+            payload["image_url"] = storage_public_url(BUCKET, path)
+        return item
+
+    ready = []
+    for item, outcome in zip(todo, await asyncio.gather(*(with_cover(i) for i in todo), return_exceptions=True)):
+        line, payload, _ = item
+        if isinstance(outcome, BaseException):
+            results.append(RowResult(line, payload["code"], payload["title"], "error", str(outcome)))
+        else:
+            ready.append((line, payload))
+
+    if not ready:
+        return results
+
+    now = datetime.now(timezone.utc).isoformat()
+    for _, payload in ready:
+        payload["created_at"] = now
+
+    def outcome(line: int, p: dict, inserted: set[str]) -> RowResult:
+        if p["code"] in inserted:
+            return RowResult(line, p["code"], p["title"], "created")
+        return RowResult(line, p["code"], p["title"], "duplicate", "code already exists")
+
+    # one bulk insert; codes taken meanwhile are skipped by the database (missing from the answer)
+    r = await sb_post(_INSERT_PATH, json=[p for _, p in ready], access_token=access_token, prefer=_INSERT_PREFER)
+    if r.status_code < 400:
+        inserted = {row["code"] for row in r.json()}
+        done = [outcome(line, p, inserted) for line, p in ready]
+    else:
+        # PostgREST rejected the array (one bad row fails it all): per row, so each gets its own result
+        async def one(line: int, p: dict) -> RowResult:
+            async with sem:
+                rr = await sb_post(_INSERT_PATH, json=p, access_token=access_token, prefer=_INSERT_PREFER)
+            if rr.status_code >= 400:
+                return RowResult(line, p["code"], p["title"], "error", f"insert failed ({rr.status_code})")
+            return outcome(line, p, {row["code"] for row in rr.json()})
+
+        done = list(await asyncio.gather(*(one(line, p) for line, p in ready)))
+
+    orphans = [uploaded[res.code] for res in done if res.status != "created" and res.code in uploaded]
+    if orphans:
+        await _drop_covers(orphans, sem, access_token)
+    return results + done
+
+
+async def import_books(csv_file: BinaryIO, covers_file: BinaryIO | None, access_token: str) -> list[RowResult]:
+    """Whole import; results in CSV order. Raises BulkImportError for an unusable file (before any insert)."""
+    await asyncio.to_thread(check_csv, csv_file)
+    archive = CoverArchive(covers_file) if covers_file is not None else None
+    sem = asyncio.Semaphore(COVER_UPLOAD_CONCURRENCY)
+    results: list[RowResult] = []
+    seen: set[str] = set()
+    batch: list[tuple[int, dict, str]] = []
+
+    for line, row in read_csv_rows(csv_file):
+        payload, reason = validate_row(row)
+        if payload is None:
+            results.append(RowResult(line, row.get("code", ""), row.get("title", ""), "invalid", reason))
+            continue
+        if payload["code"] in seen:
+            results.append(RowResult(line, payload["code"], payload["title"], "duplicate", "code repeated in the file"))
+            continue
+        seen.add(payload["code"])
+        batch.append((line, payload, row.get("cover") or ""))
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            results += await _import_batch(batch, archive, sem, access_token)
+            batch = []
+
+    if batch:
+        results += await _import_batch(batch, archive, sem, access_token)
+    results.sort(key=lambda r: r.line)
+    return results
+
+
+# =========================
+# Bulk copies
+# =========================
+def parse_copies_lines(text: str) -> tuple[list[dict], list[RowResult]]:
+    """"code,copies_total" per line -> (RPC updates, invalid lines)."""
+    updates: list[dict] = []
+    invalid: list[RowResult] = []
+    seen: set[str] = set()
+    for line_no, row in enumerate(csv.reader(io.StringIO(text)), start=1):
+        cells = [c.strip() for c in row]
+        if not cells or not any(cells):
+            continue
+        if line_no == 1 and cells[0].lower() == "code":
+            continue  # header
+        if len(cells) < 2 or not cells[0]:
+            invalid.append(RowResult(line_no, cells[0] if cells else "", "", "invalid", "expected code,copies_total"))
+            continue
+        code, raw = cells[0], cells[1]
+        try:
+            copies = int(raw)
+        except ValueError:
+            invalid.append(RowResult(line_no, code, "", "invalid", f"copies_total is not a number: {raw[:20]}"))
+            continue
+        if copies < 1:
+            invalid.append(RowResult(line_no, code, "", "invalid", "copies_total must be >= 1"))
+            continue
+        if code in seen:
+            invalid.append(RowResult(line_no, code, "", "duplicate", "code repeated"))
+            continue
+        seen.add(code)
+        updates.append({"line": line_no, "code": code, "copies_total": copies})
+    return updates, invalid
+
+
+async def bulk_update_copies(updates: list[dict], access_token: str) -> list[RowResult]:
+    """One RPC for every change; per-code status from the database."""
+    if not updates:
+        return []
+    r = await sb_post(
+        "/rest/v1/rpc/bulk_update_copies",
+        json={"p_updates": [{"code": u["code"], "copies_total": u["copies_total"]} for u in updates]},
+        access_token=access_token,
+    )
+    if r.status_code >= 400:
+        return [RowResult(u["line"], u["code"], "", "error", f"update failed ({r.status_code})") for u in updates]
+
+    status = {row["code"]: row["status"] for row in r.json()}
+    return [RowResult(u["line"], u["code"], "", status.get(u["code"], "error")) for u in updates]
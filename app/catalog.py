@@ -0,0 +1,273 @@
+import os
+import time
+import base64
+import asyncio
+import hashlib
+import json
+import tempfile
+import contextvars
+from urllib.parse import urlencode, quote
+
+from app.cache import TTLCache
+from app.search import SearchIndex, search_index
+from app.supabase_client import sb_get, SUPABASE_SERVICE_ROLE_KEY
+
+# books_with_ratings columns used by the pages (no select=*)
+CATALOG_COLUMNS = (
+    "id,title,author,code,description,image_url,image_variants,created_at,"
+    "copies_total,copies_borrowed,available_copies,rating_avg,rating_count"
+)
+
+PAGE_SIZES = (12, 24, 48, 96)
+DEFAULT_PAGE_SIZE = 24
+# ranked search: at most this many matches are fetched (and paged through)
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "192"))
+
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "30"))
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "512"))
+
+# catalog pages are the same for every logged-in user (books are readable by all),
+# so one cache per worker keyed by the PostgREST query path
+catalog_cache = TTLCache(ttl=CATALOG_CACHE_TTL, maxsize=CATALOG_CACHE_SIZE)
+
+
+def parse_page_size(raw: str | None) -> int:
+    try:
+        n = int(raw or DEFAULT_PAGE_SIZE)
+    except ValueError:
+        return DEFAULT_PAGE_SIZE
+    return n if n in PAGE_SIZES else DEFAULT_PAGE_SIZE
+
+
+def encode_cursor(row: dict) -> str:
+    raw = json.dumps([row.get("created_at"), row.get("id")], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(raw: str | None) -> tuple[str, int] | None:
+    """Cursor = last (created_at, id) of the previous page. Bad cursor => first page."""
+    if not raw:
+        return None
+    try:
+        padded = raw + "=" * (-len(raw) % 4)
+        created_at, book_id = json.loads(base64.urlsafe_b64decode(padded))
+        return str(created_at), int(book_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def encode_offset_cursor(offset: int) -> str:
+    """Ranked search results are paged by position, not by (created_at, id)."""
+    return f"o{int(offset)}"
+
+
+def decode_offset_cursor(raw: str | None) -> int:
+    if raw and raw.startswith("o") and raw[1:].isdigit():
+        return min(int(raw[1:]), SEARCH_MAX_RESULTS)
+    return 0
+
+
+def _quote_value(v) -> str:
+    # PostgREST logic trees: double-quote values that may contain , . : ( )
+    s = str(v).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{s}"'
+
+
+def catalog_path(
+    q: str = "",
+    filter_mode: str = "all",
+    after: tuple[str, int] | None = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    book_ids: list[int] | None = None,
+) -> str:
+    """
+    PostgREST query for one catalog page, newest first.
+    - keyset pagination on (created_at, id) instead of offset
+    - search / availability / "mine" filters run in Postgres
+    - asks for limit+1 rows so the caller knows if there is a next page
+    """
+    params: list[tuple[str, str]] = [("select", CATALOG_COLUMNS)]
+    trees: list[str] = []
+
+    term = q.replace("*", "").replace("%", "").strip()
+    if term:
+        like = _quote_value(f"*{term}*")
+        trees.append(f"or(title.ilike.{like},author.ilike.{like},code.ilike.{like})")
+
+    if after:
+        created_at, last_id = after
+        ts = _quote_value(created_at)
+        trees.append(f"or(created_at.lt.{ts},and(created_at.eq.{ts},id.lt.{int(last_id)}))")
+
+    if trees:
+        params.append(("and", f"({','.join(trees)})"))
+
+    if filter_mode == "available":
+        params.append(("available_copies", "gt.0"))
+    elif filter_mode == "reserved":
+        params.append(("available_copies", "eq.0"))
+
+    if book_ids is not None:
+        params.append(("id", f"in.({','.join(str(int(i)) for i in book_ids)})"))
+
+    params.append(("order", "created_at.desc,id.desc"))
+    params.append(("limit", str(int(limit) + 1)))
+
+    return "/rest/v1/books_with_ratings?" + urlencode(params, quote_via=quote, safe=",.()*:")
+
+
+class CatalogError(Exception):
+    pass
+
+
+async def fetch_catalog(path: str, access_token: str | None = None) -> tuple[list[dict], str]:
+    """
+    One catalog page, cached: (rows as returned by PostgREST, version).
+    - version is a digest of the page body (cheap ETag input, computed once per load)
+    - raises CatalogError on upstream errors so failures are never cached
+    - rows are copied so callers can enrich them per user
+    """
+    async def load():
+        r = await sb_get(path, access_token=access_token, hedge=True)
+        if r.status_code >= 400:
+            raise CatalogError(f"{r.status_code} {r.text[:200]}")
+        # good moment to refresh the last-known-good copy (rate limited, in the background)
+        schedule_snapshot_refresh(access_token)
+        return hashlib.blake2b(r.content, digest_size=12).hexdigest(), r.json()
+
+    version, rows = await catalog_cache.get_or_load(path, load)
+    return [dict(row) for row in rows], version
+
+
+def invalidate_catalog():
+    """Call after any write that changes books, copies or ratings."""
+    catalog_cache.invalidate()
+
+
+# =========================
+# Last-known-good snapshot (fallback when Supabase is degraded)
+# =========================
+# the whole catalog, newest first, in memory + a local file (survives restarts);
+# pages are served from it (with a "may be stale" banner) when the live query fails
+CATALOG_SNAPSHOT_PATH = os.getenv("CATALOG_SNAPSHOT_PATH") or os.path.join(
+    tempfile.gettempdir(), "class-library-catalog.json"
+)
+# at most one full refresh per interval (it runs after successful reads)
+CATALOG_SNAPSHOT_REFRESH = float(os.getenv("CATALOG_SNAPSHOT_REFRESH", "300"))
+CATALOG_SNAPSHOT_PAGE = 1000
+
+_snapshot: dict = {"rows": None, "taken_at": None}
+_snapshot_task: asyncio.Task | None = None
+_snapshot_attempt_at = 0.0
+
+
+def load_snapshot():
+    """Startup: read the snapshot file, if any (a missing/corrupt file just means no fallback yet)."""
+    try:
+        with open(CATALOG_SNAPSHOT_PATH, encoding="utf-8") as f:
+            data = json.load(f)
+        _snapshot.update(rows=data["rows"], taken_at=data["taken_at"])
+        search_index.rebuild(data["rows"])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+
+def _write_snapshot_file(rows: list[dict], taken_at: float):
+    tmp = f"{CATALOG_SNAPSHOT_PATH}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"taken_at": taken_at, "rows": rows}, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, CATALOG_SNAPSHOT_PATH)  # readers never see a half-written file
+
+
+async def refresh_snapshot(access_token: str | None = None) -> int:
+    """Page through the whole catalog (keyset); the snapshot is replaced only if every page loaded."""
+    rows: list[dict] = []
+    after = None
+    while True:
+        r = await sb_get(catalog_path(after=after, limit=CATALOG_SNAPSHOT_PAGE), access_token=access_token)
+        if r.status_code >= 400:
+            raise CatalogError(f"{r.status_code} {r.text[:200]}")
+        page = r.json()
+        rows += page[:CATALOG_SNAPSHOT_PAGE]
+        if len(page) <= CATALOG_SNAPSHOT_PAGE:
+            break
+        after = (rows[-1]["created_at"], rows[-1]["id"])
+
+    taken_at = time.time()
+    _snapshot.update(rows=rows, taken_at=taken_at)
+    # the search index is rebuilt from the same rows (built in a thread, swapped in here)
+    search_index.replace_with(await asyncio.to_thread(SearchIndex.build, rows))
+    await asyncio.to_thread(_write_snapshot_file, rows, taken_at)
+    return len(rows)
+
+
+def schedule_snapshot_refresh(access_token: str | None = None, force: bool = False):
+    """force: refresh now (after bulk writes), not after CATALOG_SNAPSHOT_REFRESH."""
+    global _snapshot_task, _snapshot_attempt_at
+    if _snapshot_task is not None and not _snapshot_task.done():
+        return
+    if not force and time.time() - _snapshot_attempt_at < CATALOG_SNAPSHOT_REFRESH:
+        return
+    _snapshot_attempt_at = time.time()
+    # fresh context: not bound by the request's deadline, not counted in its trace
+    _snapshot_task = asyncio.get_running_loop().create_task(
+        _refresh_quietly(access_token), context=contextvars.Context()
+    )
+
+
+async def _refresh_quietly(access_token: str | None):
+    try:
+        await refresh_snapshot(access_token)
+    except Exception:
+        pass  # keep the previous snapshot; next attempt after CATALOG_SNAPSHOT_REFRESH
+
+
+# periodic resync even without traffic (needs the service key: no user token in the background)
+CATALOG_RESYNC_SECONDS = float(os.getenv("CATALOG_RESYNC_SECONDS", "900"))
+
+
+async def resync_loop():
+    """Lifespan task: refresh snapshot + search index every CATALOG_RESYNC_SECONDS."""
+    while True:
+        await _refresh_quietly(SUPABASE_SERVICE_ROLE_KEY)
+        await asyncio.sleep(CATALOG_RESYNC_SECONDS)
+
+
+def snapshot_taken_at() -> float | None:
+    return _snapshot["taken_at"]
+
+
+def snapshot_page(
+    q: str = "",
+    filter_mode: str = "all",
+    after: tuple[str, int] | None = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    book_ids: list[int] | None = None,
+) -> list[dict] | None:
+    """
+    Same page as catalog_path() would return (limit+1 rows), computed from the
+    snapshot. None when there is no snapshot yet.
+    """
+    rows = _snapshot["rows"]
+    if rows is None:
+        return None
+
+    term = q.replace("*", "").replace("%", "").strip().lower()
+    ids = set(book_ids) if book_ids is not None else None
+    out = []
+    for row in rows:
+        if after and (row.get("created_at") or "", row.get("id") or 0) >= after:
+            continue
+        if ids is not None and row.get("id") not in ids:
+            continue
+        available = row.get("available_copies") or 0
+        if filter_mode == "available" and available <= 0:
+            continue
+        if filter_mode == "reserved" and available != 0:
+            continue
+        if term and not any(term in (row.get(k) or "").lower() for k in ("title", "author", "code")):
+            continue
+        out.append(dict(row))
+        if len(out) > limit:
+            break
+    return out
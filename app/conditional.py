@@ -0,0 +1,36 @@
+import hashlib
+
+from fastapi import Request, Response
+
+# private pages: the browser may keep a copy but must revalidate it every time
+PRIVATE_CACHE_CONTROL = "private, no-cache"
+
+
+def weak_etag(*parts) -> str:
+    """W/"..." from cheap version parts (cache versions, small upstream bodies, query...)."""
+    h = hashlib.blake2b(digest_size=12)
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = str(part).encode()
+        h.update(part)
+        h.update(b"\0")
+    return f'W/"{h.hexdigest()}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # weak comparison: W/"x" and "x" are the same
+    wanted = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == wanted for tag in header.split(","))
+
+
+def cache_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": PRIVATE_CACHE_CONTROL, "Vary": "Cookie"}
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag))
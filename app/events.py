@@ -0,0 +1,104 @@
+"""
+Live catalog updates over Server-Sent Events (GET /events/books).
+
+- borrow / return / rate publish the book's new counters (copies, rating)
+- every open /books tab gets them and patches the card in place (app.js)
+- per-process fan-out: each worker pushes the changes it handled itself
+  (other workers' changes show up on the next page load, as before)
+- a short replay buffer: a reconnecting EventSource sends Last-Event-ID
+  and gets what it missed instead of a gap
+- streams end after SSE_MAX_SECONDS; the browser reconnects by itself
+  (bounded connection lifetime: deploys/restarts aren't held up)
+"""
+import os
+import json
+import time
+import asyncio
+from collections import deque
+from typing import AsyncIterator
+
+from app import metrics
+
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+SSE_MAX_SECONDS = float(os.getenv("SSE_MAX_SECONDS", "300"))
+# events kept for reconnecting clients
+SSE_REPLAY = int(os.getenv("SSE_REPLAY", "256"))
+# a client this far behind is dropped (it reconnects and replays / reloads)
+SSE_CLIENT_QUEUE = int(os.getenv("SSE_CLIENT_QUEUE", "64"))
+# reconnect delay suggested to the browser (ms)
+SSE_RETRY_MS = 3000
+
+# public (and identical for every user): no per-user fields in here
+BOOK_EVENT_FIELDS = ("id", "copies_total", "copies_borrowed", "available_copies", "rating_avg", "rating_count")
+
+# ids start at the boot time so a client from a previous process never matches a replay
+_next_id = int(time.time() * 1000)
+_recent: deque[tuple[int, str]] = deque(maxlen=SSE_REPLAY)
+_subscribers: set[asyncio.Queue] = set()
+
+
+def _frame(event_id: int, event: str, data: dict) -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+def publish_book(book: dict):
+    """Send a book's public counters to every subscriber of this worker."""
+    global _next_id
+    _next_id += 1
+    frame = _frame(_next_id, "book", {k: book.get(k) for k in BOOK_EVENT_FIELDS})
+    _recent.append((_next_id, frame))
+    for queue in list(_subscribers):
+        try:
+            queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            # too slow: end its stream (None) so the browser reconnects and replays
+            _subscribers.discard(queue)
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+
+def _replay(last_event_id: str | None) -> list[str]:
+    try:
+        last = int(last_event_id or "")
+    except ValueError:
+        return []
+    if not _recent or last < _recent[0][0] - 1:
+        return []  # unknown / too old: nothing trustworthy to replay
+    return [frame for event_id, frame in _recent if event_id > last]
+
+
+async def book_stream(last_event_id: str | None = None) -> AsyncIterator[str]:
+    """SSE body: replay, then live events + heartbeats until SSE_MAX_SECONDS."""
+    queue: asyncio.Queue = asyncio.Queue(maxsize=SSE_CLIENT_QUEUE)
+    _subscribers.add(queue)
+    deadline = time.monotonic() + SSE_MAX_SECONDS
+    try:
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        for frame in _replay(last_event_id):
+            yield frame
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return
+            try:
+                frame = await asyncio.wait_for(queue.get(), min(SSE_HEARTBEAT_SECONDS, left))
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"  # keeps proxies from closing an idle connection
+                continue
+            if frame is None:
+                return
+            yield frame
+    finally:
+        _subscribers.discard(queue)
+
+
+def _metric_lines() -> list[str]:
+    return [
+        "# HELP app_sse_subscribers Open /events/books streams.",
+        "# TYPE app_sse_subscribers gauge",
+        f"app_sse_subscribers {len(_subscribers)}",
+    ]
+
+
+metrics.register_collector(_metric_lines)
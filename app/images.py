@@ -0,0 +1,230 @@
+"""
+Cover thumbnails: fixed-width WebP + JPEG variants stored next to the original
+in the book-images bucket (thumbs/<name>_w<width>.<ext>).
+
+Backfill existing books:
+    python -m app.images --workers 4
+(needs SUPABASE_SERVICE_ROLE_KEY, or --token <admin access token>)
+"""
+import io
+import os
+import sys
+import asyncio
+import argparse
+import logging
+import tempfile
+from typing import BinaryIO
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # thumbnails are skipped, originals still work
+    Image = None
+
+from app.supabase_client import (
+    get_client, close_client, sb_get, sb_patch, sb_upload_file, storage_public_url,
+    SUPABASE_SERVICE_ROLE_KEY,
+)
+from app.tracing import log_event
+
+BUCKET = "book-images"
+THUMB_WIDTHS = tuple(int(w) for w in os.getenv("THUMB_WIDTHS", "160,320,640").split(","))
+THUMB_QUALITY = int(os.getenv("THUMB_QUALITY", "80"))
+THUMB_UPLOAD_CONCURRENCY = int(os.getenv("THUMB_UPLOAD_CONCURRENCY", "4"))
+
+# variant key -> (content type, Pillow format, extension)
+_FORMATS = {
+    "webp": ("image/webp", "WEBP", "webp"),
+    "jpeg": ("image/jpeg", "JPEG", "jpg"),
+}
+
+# card width in the books grid (see .grid breakpoints in styles.css)
+CARD_SIZES = "(max-width: 520px) 100vw, (max-width: 850px) 50vw, (max-width: 1100px) 33vw, 25vw"
+
+
+def thumbnails_enabled() -> bool:
+    return Image is not None
+
+
+def render_thumbnails(src: BinaryIO, widths: tuple[int, ...] = THUMB_WIDTHS) -> list[tuple[str, int, bytes]]:
+    """
+    Resize one image to every width (never upscaled) in each format.
+    Returns [(format_key, width, bytes)]. CPU-bound: run in a thread.
+    """
+    with Image.open(src) as img:
+        # JPEG: let the decoder downscale while reading (much less memory)
+        img.draft("RGB", (max(widths) * 2, max(widths) * 4))
+        img = ImageOps.exif_transpose(img).convert("RGB")
+
+        out = []
+        done_widths = set()
+        for width in sorted(widths):
+            w = min(width, img.width)
+            if w in done_widths:
+                continue
+            done_widths.add(w)
+            h = max(1, round(img.height * w / img.width))
+            resized = img.resize((w, h), Image.LANCZOS) if w != img.width else img
+            for key, (_, pil_format, _) in _FORMATS.items():
+                buf = io.BytesIO()
+                resized.save(buf, pil_format, quality=THUMB_QUALITY, optimize=True)
+                out.append((key, w, buf.getvalue()))
+        return out
+
+
+def _stem(file_path: str) -> str:
+    return file_path.rsplit("/", 1)[-1].rsplit(".", 1)[0]
+
+
+async def create_thumbnails(src: BinaryIO, file_path: str, access_token: str | None = None) -> dict | None:
+    """
+    Generate + upload the variants of an original stored at BUCKET/file_path.
+    Returns {"webp": {"160": url, ...}, "jpeg": {...}} (stored in books.image_variants),
+    or None when Pillow is missing or the image can't be processed.
+    """
+    if not thumbnails_enabled():
+        return None
+
+    try:
+        rendered = await asyncio.to_thread(render_thumbnails, src)
+    except Exception as e:
+        log_event("thumbnail_error", level=logging.WARNING, path=file_path, error=repr(e))
+        return None
+
+    sem = asyncio.Semaphore(THUMB_UPLOAD_CONCURRENCY)
+    stem = _stem(file_path)
+
+    async def upload(key: str, width: int, data: bytes):
+        content_type, _, ext = _FORMATS[key]
+        path = f"thumbs/{stem}_w{width}.{ext}"
+        async with sem:
+            r = await sb_upload_file(BUCKET, path, data, content_type, access_token=access_token)
+        if r.status_code >= 400:
+            raise RuntimeError(f"{path}: {r.status_code} {r.text[:200]}")
+        return key, width, storage_public_url(BUCKET, path)
+
+    try:
+        uploaded = await asyncio.gather(*(upload(k, w, d) for k, w, d in rendered))
+    except Exception as e:
+        log_event("thumbnail_upload_error", level=logging.WARNING, path=file_path, error=repr(e))
+        return None
+
+    variants: dict = {}
+    for key, width, url in uploaded:
+        variants.setdefault(key, {})[str(width)] = url
+    return variants
+
+
+# =========================
+# Template helpers
+# =========================
+def srcset(variants: dict | None, key: str) -> str:
+    urls = (variants or {}).get(key) or {}
+    return ", ".join(f"{url} {w}w" for w, url in sorted(urls.items(), key=lambda kv: int(kv[0])))
+
+
+def thumb_url(variants: dict | None, min_width: int = 160, key: str = "jpeg") -> str | None:
+    """Smallest variant at least min_width wide (or the largest one)."""
+    urls = (variants or {}).get(key) or {}
+    if not urls:
+        return None
+    widths = sorted(int(w) for w in urls)
+    best = next((w for w in widths if w >= min_width), widths[-1])
+    return urls[str(best)]
+
+
+# =========================
+# Backfill (existing books)
+# =========================
+def _object_path(image_url: str) -> str | None:
+    marker = f"/storage/v1/object/public/{BUCKET}/"
+    return image_url.split(marker, 1)[1] if marker in image_url else None
+
+
+async def _backfill_one(book: dict, access_token: str) -> bool:
+    file_path = _object_path(book["image_url"])
+    if not file_path:
+        return False
+
+    # spool the original to disk past 1 MB so big covers don't sit in memory
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as tmp:
+        async with get_client().stream("GET", book["image_url"]) as r:
+            if r.status_code >= 400:
+                return False
+            async for chunk in r.aiter_bytes():
+                tmp.write(chunk)
+        tmp.seek(0)
+        variants = await create_thumbnails(tmp, file_path, access_token=access_token)
+
+    if not variants:
+        return False
+    pr = await sb_patch(
+        f"/rest/v1/books?id=eq.{book['id']}",
+        json={"image_variants": variants},
+        access_token=access_token,
+    )
+    return pr.status_code < 400
+
+
+async def backfill(access_token: str, workers: int = 4, page_size: int = 100, limit: int | None = None) -> dict:
+    """Thumbnails for every book with an image_url and no image_variants, `workers` at a time."""
+    queue: asyncio.Queue = asyncio.Queue(maxsize=workers * 2)
+    stats = {"ok": 0, "failed": 0}
+
+    async def worker():
+        while True:
+            book = await queue.get()
+            try:
+                ok = await _backfill_one(book, access_token)
+            except Exception as e:
+                log_event("backfill_error", level=logging.WARNING, book_id=book.get("id"), error=repr(e))
+                ok = False
+            stats["ok" if ok else "failed"] += 1
+            queue.task_done()
+
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    try:
+        last_id, seen = 0, 0
+        while limit is None or seen < limit:
+            r = await sb_get(
+                f"/rest/v1/books?select=id,image_url&image_url=not.is.null&image_variants=is.null"
+                f"&id=gt.{last_id}&order=id.asc&limit={page_size}",
+                access_token=access_token,
+            )
+            rows = r.json() if r.status_code < 400 else []
+            if not rows:
+                break
+            for book in rows[: (limit - seen) if limit is not None else None]:
+                await queue.put(book)
+                seen += 1
+            last_id = rows[-1]["id"]
+        await queue.join()
+    finally:
+        for t in tasks:
+            t.cancel()
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate cover thumbnails for existing books.")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--token", default=SUPABASE_SERVICE_ROLE_KEY, help="admin access token or service role key")
+    args = parser.parse_args(argv)
+
+    if not thumbnails_enabled():
+        sys.exit("Pillow is not installed")
+    if not args.token:
+        sys.exit("Set SUPABASE_SERVICE_ROLE_KEY or pass --token")
+
+    async def run():
+        try:
+            return await backfill(args.token, workers=args.workers, limit=args.limit)
+        finally:
+            await close_client()
+
+    stats = asyncio.run(run())
+    print(f"backfill done: ok={stats['ok']} failed={stats['failed']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,511 @@
+"""
+In-process background jobs for side effects the user doesn't wait for
+(profile creation, password-reset mail, cover processing).
+
+- enqueue() writes the job to a local SQLite backlog first, then wakes a worker:
+  a job accepted before a redirect survives a crash/restart of the worker
+- JOBS_WORKERS asyncio workers per process; several uvicorn workers can share
+  the same file (a job is claimed with a lease, expired leases are re-run)
+- failures are retried with exponential backoff up to JOBS_MAX_ATTEMPTS,
+  then kept as "failed" (last error stored) for inspection
+- bearer tokens are never written to the file: a user token passed to
+  enqueue() stays in this process's memory, and the job is only claimed
+  here (or, once this process stopped heartbeating, by another one that runs
+  it with the service key or fails it)
+- depth (re-read every JOBS_STATS_SECONDS) / wait / run time are exported in /metrics
+
+Handlers are plain async functions registered with @job("kind").
+"""
+import os
+import json
+import uuid
+import time
+import random
+import asyncio
+import logging
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime, timezone
+from typing import AsyncIterator, Awaitable, Callable
+from urllib.parse import quote
+
+from app import metrics
+from app.tracing import log_event
+from app.catalog import invalidate_catalog
+from app.search import search_index
+from app.images import BUCKET, create_thumbnails
+from app.uploads import UPLOAD_CHUNK_SIZE
+from app.supabase_client import (
+    sb_get, sb_post, sb_patch, sb_upload_file, storage_public_url,
+    SUPABASE_SERVICE_ROLE_KEY, SUPABASE_UPLOAD_TIMEOUT,
+)
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH") or os.path.join(tempfile.gettempdir(), "class-library-jobs.sqlite3")
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "4"))
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "6"))
+JOBS_RETRY_BASE = float(os.getenv("JOBS_RETRY_BASE", "2"))
+JOBS_RETRY_CAP = float(os.getenv("JOBS_RETRY_CAP", "300"))
+# a claimed job that isn't finished after this is considered lost (crashed worker) and re-run
+JOBS_LEASE_SECONDS = float(os.getenv("JOBS_LEASE_SECONDS", "120"))
+JOBS_TIMEOUT = float(os.getenv("JOBS_TIMEOUT", "60"))
+# cover jobs: the upload alone may take SUPABASE_UPLOAD_TIMEOUT, thumbnails + patch come on top
+JOBS_COVER_TIMEOUT = float(os.getenv("JOBS_COVER_TIMEOUT", str(SUPABASE_UPLOAD_TIMEOUT * 3)))
+# idle workers also look for due retries / jobs from other processes this often
+JOBS_POLL_SECONDS = float(os.getenv("JOBS_POLL_SECONDS", "1"))
+# finished jobs are deleted; failed ones are kept this long
+JOBS_KEEP_FAILED_SECONDS = float(os.getenv("JOBS_KEEP_FAILED_SECONDS", str(7 * 24 * 3600)))
+# backlog depth for /metrics is re-read (off the event loop) this often; old failed jobs pruned every JOBS_PRUNE_SECONDS
+JOBS_STATS_SECONDS = float(os.getenv("JOBS_STATS_SECONDS", "5"))
+JOBS_PRUNE_SECONDS = 600
+# uploaded covers wait here until the cover job has sent them to Storage
+JOBS_SPOOL_DIR = os.getenv("JOBS_SPOOL_DIR") or os.path.join(tempfile.gettempdir(), "class-library-spool")
+
+_handlers: dict[str, Callable[..., Awaitable[None]]] = {}
+# kinds whose handler takes access_token= (injected from memory, never stored)
+_token_kinds: set[str] = set()
+# kind -> cleanup called with the payload when a job ends up "failed"
+_on_fail: dict[str, Callable[..., None]] = {}
+# kind -> attempt timeout, when not JOBS_TIMEOUT
+_timeouts: dict[str, float] = {}
+
+# this process, in jobs.owner / workers.owner
+_OWNER = uuid.uuid4().hex
+# job id -> user access token (this process only)
+_tokens: dict[int, str] = {}
+
+
+def job(kind: str, token: bool = False, on_fail: Callable[..., None] | None = None, timeout: float | None = None):
+    """
+    Register an async handler: @job("profile.ensure") async def ensure_profile(**payload).
+    - token=True: the handler also gets access_token= (the one given to enqueue, or None)
+    - on_fail: sync cleanup run with the payload when the job fails for good
+    - timeout: per-attempt limit instead of JOBS_TIMEOUT
+    """
+    def register(fn):
+        _handlers[kind] = fn
+        if token:
+            _token_kinds.add(kind)
+        if on_fail is not None:
+            _on_fail[kind] = on_fail
+        if timeout is not None:
+            _timeouts[kind] = timeout
+        return fn
+    return register
+
+
+def _lease(kind: str) -> float:
+    """A running attempt keeps its lease for at least twice its timeout (no double runs)."""
+    return max(JOBS_LEASE_SECONDS, 2 * _timeouts.get(kind, JOBS_TIMEOUT))
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying can't help (bad input, 4xx): the job fails right away."""
+
+
+# =========================
+# SQLite backlog
+# =========================
+class _Store:
+    """One connection per process; calls are short and run in a thread (to_thread)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn: sqlite3.Connection | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("pragma journal_mode=wal")
+            conn.execute("pragma synchronous=normal")
+            conn.execute(
+                """
+                create table if not exists jobs (
+                    id integer primary key autoincrement,
+                    kind text not null,
+                    payload text not null,
+                    state text not null default 'pending',  -- pending / running / failed
+                    attempts integer not null default 0,
+                    run_at real not null,
+                    lease_until real,
+                    created_at real not null,
+                    last_error text
+                )
+                """
+            )
+            conn.execute("create index if not exists jobs_due on jobs (state, run_at)")
+            if "owner" not in {c[1] for c in conn.execute("pragma table_info(jobs)")}:
+                conn.execute("alter table jobs add column owner text")
+            # backlogs written before tokens moved to memory
+            conn.execute(
+                "update jobs set payload = json_remove(payload, '$.access_token') "
+                "where json_extract(payload, '$.access_token') is not null"
+            )
+            conn.execute("create table if not exists workers (owner text primary key, seen_at real not null)")
+            self.conn = conn
+        return self.conn
+
+    def add(self, kind: str, payload: dict, run_at: float, owner: str | None) -> int:
+        with self.lock:
+            cur = self._connect().execute(
+                "insert into jobs (kind, payload, run_at, created_at, owner) values (?, ?, ?, ?, ?)",
+                (kind, json.dumps(payload, ensure_ascii=False), run_at, time.time(), owner),
+            )
+            return cur.lastrowid
+
+    def beat(self, owner: str):
+        """This process is alive (its owned jobs stay its own)."""
+        now = time.time()
+        with self.lock:
+            conn = self._connect()
+            conn.execute("insert or replace into workers (owner, seen_at) values (?, ?)", (owner, now))
+            conn.execute("delete from workers where seen_at < ?", (now - JOBS_KEEP_FAILED_SECONDS,))
+
+    def claim(self, owner: str) -> tuple | None:
+        """
+        Next due job (or one whose lease expired), marked running with a fresh lease.
+        Jobs owned by another live process (their token is in its memory) are skipped.
+        """
+        now = time.time()
+        with self.lock:
+            conn = self._connect()
+            conn.execute("begin immediate")
+            try:
+                row = conn.execute(
+                    """
+                    select id, kind, payload, attempts, created_at, owner from jobs
+                    where ((state = 'pending' and run_at <= ?) or (state = 'running' and lease_until < ?))
+                      and (owner is null or owner = ? or not exists (
+                          select 1 from workers w where w.owner = jobs.owner and w.seen_at >= ?))
+                    order by run_at limit 1
+                    """,
+                    (now, now, owner, now - JOBS_LEASE_SECONDS),
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "update jobs set state = 'running', attempts = attempts + 1, lease_until = ? where id = ?",
+                        (now + _lease(row[1]), row[0]),
+                    )
+                conn.execute("commit")
+            except BaseException:
+                conn.execute("rollback")
+                raise
+        if row is None:
+            return None
+        job_id, kind, payload, attempts, created_at, job_owner = row
+        return job_id, kind, payload, attempts + 1, created_at, job_owner
+
+    def done(self, job_id: int):
+        with self.lock:
+            self._connect().execute("delete from jobs where id = ?", (job_id,))
+
+    def retry(self, job_id: int, run_at: float, error: str):
+        with self.lock:
+            self._connect().execute(
+                "update jobs set state = 'pending', run_at = ?, lease_until = null, last_error = ? where id = ?",
+                (run_at, error, job_id),
+            )
+
+    def release(self, job_id: int):
+        """Shutdown: give the job back without counting the attempt."""
+        with self.lock:
+            self._connect().execute(
+                "update jobs set state = 'pending', attempts = max(attempts - 1, 0), lease_until = null where id = ?",
+                (job_id,),
+            )
+
+    def fail(self, job_id: int, error: str):
+        with self.lock:
+            self._connect().execute(
+                "update jobs set state = 'failed', lease_until = null, last_error = ? where id = ?",
+                (error, job_id),
+            )
+
+    def prune(self):
+        with self.lock:
+            self._connect().execute(
+                "delete from jobs where state = 'failed' and run_at < ?", (time.time() - JOBS_KEEP_FAILED_SECONDS,)
+            )
+
+    def counts(self) -> dict[str, int]:
+        with self.lock:
+            return dict(self._connect().execute("select state, count(*) from jobs group by state").fetchall())
+
+
+_store = _Store(JOBS_DB_PATH)
+_wakeup: asyncio.Event | None = None
+_workers: list[asyncio.Task] = []
+# last backlog counts read by _housekeeping (the /metrics scrape never touches SQLite)
+_depth: dict[str, int] = {}
+
+job_wait = metrics.Histogram(
+    "app_job_wait_seconds", "Time from enqueue to start of the (last) attempt.", ("kind",),
+    (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0, 60.0, 300.0, 3600.0))
+job_run = metrics.Histogram(
+    "app_job_run_seconds", "Job attempt duration.", ("kind",), metrics.UPSTREAM_BUCKETS)
+job_outcomes = metrics.Counter("app_jobs_total", "Job attempts by outcome (done / retry / failed).", ("kind", "outcome"))
+enqueue_errors = metrics.Counter("app_job_enqueue_errors_total", "Jobs that couldn't be written to the backlog.", ("kind",))
+
+
+def _depth_lines() -> list[str]:
+    out = ["# HELP app_jobs_backlog Jobs in the local backlog by state.", "# TYPE app_jobs_backlog gauge"]
+    out += [f'app_jobs_backlog{{state="{s}"}} {_depth.get(s, 0)}' for s in ("pending", "running", "failed")]
+    return out
+
+
+metrics.register_metric(job_wait)
+metrics.register_metric(job_run)
+metrics.register_metric(job_outcomes)
+metrics.register_metric(enqueue_errors)
+metrics.register_collector(_depth_lines)
+
+
+async def enqueue(kind: str, payload: dict, delay: float = 0, access_token: str | None = None) -> int:
+    """
+    Persist the job, then wake a worker. Returns the job id.
+    access_token is kept in memory only (and only used without a service key).
+    A failed write is logged + counted (app_job_enqueue_errors_total) and re-raised.
+    """
+    if kind not in _handlers:
+        raise ValueError(f"unknown job kind: {kind}")
+    token = access_token if kind in _token_kinds and not SUPABASE_SERVICE_ROLE_KEY else None
+    try:
+        job_id = await asyncio.to_thread(
+            _store.add, kind, payload, time.time() + delay, _OWNER if token else None
+        )
+    except Exception as e:
+        enqueue_errors.inc(kind)
+        log_event("job_enqueue_error", level=logging.ERROR, kind=kind, error=repr(e))
+        raise
+    if token:
+        _tokens[job_id] = token
+    if _wakeup is not None:
+        _wakeup.set()
+    return job_id
+
+
+def stats() -> dict[str, int]:
+    """Backlog counts as of the last _housekeeping pass (at most JOBS_STATS_SECONDS old)."""
+    return dict(_depth)
+
+
+def _backoff(attempts: int) -> float:
+    return random.uniform(0.5, 1.0) * min(JOBS_RETRY_CAP, JOBS_RETRY_BASE * 2 ** (attempts - 1))
+
+
+async def _run_one(row: tuple):
+    job_id, kind, payload, attempts, created_at, owner = row
+    job_wait.observe(max(time.time() - created_at, 0), kind)
+    handler = _handlers.get(kind)
+    kwargs = json.loads(payload)
+    started = time.perf_counter()
+    try:
+        if handler is None:
+            raise PermanentJobError(f"no handler for {kind}")
+        if kind in _token_kinds:
+            # None for a job adopted from a dead process: its token died with it
+            kwargs["access_token"] = _tokens.get(job_id) if owner == _OWNER else None
+        await asyncio.wait_for(handler(**kwargs), _timeouts.get(kind, JOBS_TIMEOUT))
+    except asyncio.CancelledError:
+        await asyncio.shield(asyncio.to_thread(_store.release, job_id))
+        raise
+    except Exception as e:
+        job_run.observe(time.perf_counter() - started, kind)
+        error = f"{type(e).__name__}: {e}"[:500]
+        if isinstance(e, PermanentJobError) or attempts >= JOBS_MAX_ATTEMPTS:
+            job_outcomes.inc(kind, "failed")
+            log_event("job_failed", level=logging.WARNING, job_id=job_id, kind=kind, attempts=attempts, error=error)
+            _tokens.pop(job_id, None)
+            await asyncio.to_thread(_store.fail, job_id, error)
+            cleanup = _on_fail.get(kind)
+            if cleanup is not None:
+                kwargs.pop("access_token", None)
+                try:
+                    await asyncio.to_thread(cleanup, **kwargs)
+                except Exception as ce:
+                    log_event("job_cleanup_error", level=logging.WARNING, job_id=job_id, kind=kind, error=repr(ce))
+        else:
+            job_outcomes.inc(kind, "retry")
+            await asyncio.to_thread(_store.retry, job_id, time.time() + _backoff(attempts), error)
+        return
+
+    job_run.observe(time.perf_counter() - started, kind)
+    job_outcomes.inc(kind, "done")
+    _tokens.pop(job_id, None)
+    await asyncio.to_thread(_store.done, job_id)
+
+
+async def _worker():
+    while True:
+        try:
+            row = await asyncio.to_thread(_store.claim, _OWNER)
+            if row is not None:
+                await _run_one(row)
+                continue
+        except sqlite3.Error as e:
+            # file locked by another process etc.: the job (if any) is re-run once its lease expires
+            log_event("jobs_worker_error", level=logging.WARNING, error=repr(e))
+            await asyncio.sleep(JOBS_POLL_SECONDS)
+            continue
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), JOBS_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _housekeeping():
+    """Heartbeat, backlog counts and pruning of old failed jobs, in a thread (SQLite may be busy)."""
+    pruned_at = 0.0
+    while True:
+        try:
+            await asyncio.to_thread(_store.beat, _OWNER)
+            if time.monotonic() - pruned_at >= JOBS_PRUNE_SECONDS:
+                await asyncio.to_thread(_store.prune)
+                pruned_at = time.monotonic()
+            counts = await asyncio.to_thread(_store.counts)
+            _depth.clear()
+            _depth.update(counts)
+        except sqlite3.Error as e:
+            log_event("jobs_housekeeping_error", level=logging.WARNING, error=repr(e))
+        await asyncio.sleep(JOBS_STATS_SECONDS)
+
+
+async def start_jobs():
+    """Lifespan: start the workers (jobs left by a previous run are picked up)."""
+    global _wakeup
+    _wakeup = asyncio.Event()
+    await asyncio.to_thread(_store.beat, _OWNER)  # before any claim: our own jobs stay ours
+    _workers[:] = [asyncio.create_task(_worker()) for _ in range(JOBS_WORKERS)]
+    _workers.append(asyncio.create_task(_housekeeping()))
+
+
+async def stop_jobs():
+    for t in _workers:
+        t.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+
+
+# =========================
+# Jobs
+# =========================
+def _token(access_token: str | None) -> str:
+    # a retry can run after the user's token expired: the service key (when set) doesn't
+    token = SUPABASE_SERVICE_ROLE_KEY or access_token
+    if not token:
+        raise PermanentJobError("no token: service key unset and the user token is gone (process restarted)")
+    return token
+
+
+def _check(r, what: str):
+    """5xx / 429 / no response => retry; other 4xx => permanent."""
+    if r.status_code < 400:
+        return
+    message = f"{what}: {r.status_code} {r.text[:200]}"
+    if r.status_code >= 500 or r.status_code == 429:
+        raise RuntimeError(message)
+    raise PermanentJobError(message)
+
+
+@job("profile.ensure", token=True)
+async def ensure_profile(user_id: str, email: str, full_name: str, access_token: str | None = None):
+    """user_profiles row (approved=false) for a user who just signed up / logged in."""
+    token = _token(access_token)
+    r = await sb_get(f"/rest/v1/user_profiles?select=user_id&user_id=eq.{quote(user_id)}&limit=1", access_token=token)
+    _check(r, "profile lookup")
+    if r.json():
+        return
+    r = await sb_post(
+        "/rest/v1/user_profiles",
+        json={
+            "user_id": user_id,
+            "email": email,
+            "full_name": full_name,
+            "is_approved": False,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        },
+        access_token=token,
+    )
+    if r.status_code == 409:
+        return  # created meanwhile (signup + login racing)
+    _check(r, "profile insert")
+
+
+@job("auth.recover")
+async def send_recovery(email: str, redirect_to: str):
+    r = await sb_post("/auth/v1/recover", json={"email": email, "redirect_to": redirect_to})
+    log_event("forgot_password", redirect_to=redirect_to, status=r.status_code)
+    _check(r, "recover")
+
+
+async def spool_upload(body: AsyncIterator[bytes], ext: str) -> str:
+    """Write a validated upload to JOBS_SPOOL_DIR; returns the file path (removed by the job)."""
+    os.makedirs(JOBS_SPOOL_DIR, exist_ok=True)
+    path = os.path.join(JOBS_SPOOL_DIR, f"{uuid.uuid4().hex}.{ext}")
+    f = await asyncio.to_thread(open, path, "wb")
+    try:
+        async for chunk in body:
+            await asyncio.to_thread(f.write, chunk)
+    except BaseException:
+        f.close()
+        os.unlink(path)
+        raise
+    f.close()
+    return path
+
+
+def _drop_spool(spool_path: str, **_):
+    """cover.upload failed for good: the spooled file is of no use any more."""
+    try:
+        os.unlink(spool_path)
+    except FileNotFoundError:
+        pass
+
+
+async def _file_chunks(f) -> AsyncIterator[bytes]:
+    while chunk := await asyncio.to_thread(f.read, UPLOAD_CHUNK_SIZE):
+        yield chunk
+
+
+@job("cover.upload", token=True, on_fail=_drop_spool, timeout=JOBS_COVER_TIMEOUT)
+async def upload_cover(code: str, spool_path: str, content_type: str, access_token: str | None = None):
+    """Spooled cover -> Storage + thumbnails -> books.image_url / image_variants (streamed from the spool file)."""
+    token = _token(access_token)
+    try:
+        f = await asyncio.to_thread(open, spool_path, "rb")
+    except FileNotFoundError:
+        raise PermanentJobError(f"spooled cover missing: {spool_path}")
+
+    # same object name on every attempt (x-upsert): a retry overwrites, no orphans
+    file_path = os.path.basename(spool_path)
+    try:
+        size = os.fstat(f.fileno()).st_size
+        up = await sb_upload_file(BUCKET, file_path, _file_chunks(f), content_type, access_token=token, content_length=size)
+        _check(up, "cover upload")
+        f.seek(0)
+        variants = await create_thumbnails(f, file_path, access_token=token)
+    finally:
+        f.close()
+
+    r = await sb_patch(
+        f"/rest/v1/books?code=eq.{quote(code)}",
+        json={"image_url": storage_public_url(BUCKET, file_path), "image_variants": variants},
+        access_token=token,
+    )
+    _check(r, "cover patch")
+    os.unlink(spool_path)
+
+    invalidate_catalog()
+    # best effort from here: the cover is stored and the spool file gone, a retry would only fail
+    try:
+        nr = await sb_get(
+            f"/rest/v1/books?select=id,title,author,code,created_at,image_url,image_variants&code=eq.{quote(code)}&limit=1",
+            access_token=token,
+        )
+        if nr.status_code < 400 and nr.json():
+            search_index.add(nr.json()[0])
+    except Exception as e:
+        log_event("cover_index_error", level=logging.WARNING, code=code, error=repr(e))
+
@@ -1,31 +1,148 @@
 # app/main.py
 
-import uuid
-import mimetypes
+import os
+import time
+import asyncio
+import contextvars
+import logging
+from urllib.parse import quote, urlencode, parse_qsl
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 
 from fastapi import FastAPI, Request, Form, UploadFile, File
-from fastapi.responses import RedirectResponse, HTMLResponse, PlainTextResponse
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import RedirectResponse, HTMLResponse, PlainTextResponse, JSONResponse, StreamingResponse
 
-from app.auth import set_session_cookie, clear_session_cookie, read_session_cookie
+from app.catalog import (
+    PAGE_SIZES, catalog_path, decode_cursor, encode_cursor, parse_page_size,
+    fetch_catalog, invalidate_catalog, catalog_cache,
+    load_snapshot, snapshot_page, snapshot_taken_at, resync_loop, schedule_snapshot_refresh,
+    SEARCH_MAX_RESULTS, encode_offset_cursor, decode_offset_cursor,
+)
+from app.search import search_index
+from app.auth import (
+    set_session_cookie, clear_session_cookie, read_session_cookie, write_session_cookie,
+    session_cookie_written, ensure_fresh_session,
+)
+from app.cache import TTLCache
+from app.bulk import (
+    BulkImportError, import_books, parse_copies_lines, bulk_update_copies,
+    IMPORT_BATCH_SIZE, IMPORT_SHOW_ROWS, IMPORT_BUDGET_SECONDS,
+)
+from app.uploads import UploadRejected, open_image_upload, UPLOAD_MAX_BYTES
+from app.images import thumb_url
+from app.assets import StaticAssets, PageGZipMiddleware
+from app.templating import templates, warm_templates, fragment_cache, PAGES_VERSION
+from app import metrics
+from app.events import book_stream, publish_book, BOOK_EVENT_FIELDS
+from app.reminders import reminder_loop, reminders_enabled
+from app.analytics import analytics, reconcile_loop
+from app.jobs import enqueue, spool_upload, start_jobs, stop_jobs, stats as job_stats
+from app.admin_lists import (
+    users_path, admin_books_path, parse_admin_page_size, decode_admin_cursor, split_page, admin_page,
+    ADMIN_PAGE_SIZES, ADMIN_LOW_STOCK,
+)
+from app.tracing import start_request, finish_request, server_timing, log_event
+from app.conditional import weak_etag, etag_matches, cache_headers, not_modified
 from app.supabase_client import (
     sb_post, sb_get, sb_patch, sb_delete,
-    sb_upload_file, storage_public_url,
-    SUPABASE_URL, SUPABASE_ANON_KEY,
+    sb_gather,
+    open_client, close_client, set_request_budget, reset_request_budget,
+    SUPABASE_SERVICE_ROLE_KEY,
 )
 
-app = FastAPI()
-app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
-templates = Jinja2Templates(directory="app/templates")
-templates.env.globals["SUPABASE_URL"] = SUPABASE_URL
-templates.env.globals["SUPABASE_ANON_KEY"] = SUPABASE_ANON_KEY
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # one pooled (keep-alive, HTTP/2) Supabase client per worker
+    await open_client()
+    warm_templates()
+    load_snapshot()
+    resync = asyncio.create_task(resync_loop()) if SUPABASE_SERVICE_ROLE_KEY else None
+    # admin analytics: rebuilt from Supabase now and then, kept current by the actions in between
+    reconciler = asyncio.create_task(reconcile_loop()) if SUPABASE_SERVICE_ROLE_KEY else None
+    # background side effects (profiles, reset mails, covers): see app/jobs.py
+    await start_jobs()
+    # due-soon / overdue reminders (one worker leads, see app/reminders.py)
+    reminders = asyncio.create_task(reminder_loop()) if reminders_enabled() else None
+    try:
+        yield
+    finally:
+        for task in (resync, reconciler):
+            if task is not None:
+                task.cancel()
+        if reminders is not None:
+            reminders.cancel()
+        await stop_jobs()
+        await close_client()
+
+
+app = FastAPI(lifespan=lifespan)
+# fingerprinted + precompressed assets (see app/assets.py)
+app.mount("/static", StaticAssets(), name="static")
+# HTML pages (static assets come precompressed; SSE must not sit in a gzip buffer)
+app.add_middleware(PageGZipMiddleware, minimum_size=1024, exclude_prefixes=("/static/", "/events/"))
+
+
+@app.middleware("http")
+async def session_middleware(request: Request, call_next):
+    # refresh an access token that is about to expire (exp read locally) before any Supabase call
+    sess = require_session(request)
+    expired = False
+    if sess:
+        fresh = await ensure_fresh_session(sess)
+        if fresh is None:
+            expired = True
+            request.state.session = {}  # falsy => routes redirect to /login
+
+    response = await call_next(request)
+
+    # a handler/refresh updated the session => re-set the cookie, unless the handler
+    # itself set or cleared it (login/logout: its cookie wins over the refreshed one)
+    sess = getattr(request.state, "session", None)
+    if session_cookie_written(response):
+        pass
+    elif expired:
+        clear_session_cookie(response)
+    elif sess and sess.pop("_dirty", False):
+        write_session_cookie(response, sess)
+    return response
+
+
+# every Supabase call of a request must finish within this (fail fast instead of piling up)
+REQUEST_BUDGET_SECONDS = float(os.getenv("REQUEST_BUDGET_SECONDS", "10"))
+
+
+@app.middleware("http")
+async def tracing_middleware(request: Request, call_next):
+    # outermost: times the session refresh too; every sb_* call lands in this request's trace
+    trace, token = start_request(request.method, request.url.path, request.headers.get("x-request-id"))
+    status, location = 500, None
+    metrics.http_in_flight.inc()
+    budget = set_request_budget(REQUEST_BUDGET_SECONDS)
+    try:
+        response = await call_next(request)
+        status, location = response.status_code, response.headers.get("location")
+    finally:
+        reset_request_budget(budget)
+        metrics.http_in_flight.dec()
+        # route template (/borrow/{book_id}), not the raw path: one series per route in logs/spans/metrics
+        route = getattr(request.scope.get("route"), "path", None)
+        duration_ms = finish_request(trace, token, route or request.url.path, status)
+        if route is None:
+            route = "/static" if request.url.path.startswith("/static/") else "unmatched"
+        metrics.observe_request(request.method, route, status, duration_ms / 1000, location)
+    response.headers["X-Request-ID"] = trace.request_id
+    response.headers["Server-Timing"] = server_timing(trace, duration_ms)
+    return response
 
 
 def require_session(request: Request):
-    return read_session_cookie(request)
+    sess = getattr(request.state, "session", None)
+    if sess is None:
+        # decoded once per request (the session middleware reads it first)
+        sess = read_session_cookie(request)
+        request.state.session = sess
+    return sess
 
 
 # ===== ADMIN (simple by email) =====
@@ -36,14 +153,59 @@ async def is_admin(sess: dict) -> bool:
 
 
 # ✅ approval stored in user_profiles.is_approved
+APPROVAL_CACHE_TTL = float(os.getenv("APPROVAL_CACHE_TTL", "300"))
+APPROVAL_CACHE_SIZE = int(os.getenv("APPROVAL_CACHE_SIZE", "10000"))
+# optional: also carry the flag in the signed session cookie (refreshed lazily)
+APPROVAL_IN_COOKIE = os.getenv("APPROVAL_IN_COOKIE", "0") == "1"
+APPROVAL_COOKIE_TTL = float(os.getenv("APPROVAL_COOKIE_TTL", "600"))
+
+approval_cache = TTLCache(ttl=APPROVAL_CACHE_TTL, maxsize=APPROVAL_CACHE_SIZE)
+# user_id -> time.time() of the last admin (un)approve; cookie flags older than that are ignored
+approval_changes = TTLCache(ttl=APPROVAL_COOKIE_TTL, maxsize=APPROVAL_CACHE_SIZE)
+
+
+class ApprovalLookupError(Exception):
+    pass
+
+
 async def get_my_approval(sess: dict) -> bool:
-    r = await sb_get(
-        f"/rest/v1/user_profiles?select=is_approved&user_id=eq.{sess['user_id']}&limit=1",
-        access_token=sess["access_token"],
-    )
-    if r.status_code >= 400 or not r.json():
+    user_id = sess["user_id"]
+
+    if APPROVAL_IN_COOKIE:
+        checked_at = sess.get("approved_checked_at")
+        changed_at = approval_changes.get(user_id)
+        if (
+            checked_at
+            and time.time() - checked_at < APPROVAL_COOKIE_TTL
+            and (changed_at is None or changed_at < checked_at)
+        ):
+            return bool(sess.get("approved"))
+
+    async def load():
+        r = await sb_get(
+            f"/rest/v1/user_profiles?select=is_approved&user_id=eq.{user_id}&limit=1",
+            access_token=sess["access_token"],
+        )
+        if r.status_code >= 400:
+            raise ApprovalLookupError(r.status_code)
+        rows = r.json()
+        return bool(rows[0].get("is_approved")) if rows else False
+
+    try:
+        approved = await approval_cache.get_or_load(user_id, load)
+    except ApprovalLookupError:
         return False
-    return bool(r.json()[0].get("is_approved"))
+
+    if APPROVAL_IN_COOKIE:
+        sess["approved"] = approved
+        sess["approved_checked_at"] = time.time()
+        sess["_dirty"] = True
+    return approved
+
+
+def invalidate_approval(user_id: str):
+    approval_cache.invalidate(user_id)
+    approval_changes.set(user_id, time.time())
 
 
 # =========================
@@ -92,21 +254,12 @@ async def signup(full_name: str = Form(...), email: str = Form(...), password: s
         session["user"].get("email") or email,
     )
 
-    # ✅ create profile (approved=false) - ignore errors if exists
-    try:
-        await sb_post(
-            "/rest/v1/user_profiles",
-            json={
-                "user_id": session["user"]["id"],
-                "email": session["user"].get("email") or email,
-                "full_name": full_name,
-                "is_approved": False,
-                "created_at": datetime.now(timezone.utc).isoformat(),
-            },
-            access_token=session["access_token"],
-        )
-    except Exception:
-        pass
+    # ✅ create profile (approved=false) in the background: the redirect doesn't wait for it
+    await enqueue("profile.ensure", {
+        "user_id": session["user"]["id"],
+        "email": session["user"].get("email") or email,
+        "full_name": full_name,
+    }, access_token=session["access_token"])
 
     return resp
 
@@ -146,23 +299,12 @@ async def login(email: str = Form(...), password: str = Form(...)):
         data["user"].get("email") or email,
     )
 
-    # ✅ ensure profile exists
-    pr = await sb_get(
-        f"/rest/v1/user_profiles?select=user_id&user_id=eq.{data['user']['id']}&limit=1",
-        access_token=data["access_token"],
-    )
-    if pr.status_code < 400 and not pr.json():
-        await sb_post(
-            "/rest/v1/user_profiles",
-            json={
-                "user_id": data["user"]["id"],
-                "email": data["user"].get("email") or email,
-                "full_name": (data["user"].get("user_metadata") or {}).get("full_name") or "",
-                "is_approved": False,
-                "created_at": datetime.now(timezone.utc).isoformat(),
-            },
-            access_token=data["access_token"],
-        )
+    # ✅ ensure profile exists (background job)
+    await enqueue("profile.ensure", {
+        "user_id": data["user"]["id"],
+        "email": data["user"].get("email") or email,
+        "full_name": (data["user"].get("user_metadata") or {}).get("full_name") or "",
+    }, access_token=data["access_token"])
 
     return resp
 
@@ -203,18 +345,13 @@ async def forgot_send(request: Request, email: str = Form(...)):
     base = str(request.base_url).rstrip("/")
     redirect_url = f"{base}/reset"
 
-    r = await sb_post(
-        "/auth/v1/recover",
-        json={"email": email, "redirect_to": redirect_url},
-    )
-
-    print("FORGOT REDIRECT:", redirect_url)
-    print("FORGOT STATUS:", r.status_code)
-    print("FORGOT BODY:", r.text)
-
-    if r.status_code >= 400:
+    # sent by a background job (retried if Supabase is down); the answer is the same
+    # whether the address exists or not. A job that couldn't be queued (logged + counted
+    # in app_job_enqueue_errors_total by enqueue) => "try again"
+    try:
+        await enqueue("auth.recover", {"email": email, "redirect_to": redirect_url})
+    except Exception:
         return RedirectResponse("/forgot?msg=error", status_code=303)
-
     return RedirectResponse("/forgot?msg=sent", status_code=303)
 
 
@@ -229,38 +366,129 @@ async def reset_page(request: Request):
 # =========================
 # Books (list)
 # =========================
+# ?msg= codes of the /books redirects (also the message of the JSON answers)
+BOOK_MESSAGES = {
+    "no_copies_left": "⚠️ ما بقات حتى نسخة.",
+    "borrowed": "✅ تسلفات نسخة.",
+    "returned": "✅ ترجعات نسخة.",
+    "borrow_error": "❌ وقع مشكل فـ Borrow.",
+    "return_error": "❌ وقع مشكل فـ Return.",
+    "not_your_book": "⚠️ ماشي أنت اللي مسلف هاد الكتاب.",
+    "already_rated": "⚠️ راك قيّمتي هاد الكتاب من قبل.",
+    "rated": "✅ شكراً! تسجّل التقييم ديالك.",
+    "rate_error": "❌ وقع مشكل فالتقييم. عاود جرّب.",
+    "not_admin": "⚠️ ماعندكش صلاحية Admin.",
+    "await_approval": "⏳ خاص Admin يقبل الحساب ديالك باش تولّي تقدر تدير Borrow.",
+}
+
+
 @app.get("/books", response_class=HTMLResponse)
 async def books_page(request: Request):
     sess = require_session(request)
     if not sess:
         return RedirectResponse("/login", status_code=303)
 
-    approved = await get_my_approval(sess)
+    q = (request.query_params.get("q") or "").strip().lower()
+    filter_mode = (request.query_params.get("filter") or "all").strip().lower()
+    page_size = parse_page_size(request.query_params.get("limit"))
+    after = decode_cursor(request.query_params.get("after"))
 
-    # 1) books
-    r = await sb_get(
-        "/rest/v1/books_with_ratings?select=*&order=created_at.desc",
-        access_token=sess["access_token"],
+    ratings_path = f"/rest/v1/ratings?select=book_id,rating&user_id=eq.{sess['user_id']}"
+    # via borrow_history view
+    borrows_path = (
+        f"/rest/v1/borrow_history?select=book_id,due_date,status&user_id=eq.{sess['user_id']}&status=eq.borrowed"
     )
-    books = r.json() if r.status_code < 400 else []
+
+    # search: ranked ids from the local index; the rows themselves come from the live catalog
+    search_ids = search_index.search(q, limit=SEARCH_MAX_RESULTS) if q and search_index.ready() else None
+    if not search_ids:
+        # no hit in the index (e.g. "ventur" inside "Adventure"): the ilike substring query
+        search_ids = None
+
+    def page_query(book_ids: list[int] | None = None) -> tuple[str, list[int] | None]:
+        """(catalog path, ids it is restricted to) for this page."""
+        if search_ids is None:
+            return catalog_path(q, filter_mode, after, page_size, book_ids=book_ids), book_ids
+        wanted = set(book_ids) if book_ids is not None else None
+        ids = search_ids if wanted is None else [i for i in search_ids if i in wanted]
+        return catalog_path("", filter_mode, None, SEARCH_MAX_RESULTS, book_ids=ids), ids
+
+    # 1) approval + books page + my ratings + my active borrows (independent => concurrent)
+    if filter_mode == "mine":
+        # "mine" needs my borrowed ids before the catalog query
+        br = await sb_get(borrows_path, access_token=sess["access_token"])
+        mine_ids = [row["book_id"] for row in br.json()] if br.status_code < 400 else []
+        path, only_ids = page_query(mine_ids)
+    else:
+        path, only_ids = page_query()
+    if only_ids == []:
+        path = None  # nothing can match: no catalog call
+
+    if filter_mode == "mine":
+        approved, page, rr = await sb_gather(
+            get_my_approval(sess),
+            fetch_catalog(path, access_token=sess["access_token"]) if path else None,
+            sb_get(ratings_path, access_token=sess["access_token"]),
+        )
+    else:
+        approved, page, rr, br = await sb_gather(
+            get_my_approval(sess),
+            fetch_catalog(path, access_token=sess["access_token"]) if path else None,
+            sb_get(ratings_path, access_token=sess["access_token"]),
+            sb_get(borrows_path, access_token=sess["access_token"]),
+        )
+    approved = bool(approved)
+    books, catalog_version = page or ([], None)
+
+    # catalog query failed/timed out => last-known-good snapshot (no ETag: never a 304 on stale data)
+    stale_since = None
+    if page is None and path is not None:
+        if search_ids is None:
+            fallback = snapshot_page(q, filter_mode, after, page_size, book_ids=only_ids)
+        else:
+            fallback = snapshot_page("", filter_mode, None, SEARCH_MAX_RESULTS, book_ids=only_ids)
+        if fallback is not None:
+            books = fallback
+            stale_since = datetime.fromtimestamp(snapshot_taken_at(), timezone.utc)
+
+    # ranked search: index order, paged by position
+    offset = 0
+    if search_ids is not None:
+        rank = {book_id: i for i, book_id in enumerate(search_ids)}
+        books.sort(key=lambda b: rank.get(b["id"], len(rank)))
+        offset = decode_offset_cursor(request.query_params.get("after"))
+        books = books[offset:offset + page_size + 1]
+
+    # 304 before any enrichment/rendering when nothing I see has changed
+    etag = None
+    if catalog_version is not None:
+        etag = weak_etag(
+            PAGES_VERSION,
+            request.url.query,
+            sess.get("email"),
+            approved,
+            catalog_version,
+            search_index.version if search_ids is not None else None,
+            rr.content if rr is not None else None,
+            br.content if br is not None else None,
+        )
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+    next_cursor = None
+    if len(books) > page_size:
+        books = books[:page_size]
+        next_cursor = encode_offset_cursor(offset + page_size) if search_ids is not None else encode_cursor(books[-1])
 
     # 2) my ratings
-    rr = await sb_get(
-        f"/rest/v1/ratings?select=book_id,rating&user_id=eq.{sess['user_id']}",
-        access_token=sess["access_token"],
-    )
     rated_map = {}
-    if rr.status_code < 400:
+    if rr is not None and rr.status_code < 400:
         for row in rr.json():
             rated_map[row["book_id"]] = row["rating"]
 
-    # 3) my active borrows (via borrow_history view)
-    br = await sb_get(
-        f"/rest/v1/borrow_history?select=book_id,due_date,status&user_id=eq.{sess['user_id']}&status=eq.borrowed",
-        access_token=sess["access_token"],
-    )
+    # 3) my active borrows
     active_borrows = {}
-    if br.status_code < 400:
+    if br is not None and br.status_code < 400:
         for row in br.json():
             active_borrows[row["book_id"]] = row.get("due_date")
 
@@ -276,47 +504,10 @@ async def books_page(request: Request):
         borrowed = int(b.get("copies_borrowed") or 0)
         b["available_copies"] = max(total - borrowed, 0)
 
-    # 5) msg/search/filter
-    q = (request.query_params.get("q") or "").strip().lower()
-    filter_mode = (request.query_params.get("filter") or "all").strip().lower()
+    # 5) msg
     msg = request.query_params.get("msg")
 
-    message = None
-    if msg == "no_copies_left":
-        message = "⚠️ ما بقات حتى نسخة."
-    elif msg == "borrowed":
-        message = "✅ تسلفات نسخة."
-    elif msg == "returned":
-        message = "✅ ترجعات نسخة."
-    elif msg == "borrow_error":
-        message = "❌ وقع مشكل فـ Borrow."
-    elif msg == "return_error":
-        message = "❌ وقع مشكل فـ Return."
-    elif msg == "not_your_book":
-        message = "⚠️ ماشي أنت اللي مسلف هاد الكتاب."
-    elif msg == "already_rated":
-        message = "⚠️ راك قيّمتي هاد الكتاب من قبل."
-    elif msg == "rated":
-        message = "✅ شكراً! تسجّل التقييم ديالك."
-    elif msg == "rate_error":
-        message = "❌ وقع مشكل فالتقييم. عاود جرّب."
-    elif msg == "not_admin":
-        message = "⚠️ ماعندكش صلاحية Admin."
-    elif msg == "await_approval":
-        message = "⏳ خاص Admin يقبل الحساب ديالك باش تولّي تقدر تدير Borrow."
-
-    if q:
-        def match(book):
-            hay = f"{book.get('title','')} {book.get('author','')} {book.get('code','')}".lower()
-            return q in hay
-        books = [b for b in books if match(b)]
-
-    if filter_mode == "available":
-        books = [b for b in books if b.get("available_copies", 0) > 0]
-    elif filter_mode == "reserved":
-        books = [b for b in books if b.get("available_copies", 0) == 0]
-    elif filter_mode == "mine":
-        books = [b for b in books if b.get("my_borrowed")]
+    message = BOOK_MESSAGES.get(msg)
 
     return templates.TemplateResponse(
         "books.html",
@@ -327,24 +518,167 @@ async def books_page(request: Request):
             "books": books,
             "q": q,
             "filter": filter_mode,
+            "limit": page_size,
+            "page_sizes": PAGE_SIZES,
+            "after": request.query_params.get("after") if (after or offset) else None,
+            "next_cursor": next_cursor,
             "message": message,
             "approved": approved,
+            "stale_since": stale_since,
         },
+        headers=cache_headers(etag) if etag else None,
     )
 
 
+# =========================
+# Search as you type (JSON)
+# =========================
+SUGGEST_LIMIT = int(os.getenv("SUGGEST_LIMIT", "8"))
+
+
+@app.get("/api/books/suggest")
+async def books_suggest(request: Request):
+    """Top matches from the local search index: no Supabase call, a few hundred bytes."""
+    sess = require_session(request)
+    if not sess:
+        return JSONResponse({"error": "login_required"}, status_code=401)
+
+    q = (request.query_params.get("q") or "").strip()[:100]
+    results = []
+    if q:
+        for b in search_index.summaries(search_index.search(q, limit=SUGGEST_LIMIT)):
+            results.append({
+                "id": b["id"],
+                "title": b["title"],
+                "author": b["author"],
+                "code": b["code"],
+                "thumbnail": thumb_url(b.get("image_variants"), min_width=160) or b.get("image_url"),
+            })
+    # same query => same answer for a short while (typing back and forth)
+    return JSONResponse({"q": q, "results": results}, headers={"Cache-Control": "private, max-age=30"})
+
+
 # =========================
 # Borrow / Return (RPC)
 # =========================
+# app.js posts the same forms with Accept: application/json and patches the card
+# from the answer; without JS the routes redirect back to /books as before
+ACTION_STATUS = {
+    "borrowed": 200, "returned": 200, "rated": 200,
+    "await_approval": 403,
+    "no_copies_left": 409, "not_your_book": 409, "already_rated": 409,
+    "borrow_error": 502, "return_error": 502, "rate_error": 502,
+}
+
+
+def wants_json(request: Request) -> bool:
+    return "application/json" in request.headers.get("accept", "")
+
+
+async def _no_call():
+    return None
+
+
+async def book_state(book_id: int, sess: dict, with_borrow: bool = True, with_rating: bool = True) -> dict | None:
+    """One book's live counters + (optionally) my borrow/rating on it (what a card shows)."""
+    token, uid = sess["access_token"], sess["user_id"]
+    br, mine, rated = await sb_gather(
+        sb_get(f"/rest/v1/books_with_ratings?select={','.join(BOOK_EVENT_FIELDS)}&id=eq.{book_id}", access_token=token),
+        sb_get(
+            f"/rest/v1/borrow_history?select=due_date&user_id=eq.{uid}&book_id=eq.{book_id}&status=eq.borrowed&limit=1",
+            access_token=token,
+        ) if with_borrow else _no_call(),
+        sb_get(
+            f"/rest/v1/ratings?select=rating&user_id=eq.{uid}&book_id=eq.{book_id}&limit=1", access_token=token
+        ) if with_rating else _no_call(),
+    )
+    if br is None or br.status_code >= 400 or not br.json():
+        return None
+    book = br.json()[0]
+    total = int(book.get("copies_total") or 1)
+    book["available_copies"] = max(total - int(book.get("copies_borrowed") or 0), 0)
+    borrow = mine.json() if mine is not None and mine.status_code < 400 else []
+    book["my_borrowed"] = bool(borrow)
+    book["my_due_date"] = borrow[0].get("due_date") if borrow else None
+    rating = rated.json() if rated is not None and rated.status_code < 400 else []
+    book["my_rating"] = rating[0]["rating"] if rating else None
+    return book
+
+
+def _after_action(sess: dict, book: dict, msg: str, rating: int | None):
+    """A successful action: its new counters go out on /events/books and into the analytics."""
+    publish_book(book)
+    if msg == "borrowed":
+        analytics.borrowed(sess["user_id"], book)
+    elif msg == "returned":
+        analytics.returned(sess["user_id"], book)
+    elif msg == "rated" and rating:
+        analytics.rated(book, rating)
+
+
+# background publishes of form posts (referenced until done)
+_action_tasks: set[asyncio.Task] = set()
+
+
+async def _publish_later(sess: dict, book_id: int, msg: str, rating: int | None):
+    try:
+        # counters for everyone + my due date (analytics) on a borrow; nothing else is needed
+        book = await book_state(book_id, sess, with_borrow=msg == "borrowed", with_rating=False)
+    except Exception as e:
+        log_event("action_publish_error", level=logging.WARNING, book_id=book_id, error=repr(e))
+        return
+    if book is not None:
+        _after_action(sess, book, msg, rating)
+
+
+async def action_response(
+    request: Request, sess: dict, book_id: int, msg: str, redirect: str, rating: int | None = None
+):
+    """
+    Redirect (form post) or {ok, msg, message, book} (fetch); successes go out on /events/books.
+    - a form post redirects right away: the counters for SSE/analytics are read in the background
+    - a fetch gets the card's fresh state (also on errors, e.g. no_copies_left: the card was stale)
+    """
+    ok = ACTION_STATUS.get(msg) == 200
+    if ok:
+        invalidate_catalog()
+    if not wants_json(request):
+        if ok:
+            # fresh context: not bound by this request's deadline, not counted in its trace
+            task = asyncio.get_running_loop().create_task(
+                _publish_later(dict(sess), book_id, msg, rating), context=contextvars.Context()
+            )
+            _action_tasks.add(task)
+            task.add_done_callback(_action_tasks.discard)
+        return RedirectResponse(redirect, status_code=303)
+
+    book = await book_state(book_id, sess)
+    if ok and book is not None:
+        _after_action(sess, book, msg, rating)
+
+    # no Location header to read the outcome from (see metrics.observe_request)
+    metrics.outcomes.inc(request.scope["route"].path, msg)
+    return JSONResponse(
+        {"ok": ok, "msg": msg, "message": BOOK_MESSAGES.get(msg), "book": book},
+        status_code=ACTION_STATUS.get(msg, 200),
+    )
+
+
+def login_required(request: Request):
+    if wants_json(request):
+        return JSONResponse({"error": "login_required"}, status_code=401)
+    return RedirectResponse("/login", status_code=303)
+
+
 @app.post("/borrow/{book_id}")
 async def borrow_book(request: Request, book_id: int):
     sess = require_session(request)
     if not sess:
-        return RedirectResponse("/login", status_code=303)
+        return login_required(request)
 
     approved = await get_my_approval(sess)
     if not approved:
-        return RedirectResponse("/books?filter=all&msg=await_approval", status_code=303)
+        return await action_response(request, sess, book_id, "await_approval", "/books?filter=all&msg=await_approval")
 
     r = await sb_post(
         "/rest/v1/rpc/borrow_copy",
@@ -352,20 +686,18 @@ async def borrow_book(request: Request, book_id: int):
         access_token=sess["access_token"],
     )
 
+    msg = "borrowed"
     if r.status_code >= 400:
         txt = (r.text or "").lower()
-        if "no_copies_left" in txt:
-            return RedirectResponse("/books?filter=all&msg=no_copies_left", status_code=303)
-        return RedirectResponse("/books?filter=all&msg=borrow_error", status_code=303)
-
-    return RedirectResponse("/books?filter=all&msg=borrowed", status_code=303)
+        msg = "no_copies_left" if "no_copies_left" in txt else "borrow_error"
+    return await action_response(request, sess, book_id, msg, f"/books?filter=all&msg={msg}")
 
 
 @app.post("/return/{book_id}")
 async def return_book(request: Request, book_id: int):
     sess = require_session(request)
     if not sess:
-        return RedirectResponse("/login", status_code=303)
+        return login_required(request)
 
     r = await sb_post(
         "/rest/v1/rpc/return_copy",
@@ -373,13 +705,26 @@ async def return_book(request: Request, book_id: int):
         access_token=sess["access_token"],
     )
 
+    msg = "returned"
     if r.status_code >= 400:
         txt = (r.text or "").lower()
-        if "not_your_book" in txt:
-            return RedirectResponse("/books?filter=all&msg=not_your_book", status_code=303)
-        return RedirectResponse("/books?filter=all&msg=return_error", status_code=303)
+        msg = "not_your_book" if "not_your_book" in txt else "return_error"
+    return await action_response(request, sess, book_id, msg, f"/books?filter=all&msg={msg}")
 
-    return RedirectResponse("/books?filter=all&msg=returned", status_code=303)
+
+# =========================
+# Live updates (SSE)
+# =========================
+@app.get("/events/books")
+async def book_events(request: Request):
+    sess = require_session(request)
+    if not sess:
+        return JSONResponse({"error": "login_required"}, status_code=401)
+    return StreamingResponse(
+        book_stream(request.headers.get("last-event-id")),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # (optional safety) avoid GET calling borrow/return
@@ -407,9 +752,16 @@ async def history_page(request: Request):
     )
     history = r.json() if r.status_code < 400 else []
 
+    etag = None
+    if r.status_code < 400:
+        etag = weak_etag(PAGES_VERSION, request.url.query, sess.get("email"), r.content)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
     return templates.TemplateResponse(
         "history.html",
         {"request": request, "title": "My History", "session": sess, "history": history},
+        headers=cache_headers(etag) if etag else None,
     )
 
 
@@ -420,18 +772,16 @@ async def history_page(request: Request):
 async def rate_book(request: Request, book_id: int, rating: int = Form(...)):
     sess = require_session(request)
     if not sess:
-        return RedirectResponse("/login", status_code=303)
+        return login_required(request)
 
     payload = {"book_id": book_id, "user_id": sess["user_id"], "rating": int(rating)}
     r = await sb_post("/rest/v1/ratings", json=payload, access_token=sess["access_token"])
 
+    msg = "rated"
     if r.status_code >= 400:
         txt = (r.text or "").lower()
-        if "duplicate" in txt or "unique" in txt:
-            return RedirectResponse("/books?msg=already_rated", status_code=303)
-        return RedirectResponse("/books?msg=rate_error", status_code=303)
-
-    return RedirectResponse("/books?msg=rated", status_code=303)
+        msg = "already_rated" if "duplicate" in txt or "unique" in txt else "rate_error"
+    return await action_response(request, sess, book_id, msg, f"/books?msg={msg}", rating=int(rating))
 
 
 # =========================
@@ -449,8 +799,14 @@ async def admin_add_book_page(request: Request):
     message = None
     if msg == "upload_error":
         message = "❌ Upload failed."
+    elif msg == "too_large":
+        message = f"❌ Image too big (max {UPLOAD_MAX_BYTES // (1024 * 1024)} MB)."
+    elif msg == "bad_image":
+        message = "❌ Unsupported image (JPG / PNG / WebP / GIF / AVIF)."
     elif msg == "created":
         message = "✅ Book added."
+    elif msg == "created_cover_pending":
+        message = "✅ Book added (cover is being processed)."
 
     return templates.TemplateResponse(
         "admin_add_book.html",
@@ -477,36 +833,23 @@ async def admin_add_book(
     if not await is_admin(sess):
         return RedirectResponse("/books?filter=all&msg=not_admin", status_code=303)
 
-    image_url = None
-
+    cover = None
     if image and image.filename:
-        ext = (image.filename.rsplit(".", 1)[-1] or "jpg").lower()
-        file_path = f"{uuid.uuid4().hex}.{ext}"
-        data = await image.read()
-
-        guessed_type, _ = mimetypes.guess_type(image.filename)
-        content_type = guessed_type or image.content_type or "image/jpeg"
-
-        up = await sb_upload_file(
-            "book-images",
-            file_path,
-            data,
-            content_type,
-            access_token=sess["access_token"],
-        )
-
-        if up.status_code >= 400:
-            print("UPLOAD ERROR:", up.status_code, up.text)
-            return RedirectResponse("/admin/books/new?msg=upload_error", status_code=303)
-
-        image_url = storage_public_url("book-images", file_path)
+        # validated here (type from magic bytes, size while streaming) and spooled to disk;
+        # the Storage upload + thumbnails run in the cover.upload job
+        try:
+            content_type, ext, body, size = await open_image_upload(image)
+            cover = {"spool_path": await spool_upload(body, ext), "content_type": content_type}
+        except UploadRejected as e:
+            return RedirectResponse(f"/admin/books/new?msg={e.code}", status_code=303)
 
     payload = {
         "title": title,
         "author": author,
         "code": code,
         "description": description,
-        "image_url": image_url,
+        "image_url": None,
+        "image_variants": None,
         "created_at": datetime.now(timezone.utc).isoformat(),
         "copies_total": int(copies_total) if int(copies_total) > 0 else 1,
         "copies_borrowed": 0,
@@ -514,10 +857,114 @@ async def admin_add_book(
 
     ir = await sb_post("/rest/v1/books", json=payload, access_token=sess["access_token"])
     if ir.status_code >= 400:
-        print("INSERT BOOK ERROR:", ir.status_code, ir.text)
+        log_event("insert_book_error", level=logging.WARNING, status=ir.status_code, body=ir.text[:500])
+        if cover:
+            os.unlink(cover["spool_path"])
         return RedirectResponse("/admin/books/new?msg=upload_error", status_code=303)
 
-    return RedirectResponse("/admin/books/new?msg=created", status_code=303)
+    if cover:
+        await enqueue("cover.upload", {"code": code, **cover}, access_token=sess["access_token"])
+
+    invalidate_catalog()
+    # searchable right away (codes are unique); the next resync would catch it anyway
+    nr = await sb_get(
+        f"/rest/v1/books?select=id,title,author,code,created_at,image_url,image_variants&code=eq.{quote(code)}&limit=1",
+        access_token=sess["access_token"],
+    )
+    if nr.status_code < 400 and nr.json():
+        search_index.add(nr.json()[0])
+    return RedirectResponse(f"/admin/books/new?msg={'created_cover_pending' if cover else 'created'}", status_code=303)
+
+
+# =========================
+# Admin - Bulk import / bulk copies
+# =========================
+def _bulk_page(request: Request, sess: dict, *, results=None, kind=None, message=None, copies_text=""):
+    counts: dict[str, int] = {}
+    for r in results or []:
+        counts[r.status] = counts.get(r.status, 0) + 1
+    # only rows that need attention are listed
+    problems = [r for r in results or [] if r.status not in ("created", "updated")]
+    return templates.TemplateResponse(
+        "admin_import.html",
+        {
+            "request": request,
+            "title": "Bulk import",
+            "session": sess,
+            "message": message,
+            "kind": kind,
+            "problems": problems[:IMPORT_SHOW_ROWS],
+            "problems_total": len(problems),
+            "total": len(results or []),
+            "counts": counts,
+            "batch_size": IMPORT_BATCH_SIZE,
+            "copies_text": copies_text,
+        },
+    )
+
+
+@app.get("/admin/books/import", response_class=HTMLResponse)
+async def admin_import_page(request: Request):
+    sess = require_session(request)
+    if not sess:
+        return RedirectResponse("/login", status_code=303)
+    if not await is_admin(sess):
+        return RedirectResponse("/books?filter=all&msg=not_admin", status_code=303)
+
+    # prefilled copies editor: edit the numbers, submit, one RPC applies the changes
+    r = await sb_get("/rest/v1/books?select=code,copies_total&order=code.asc", access_token=sess["access_token"])
+    lines = ["code,copies_total"]
+    if r.status_code < 400:
+        lines += [f"{b['code']},{b.get('copies_total') or 1}" for b in r.json() if b.get("code")]
+    return _bulk_page(request, sess, copies_text="\n".join(lines))
+
+
+@app.post("/admin/books/import", response_class=HTMLResponse)
+async def admin_import_books(
+    request: Request,
+    csv_file: UploadFile = File(...),
+    covers: UploadFile = File(None),
+):
+    sess = require_session(request)
+    if not sess:
+        return RedirectResponse("/login", status_code=303)
+    if not await is_admin(sess):
+        return RedirectResponse("/books?filter=all&msg=not_admin", status_code=303)
+
+    budget = set_request_budget(IMPORT_BUDGET_SECONDS)
+    try:
+        results = await import_books(
+            csv_file.file,
+            covers.file if covers and covers.filename else None,
+            access_token=sess["access_token"],
+        )
+    except BulkImportError as e:
+        return _bulk_page(request, sess, message=f"❌ {e}")
+    finally:
+        reset_request_budget(budget)
+
+    if any(r.status == "created" for r in results):
+        invalidate_catalog()
+        # new books => snapshot + search index now, not at the next periodic refresh
+        schedule_snapshot_refresh(sess["access_token"], force=True)
+    log_event("bulk_import", rows=len(results), created=sum(r.status == "created" for r in results))
+    return _bulk_page(request, sess, results=results, kind="import")
+
+
+@app.post("/admin/books/copies", response_class=HTMLResponse)
+async def admin_bulk_copies(request: Request, updates: str = Form(...)):
+    sess = require_session(request)
+    if not sess:
+        return RedirectResponse("/login", status_code=303)
+    if not await is_admin(sess):
+        return RedirectResponse("/books?filter=all&msg=not_admin", status_code=303)
+
+    changes, invalid = parse_copies_lines(updates)
+    results = await bulk_update_copies(changes, access_token=sess["access_token"])
+    if any(r.status == "updated" for r in results):
+        invalidate_catalog()
+    results = sorted(invalid + results, key=lambda r: r.line)
+    return _bulk_page(request, sess, results=results, kind="copies", copies_text=updates)
 
 
 # =========================
@@ -531,8 +978,19 @@ async def admin_books(request: Request):
     if not await is_admin(sess):
         return RedirectResponse("/books?filter=all&msg=not_admin", status_code=303)
 
-    r = await sb_get("/rest/v1/books?select=*&order=created_at.desc", access_token=sess["access_token"])
-    books = r.json() if r.status_code < 400 else []
+    q = (request.query_params.get("q") or "").strip()
+    low_stock = request.query_params.get("low") == "1"
+    page_size = parse_admin_page_size(request.query_params.get("limit"))
+    after = decode_admin_cursor(request.query_params.get("after"))
+
+    r = await sb_get(admin_books_path(q, low_stock, after, page_size), access_token=sess["access_token"])
+    books, next_cursor = split_page(r.json() if r.status_code < 400 else [], page_size, "id")
+
+    etag = None
+    if r.status_code < 400:
+        etag = weak_etag(PAGES_VERSION, request.url.query, sess.get("email"), r.content)
+        if etag_matches(request, etag):
+            return not_modified(etag)
 
     msg = request.query_params.get("msg")
     message = None
@@ -548,12 +1006,21 @@ async def admin_books(request: Request):
         message = "❌ Update error."
     elif msg == "copies_too_low":
         message = "⚠️ copies_total ما يقدرش يكون أقل من copies_borrowed."
+    elif r.status_code >= 400:
+        message = "❌ Couldn't load books."
 
-    return templates.TemplateResponse(
+    return admin_page(
+        request,
         "admin_books.html",
-        {"request": request, "title": "Admin Books", "session": sess, "books": books, "message": message},
+        {
+            "request": request, "title": "Admin Books", "session": sess, "books": books, "message": message,
+            "q": q, "low": low_stock, "low_stock": ADMIN_LOW_STOCK, "limit": page_size, "page_sizes": ADMIN_PAGE_SIZES,
+            "after": request.query_params.get("after") if after else None, "next_cursor": next_cursor,
+        },
+        headers=cache_headers(etag) if etag else None,
     )
 
+
 @app.get("/admin", response_class=HTMLResponse)
 async def admin_dashboard(request: Request):
     sess = require_session(request)
@@ -562,15 +1029,37 @@ async def admin_dashboard(request: Request):
     if not await is_admin(sess):
         return RedirectResponse("/books?msg=not_admin", status_code=303)
 
+    # precomputed aggregates (app/analytics.py): no Supabase call here; without the
+    # service key they are never reconciled and the page labels them partial
+    stats = analytics.summary()
+    reconciled_at = stats["reconciled_at"]
     return templates.TemplateResponse(
         "admin_dashboard.html",
         {
             "request": request,
             "title": "Admin Dashboard",
             "session": sess,
+            "stats": stats,
+            "reconciled_at": datetime.fromtimestamp(reconciled_at, timezone.utc) if reconciled_at else None,
+            "can_reconcile": bool(SUPABASE_SERVICE_ROLE_KEY),
         },
     )
 
+
+@app.get("/admin/analytics/books.csv")
+async def admin_analytics_csv(request: Request):
+    sess = require_session(request)
+    if not sess:
+        return RedirectResponse("/login", status_code=303)
+    if not await is_admin(sess):
+        return RedirectResponse("/books?msg=not_admin", status_code=303)
+
+    return StreamingResponse(
+        analytics.csv_chunks(),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": 'attachment; filename="books-analytics.csv"', "Cache-Control": "no-store"},
+    )
+
 # =========================
 # Admin - Update copies_total
 # =========================
@@ -603,6 +1092,7 @@ async def admin_update_copies(request: Request, book_id: int, copies_total: int
     if ur.status_code >= 400:
         return RedirectResponse("/admin/books?msg=update_error", status_code=303)
 
+    invalidate_catalog()
     return RedirectResponse("/admin/books?msg=updated", status_code=303)
 
 
@@ -631,6 +1121,8 @@ async def admin_delete_book(request: Request, book_id: int):
     if dr.status_code >= 400:
         return RedirectResponse("/admin/books?msg=delete_error", status_code=303)
 
+    invalidate_catalog()
+    search_index.remove(book_id)
     return RedirectResponse("/admin/books?msg=deleted", status_code=303)
 
 
@@ -645,20 +1137,34 @@ async def admin_users_page(request: Request):
     if not await is_admin(sess):
         return RedirectResponse("/books?filter=all&msg=not_admin", status_code=303)
 
-    r = await sb_get(
-        "/rest/v1/user_profiles?select=*&order=created_at.desc",
-        access_token=sess["access_token"],
-    )
-    users = r.json() if r.status_code < 400 else []
+    q = (request.query_params.get("q") or "").strip()
+    pending = request.query_params.get("pending") == "1"
+    page_size = parse_admin_page_size(request.query_params.get("limit"))
+    after = decode_admin_cursor(request.query_params.get("after"))
 
-    return templates.TemplateResponse(
+    r = await sb_get(users_path(q, pending, after, page_size), access_token=sess["access_token"])
+    users, next_cursor = split_page(r.json() if r.status_code < 400 else [], page_size, "user_id")
+
+    return admin_page(
+        request,
         "admin_users.html",
-        {"request": request, "title": "Users", "session": sess, "users": users},
+        {
+            "request": request, "title": "Users", "session": sess, "users": users,
+            "message": "❌ Couldn't load users." if r.status_code >= 400 else None,
+            "q": q, "pending": pending, "limit": page_size, "page_sizes": ADMIN_PAGE_SIZES,
+            "after": request.query_params.get("after") if after else None, "next_cursor": next_cursor,
+        },
     )
 
 
+def _users_back(back: str) -> str:
+    """Back to the list the admin was on (filters + page), query string only."""
+    query = urlencode([(k, v) for k, v in parse_qsl(back) if k in ("q", "pending", "limit", "after")])
+    return "/admin/users" + (f"?{query}" if query else "")
+
+
 @app.post("/admin/users/{user_id}/approve")
-async def admin_approve_user(request: Request, user_id: str):
+async def admin_approve_user(request: Request, user_id: str, back: str = Form("")):
     sess = require_session(request)
     if not sess:
         return RedirectResponse("/login", status_code=303)
@@ -670,9 +1176,10 @@ async def admin_approve_user(request: Request, user_id: str):
         json={"is_approved": True, "approved_at": datetime.now(timezone.utc).isoformat()},
         access_token=sess["access_token"],
     )
-    return RedirectResponse("/admin/users", status_code=303)
+    invalidate_approval(user_id)
+    return RedirectResponse(_users_back(back), status_code=303)
 @app.post("/admin/users/{user_id}/unapprove")
-async def admin_unapprove_user(request: Request, user_id: str):
+async def admin_unapprove_user(request: Request, user_id: str, back: str = Form("")):
     sess = require_session(request)
     if not sess:
         return RedirectResponse("/login", status_code=303)
@@ -684,7 +1191,8 @@ async def admin_unapprove_user(request: Request, user_id: str):
         json={"is_approved": False, "approved_at": None},
         access_token=sess["access_token"],
     )
-    return RedirectResponse("/admin/users", status_code=303)
+    invalidate_approval(user_id)
+    return RedirectResponse(_users_back(back), status_code=303)
 
 
 # =========================
@@ -705,12 +1213,75 @@ async def about_page(request: Request):
 # =========================
 # Health (UpTimeRobot)
 # =========================
+# optional bearer token for /metrics (the scraper sends Authorization: Bearer <token>)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+metrics.register_cache("catalog", catalog_cache)
+metrics.register_cache("approval", approval_cache)
+metrics.register_cache("fragment", fragment_cache)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint(request: Request):
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        return PlainTextResponse("forbidden", status_code=403)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# liveness: the process answers (no upstream calls)
 @app.get("/healthz", response_class=PlainTextResponse)
 @app.head("/healthz")
 async def healthz():
     return "ok"
 
 
+# readiness: Supabase (PostgREST + Auth) answers; cached so a monitor can't multiply upstream load
+READY_CACHE_TTL = float(os.getenv("READY_CACHE_TTL", "5"))
+READY_TIMEOUT = float(os.getenv("READY_TIMEOUT", "2"))
+READY_SLOW_MS = float(os.getenv("READY_SLOW_MS", "1000"))
+
+ready_cache = TTLCache(ttl=READY_CACHE_TTL, maxsize=1)
+
+
+async def _check(path: str) -> dict:
+    start = time.perf_counter()
+    try:
+        r = await asyncio.wait_for(sb_get(path), READY_TIMEOUT)
+        result = {"ok": r.status_code < 500, "status": r.status_code}
+    except asyncio.TimeoutError:
+        result = {"ok": False, "error": "timeout"}
+    except Exception as e:
+        result = {"ok": False, "error": type(e).__name__}
+    result["ms"] = round((time.perf_counter() - start) * 1000, 1)
+    if result["ok"] and result["ms"] > READY_SLOW_MS:
+        result["slow"] = True
+    return result
+
+
+async def _readiness() -> dict:
+    postgrest, auth = await asyncio.gather(
+        _check("/rest/v1/books?select=id&limit=1"),
+        _check("/auth/v1/health"),
+    )
+    checks = {"postgrest": postgrest, "auth": auth}
+    return {
+        "status": "ok" if all(c["ok"] for c in checks.values()) else "unavailable",
+        "checked_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "checks": checks,
+    }
+
+
+@app.get("/readyz")
+@app.head("/readyz")
+async def readyz():
+    result = await ready_cache.get_or_load("ready", _readiness)
+    return JSONResponse(
+        result,
+        status_code=200 if result["status"] == "ok" else 503,
+        headers={"Cache-Control": "no-store"},
+    )
+
+
 # =========================
 # Debug
 # =========================
@@ -723,6 +1294,18 @@ async def debug_books(request: Request):
     return f"status={r.status_code}\nbody={r.text[:1500]}"
 
 
+@app.get("/debug/cache", response_class=PlainTextResponse)
+async def debug_cache(request: Request):
+    sess = require_session(request)
+    if not sess or not await is_admin(sess):
+        return "NO SESSION (admin only)"
+    lines = []
+    for name, cache in (("catalog", catalog_cache), ("approval", approval_cache), ("fragment", fragment_cache)):
+        lines += [f"{name}.{k}={v}" for k, v in cache.stats().items()]
+    lines += [f"jobs.{state}={n}" for state, n in sorted(job_stats().items())]
+    return "\n".join(lines)
+
+
 @app.get("/debug/last-book", response_class=PlainTextResponse)
 async def debug_last_book(request: Request):
     sess = require_session(request)
@@ -0,0 +1,183 @@
+"""
+Prometheus text-format metrics, hand-rolled (no client library, no locks:
+everything is updated from the event loop, a few dict operations per request).
+
+- app_http_requests_total / app_http_request_duration_seconds  by route template
+- app_http_requests_in_flight
+- app_upstream_request_duration_seconds / app_upstream_errors_total  by Supabase table/RPC
+- app_upstream_circuit_open  per circuit breaker
+- app_cache_*  from TTLCache.stats() (read when /metrics is scraped)
+- app_outcomes_total  from the msg= code of the redirect (borrowed, no_copies_left, ...)
+- app_job*  from app/jobs.py (registered there)
+"""
+import bisect
+import math
+from urllib.parse import urlsplit, parse_qs
+
+from app.cache import TTLCache
+from app.supabase_client import on_upstream_call, endpoint_name, breaker_states
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UPSTREAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...]):
+        self.name, self.help, self.labels = name, help, labels
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for lv, v in sorted(self.values.items()):
+            out.append(f"{self.name}{_labels(self.labels, lv)} {_num(v)}")
+        return out
+
+
+class Gauge(Counter):
+    def dec(self, *label_values, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+    def render(self) -> list[str]:
+        out = super().render()
+        out[1] = f"# TYPE {self.name} gauge"
+        return out
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...], buckets: tuple[float, ...]):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        # label values -> [bucket counts..., +Inf count, sum]
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        row = self.values.get(label_values)
+        if row is None:
+            row = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        # non-cumulative per bucket; made cumulative when rendered
+        row[bisect.bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for lv, row in sorted(self.values.items()):
+            cumulative = 0
+            for bound, n in zip((*self.buckets, math.inf), row):
+                cumulative += n
+                le = "+Inf" if bound == math.inf else _num(bound)
+                out.append(f"{self.name}_bucket{_labels((*self.labels, 'le'), (*lv, le))} {cumulative}")
+            out.append(f"{self.name}_sum{_labels(self.labels, lv)} {_num(row[-1])}")
+            out.append(f"{self.name}_count{_labels(self.labels, lv)} {cumulative}")
+        return out
+
+
+def _num(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(round(v, 6))
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for k, v in zip(names, values):
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{k}="{v}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+# =========================
+# Metrics
+# =========================
+http_requests = Counter(
+    "app_http_requests_total", "HTTP requests by route template and status.", ("method", "route", "status"))
+http_duration = Histogram(
+    "app_http_request_duration_seconds", "HTTP request latency by route template.", ("method", "route"),
+    REQUEST_BUCKETS)
+http_in_flight = Gauge("app_http_requests_in_flight", "HTTP requests being served.", ())
+
+upstream_duration = Histogram(
+    "app_upstream_request_duration_seconds", "Supabase call latency by table/RPC.", ("method", "endpoint"),
+    UPSTREAM_BUCKETS)
+upstream_errors = Counter(
+    "app_upstream_errors_total", "Supabase calls that failed (status 4xx/5xx, or transport = no response).",
+    ("method", "endpoint", "kind"))
+
+outcomes = Counter("app_outcomes_total", "Action outcomes (msg= code of the redirect).", ("route", "outcome"))
+
+_METRICS = [http_requests, http_duration, http_in_flight, upstream_duration, upstream_errors, outcomes]
+
+# name -> TTLCache (read at scrape time)
+_caches: dict[str, TTLCache] = {}
+# functions returning ready-made lines (read at scrape time)
+_collectors: list = []
+
+
+def register_cache(name: str, cache: TTLCache):
+    _caches[name] = cache
+
+
+def register_metric(metric: Counter | Histogram):
+    """Metrics defined in other modules (they import this one, not the other way round)."""
+    _METRICS.append(metric)
+
+
+def register_collector(fn):
+    _collectors.append(fn)
+
+
+@on_upstream_call
+def _observe_upstream(method, path, status, nbytes, started_at, duration):
+    endpoint = endpoint_name(path)
+    upstream_duration.observe(duration, method, endpoint)
+    if status == 0:
+        upstream_errors.inc(method, endpoint, "transport")
+    elif status >= 400:
+        upstream_errors.inc(method, endpoint, f"{status // 100}xx")
+
+
+def observe_request(method: str, route: str, status: int, duration: float, location: str | None = None):
+    http_requests.inc(method, route, str(status))
+    http_duration.observe(duration, method, route)
+    if location and "msg=" in location:
+        msg = parse_qs(urlsplit(location).query).get("msg")
+        if msg:
+            outcomes.inc(route, msg[0][:40])
+
+
+def _cache_lines() -> list[str]:
+    series = {
+        "hits": ("counter", "app_cache_hits_total", "Cache hits."),
+        "misses": ("counter", "app_cache_misses_total", "Cache misses (including expired entries)."),
+        "evictions": ("counter", "app_cache_evictions_total", "Entries evicted by the LRU bound."),
+        "size": ("gauge", "app_cache_entries", "Entries currently cached."),
+        "hit_ratio": ("gauge", "app_cache_hit_ratio", "hits / (hits + misses) since start."),
+    }
+    stats = {name: cache.stats() for name, cache in sorted(_caches.items())}
+    out = []
+    for key, (kind, metric, help) in series.items():
+        out += [f"# HELP {metric} {help}", f"# TYPE {metric} {kind}"]
+        out += [f'{metric}{{cache="{name}"}} {_num(s[key])}' for name, s in stats.items()]
+    return out
+
+
+def _breaker_lines() -> list[str]:
+    out = [
+        "# HELP app_upstream_circuit_open 1 while the endpoint's circuit breaker is open (failing fast).",
+        "# TYPE app_upstream_circuit_open gauge",
+    ]
+    out += [f'app_upstream_circuit_open{{endpoint="{name}"}} {int(is_open)}'
+            for name, is_open in sorted(breaker_states().items())]
+    return out
+
+
+def render() -> str:
+    lines = []
+    for metric in _METRICS:
+        lines += metric.render()
+    lines += _breaker_lines()
+    lines += _cache_lines()
+    for fn in _collectors:
+        lines += fn()
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,313 @@
+"""
+Due-soon / overdue reminders for active borrows.
+
+- runs inside the app: one worker is the leader (flock on REMINDER_LOCK_PATH),
+  the others keep trying, so a dead leader is replaced on the next tick
+- every REMINDER_INTERVAL_SECONDS the leader pages through active borrows by
+  (due_date, id) keyset over one bounded range:
+    now - REMINDER_OVERDUE_MAX_DAYS  <=  due_date  <  now + REMINDER_DUE_SOON_HOURS
+  (the borrow_history due_date index, see the migration); never a full scan
+- one message per user per tick listing their books
+- a local SQLite log records what was sent: re-running a tick, a restart or a
+  new leader never sends the same reminder twice. due_soon is sent once per
+  borrow, overdue again every REMINDER_OVERDUE_REPEAT_DAYS
+- notifiers: "log" (default, JSON log line with ids only: no address, names or
+  titles) or "smtp" (SMTP_HOST..., e.g. a local `python -m aiosmtpd -n -l
+  localhost:1025` stand-in)
+
+Needs SUPABASE_SERVICE_ROLE_KEY: borrow_history is per-user under RLS.
+"""
+import os
+import time
+import asyncio
+import logging
+import smtplib
+import sqlite3
+import tempfile
+import threading
+from email.message import EmailMessage
+from datetime import datetime, timezone, timedelta
+from urllib.parse import urlencode, quote
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, every process runs the scheduler (dev only)
+    fcntl = None
+
+from app.catalog import _quote_value
+from app.tracing import log_event
+from app.supabase_client import sb_get, SUPABASE_SERVICE_ROLE_KEY
+
+REMINDERS_ENABLED = os.getenv("REMINDERS_ENABLED", "1") == "1"
+REMINDER_INTERVAL_SECONDS = float(os.getenv("REMINDER_INTERVAL_SECONDS", "900"))
+REMINDER_DUE_SOON_HOURS = float(os.getenv("REMINDER_DUE_SOON_HOURS", "24"))
+REMINDER_OVERDUE_REPEAT_DAYS = float(os.getenv("REMINDER_OVERDUE_REPEAT_DAYS", "1"))
+# borrows overdue for longer than this are left to the admins (bounds the scanned range)
+REMINDER_OVERDUE_MAX_DAYS = float(os.getenv("REMINDER_OVERDUE_MAX_DAYS", "30"))
+REMINDER_PAGE = int(os.getenv("REMINDER_PAGE", "500"))
+REMINDER_SEND_CONCURRENCY = int(os.getenv("REMINDER_SEND_CONCURRENCY", "4"))
+REMINDER_NOTIFIER = os.getenv("REMINDER_NOTIFIER", "log")
+# point both at a persistent disk in production (tempdir is wiped by redeploys)
+REMINDER_LOCK_PATH = os.getenv("REMINDER_LOCK_PATH") or os.path.join(
+    tempfile.gettempdir(), "class-library-reminders.lock")
+REMINDER_DB_PATH = os.getenv("REMINDER_DB_PATH") or os.path.join(
+    tempfile.gettempdir(), "class-library-reminders.sqlite3")
+
+SMTP_HOST = os.getenv("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "1025"))
+SMTP_USER = os.getenv("SMTP_USER")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "0") == "1"
+SMTP_FROM = os.getenv("SMTP_FROM", "Class Library <library@localhost>")
+
+BORROW_COLUMNS = "id,user_id,book_id,book_title,book_code,due_date"
+
+
+# =========================
+# Notifiers
+# =========================
+# send(to, subject, body, user_id, reminders): reminders = [(book_id, "due_soon" | "overdue"), ...]
+class LogNotifier:
+    """Logs who/what would be reminded, by id (the message itself has personal data)."""
+
+    async def send(self, to: str, subject: str, body: str, user_id: str, reminders: list[tuple[int, str]]):
+        log_event("reminder", user_id=user_id, reminders=[{"book_id": b, "kind": k} for b, k in reminders])
+
+
+class SmtpNotifier:
+    """Plain smtplib in a thread (one connection per message: a few per tick)."""
+
+    async def send(self, to: str, subject: str, body: str, user_id: str, reminders: list[tuple[int, str]]):
+        msg = EmailMessage()
+        msg["From"], msg["To"], msg["Subject"] = SMTP_FROM, to, subject
+        msg.set_content(body)
+        await asyncio.to_thread(self._send, msg)
+
+    @staticmethod
+    def _send(msg: EmailMessage):
+        with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30) as smtp:
+            if SMTP_STARTTLS:
+                smtp.starttls()
+            if SMTP_USER:
+                smtp.login(SMTP_USER, SMTP_PASSWORD or "")
+            smtp.send_message(msg)
+
+
+NOTIFIERS = {"log": LogNotifier, "smtp": SmtpNotifier}
+
+
+# =========================
+# Sent log (idempotency)
+# =========================
+class _SentLog:
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn: sqlite3.Connection | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("pragma journal_mode=wal")
+            conn.execute(
+                """
+                create table if not exists sent (
+                    borrow_id integer not null,
+                    kind text not null,       -- due_soon / overdue
+                    period integer not null,  -- overdue: days late // repeat; due_soon: 0
+                    sent_at real not null,
+                    primary key (borrow_id, kind, period)
+                )
+                """
+            )
+            self.conn = conn
+        return self.conn
+
+    def already_sent(self, keys: list[tuple[int, str, int]]) -> set[tuple[int, str, int]]:
+        with self.lock:
+            conn = self._connect()
+            return {
+                key for key in keys
+                if conn.execute(
+                    "select 1 from sent where borrow_id = ? and kind = ? and period = ?", key
+                ).fetchone()
+            }
+
+    def mark(self, keys: list[tuple[int, str, int]]):
+        now = time.time()
+        with self.lock:
+            self._connect().executemany(
+                "insert or ignore into sent (borrow_id, kind, period, sent_at) values (?, ?, ?, ?)",
+                [(*key, now) for key in keys],
+            )
+
+    def prune(self, older_than: float):
+        with self.lock:
+            self._connect().execute("delete from sent where sent_at < ?", (older_than,))
+
+
+_sent = _SentLog(REMINDER_DB_PATH)
+
+
+# =========================
+# Scan
+# =========================
+def _parse_ts(raw: str | None) -> datetime | None:
+    try:
+        ts = datetime.fromisoformat(raw)
+    except (TypeError, ValueError):
+        return None
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def borrows_path(start: datetime, end: datetime, after: tuple[str, int] | None = None) -> str:
+    """One page of active borrows with start <= due_date < end, ordered by (due_date, id)."""
+    trees = [f"due_date.gte.{_quote_value(start.isoformat())}", f"due_date.lt.{_quote_value(end.isoformat())}"]
+    if after:
+        ts = _quote_value(after[0])
+        trees.append(f"or(due_date.gt.{ts},and(due_date.eq.{ts},id.gt.{int(after[1])}))")
+    params = [
+        ("select", BORROW_COLUMNS),
+        ("status", "eq.borrowed"),
+        ("and", f"({','.join(trees)})"),
+        ("order", "due_date.asc,id.asc"),
+        ("limit", str(REMINDER_PAGE)),
+    ]
+    return "/rest/v1/borrow_history?" + urlencode(params, quote_via=quote, safe=",.()*:")
+
+
+async def _profiles(user_ids: list[str]) -> dict[str, dict]:
+    out: dict[str, dict] = {}
+    for i in range(0, len(user_ids), 100):  # keeps the in.() URL short
+        chunk = ",".join(_quote_value(u) for u in user_ids[i:i + 100])
+        r = await sb_get(
+            f"/rest/v1/user_profiles?select=user_id,email,full_name&user_id=in.({chunk})",
+            access_token=SUPABASE_SERVICE_ROLE_KEY,
+        )
+        if r.status_code >= 400:
+            raise RuntimeError(f"user_profiles: {r.status_code} {r.text[:200]}")
+        out.update((row["user_id"], row) for row in r.json())
+    return out
+
+
+def _classify(row: dict, now: datetime) -> tuple[int, str, int] | None:
+    due = _parse_ts(row.get("due_date"))
+    if due is None:
+        return None
+    if due > now:
+        return int(row["id"]), "due_soon", 0
+    late_days = (now - due) / timedelta(days=1)
+    return int(row["id"]), "overdue", int(late_days // REMINDER_OVERDUE_REPEAT_DAYS)
+
+
+def _message(profile: dict, items: list[tuple[str, dict]], now: datetime) -> tuple[str, str]:
+    overdue = [row for kind, row in items if kind == "overdue"]
+    subject = "📚 Overdue library books" if overdue else "📚 Library books due soon"
+    name = profile.get("full_name")
+    lines = [f"Salam {name}," if name else "Salam,", ""]
+    for kind, row in items:
+        due = _parse_ts(row.get("due_date"))
+        when = due.strftime("%Y-%m-%d %H:%M UTC") if due else "?"
+        label = "OVERDUE since" if kind == "overdue" else "due"
+        lines.append(f"- {row.get('book_title') or row.get('book_code') or row.get('book_id')}: {label} {when}")
+    lines += ["", "Please return them from “My Books” (or to the library desk). Shukran!"]
+    return subject, "\n".join(lines)
+
+
+async def run_once(notifier=None, now: datetime | None = None) -> dict:
+    """One pass over the due range; returns counters (also logged)."""
+    notifier = notifier or NOTIFIERS[REMINDER_NOTIFIER]()
+    now = now or datetime.now(timezone.utc)
+    start = now - timedelta(days=REMINDER_OVERDUE_MAX_DAYS)
+    end = now + timedelta(hours=REMINDER_DUE_SOON_HOURS)
+    stats = {"scanned": 0, "pages": 0, "messages": 0, "reminders": 0, "skipped": 0, "failed": 0}
+    sem = asyncio.Semaphore(REMINDER_SEND_CONCURRENCY)
+
+    async def notify(profile: dict, items: list[tuple[tuple, dict]]):
+        subject, body = _message(profile, [(key[1], row) for key, row in items], now)
+        async with sem:
+            try:
+                await notifier.send(
+                    profile["email"], subject, body,
+                    user_id=profile.get("user_id"), reminders=[(row.get("book_id"), key[1]) for key, row in items],
+                )
+            except Exception as e:
+                stats["failed"] += 1
+                log_event("reminder_error", level=logging.WARNING, user_id=profile.get("user_id"), error=repr(e))
+                return  # not marked: retried next tick
+        await asyncio.to_thread(_sent.mark, [key for key, _ in items])
+        stats["messages"] += 1
+        stats["reminders"] += len(items)
+
+    after = None
+    while True:
+        r = await sb_get(borrows_path(start, end, after), access_token=SUPABASE_SERVICE_ROLE_KEY)
+        if r.status_code >= 400:
+            raise RuntimeError(f"borrow_history: {r.status_code} {r.text[:200]}")
+        rows = r.json()
+        stats["pages"] += 1
+        stats["scanned"] += len(rows)
+
+        keyed = [(key, row) for row in rows if (key := _classify(row, now)) is not None]
+        done = await asyncio.to_thread(_sent.already_sent, [key for key, _ in keyed])
+        by_user: dict[str, list] = {}
+        for key, row in keyed:
+            if key in done:
+                stats["skipped"] += 1
+            else:
+                by_user.setdefault(row["user_id"], []).append((key, row))
+
+        # a user with borrows on two pages gets two messages in that (rare) case
+        profiles = await _profiles(list(by_user))
+        await asyncio.gather(*(
+            notify(profiles[uid], items) for uid, items in by_user.items() if profiles.get(uid, {}).get("email")
+        ))
+
+        if len(rows) < REMINDER_PAGE:
+            break
+        after = (rows[-1]["due_date"], rows[-1]["id"])
+
+    # entries older than anything the range can still match
+    await asyncio.to_thread(_sent.prune, time.time() - (REMINDER_OVERDUE_MAX_DAYS + 7) * 86400)
+    return stats
+
+
+# =========================
+# Scheduler (leader only)
+# =========================
+_lock_file = None
+
+
+def _try_lead() -> bool:
+    """Non-blocking flock; held (file kept open) for the life of the process."""
+    global _lock_file
+    if _lock_file is not None:
+        return True
+    if fcntl is None:
+        return True
+    f = open(REMINDER_LOCK_PATH, "a+")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    _lock_file = f
+    return True
+
+
+async def reminder_loop():
+    """Lifespan task: every worker runs it, only the lock holder scans."""
+    notifier = NOTIFIERS[REMINDER_NOTIFIER]()
+    while True:
+        if await asyncio.to_thread(_try_lead):
+            started = time.perf_counter()
+            try:
+                stats = await run_once(notifier)
+                log_event("reminders", duration_ms=round((time.perf_counter() - started) * 1000, 1), **stats)
+            except Exception as e:
+                log_event("reminders_error", level=logging.WARNING, error=repr(e))
+        await asyncio.sleep(REMINDER_INTERVAL_SECONDS)
+
+
+def reminders_enabled() -> bool:
+    return REMINDERS_ENABLED and bool(SUPABASE_SERVICE_ROLE_KEY)
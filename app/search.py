@@ -0,0 +1,312 @@
+"""
+In-process search index over the catalog (title, author, code).
+- normalization: case, accents (é -> e), Arabic diacritics/tatweel and letter
+  variants (أ إ آ -> ا, ى -> ي, ة -> ه), Arabic-Indic digits
+- exact, prefix (search as you type) and fuzzy (1 typo) matching
+- substrings of the code (part of a call number, like the old ilike search),
+  via a trigram index over the code without separators; other substrings
+  (inside a title/author word) are left to the ilike query /books falls back to
+  when the index has no hit
+- the Arabic definite article is optional on both sides (الرواية ~ رواية)
+- ranked: field weight (code > title > author) x match quality
+- built from the catalog snapshot (app/catalog.py), kept current by the admin routes
+"""
+import bisect
+import heapq
+import re
+import unicodedata
+
+from app.cache import TTLCache
+
+# score per field
+FIELD_WEIGHTS = {"code": 4.0, "title": 3.0, "author": 2.0}
+# score factor per match kind
+EXACT, PREFIX, FUZZY = 1.0, 0.6, 0.35
+# query found inside a code (not at a word start)
+SUBSTRING = 0.5
+# code substrings shorter than this aren't looked up (would match most codes)
+CODE_GRAM = 3
+# a short prefix can match a lot of terms: only the first N (alphabetical) count
+MAX_PREFIX_TERMS = 64
+# tokens shorter than this are matched exactly/by prefix only
+FUZZY_MIN_LEN = 4
+# kept per book for suggestions (no upstream call needed to show a match)
+SUMMARY_FIELDS = ("id", "title", "author", "code", "image_url", "image_variants")
+
+_ARABIC_FOLD = str.maketrans({
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ى": "ي", "ئ": "ي", "ؤ": "و", "ة": "ه",
+    "ـ": None,  # tatweel
+    **{chr(0x0660 + d): str(d) for d in range(10)},  # ٠-٩
+    **{chr(0x06F0 + d): str(d) for d in range(10)},  # ۰-۹
+})
+_NON_WORD = re.compile(r"[^\w]+")
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.casefold())
+    # drops Latin accents and Arabic harakat/hamza marks (all combining marks)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return text.translate(_ARABIC_FOLD)
+
+
+def tokenize(text: str) -> list[str]:
+    return [t for t in _NON_WORD.split(normalize(text or "")) if t and t != "_"]
+
+
+def _deletes(term: str) -> set[str]:
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+def _within_one_edit(a: str, b: str) -> bool:
+    """Levenshtein/transposition distance <= 1."""
+    if a == b:
+        return True
+    la, lb = len(a), len(b)
+    if abs(la - lb) > 1:
+        return False
+    if la == lb:
+        diff = [i for i in range(la) if a[i] != b[i]]
+        if len(diff) == 1:
+            return True
+        return len(diff) == 2 and diff[1] == diff[0] + 1 and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]]
+    if la > lb:
+        a, b = b, a
+    # b is a with one extra char
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    return a[i:] == b[i + 1:]
+
+
+def strip_article(term: str) -> str:
+    """الرواية -> رواية (Arabic definite article); same rule for documents and queries."""
+    return term[2:] if term.startswith("ال") and len(term) > 4 else term
+
+
+def compact_code(code: str) -> str:
+    """QA-76.9 -> qa769: substring matching ignores separators."""
+    return "".join(tokenize(code))
+
+
+def _grams(text: str) -> set[str]:
+    return {text[i:i + CODE_GRAM] for i in range(len(text) - CODE_GRAM + 1)}
+
+
+def _summary(row: dict) -> dict:
+    return {k: row.get(k) for k in SUMMARY_FIELDS}
+
+
+class SearchIndex:
+    def __init__(self):
+        self._postings: dict[str, dict[int, float]] = {}  # term -> {book id: field weight}
+        self._terms: list[str] = []  # sorted vocabulary (prefix lookups)
+        self._deletes: dict[str, set[str]] = {}  # one-char deletion -> terms (fuzzy lookups)
+        self._docs: dict[int, tuple[set[str], str, dict]] = {}  # book id -> (terms, created_at, summary)
+        self._codes: dict[int, str] = {}  # book id -> compact code
+        self._code_grams: dict[str, set[int]] = {}  # code trigram -> book ids
+        self.version = 0  # bumped on every change (part of search page ETags)
+        # (version, query, limit) -> ids: repeated queries (popular terms, typing) skip scoring
+        self._results = TTLCache(ttl=600, maxsize=2048)
+
+    def __len__(self):
+        return len(self._docs)
+
+    def ready(self) -> bool:
+        return bool(self._docs)
+
+    # ---------- building ----------
+    @staticmethod
+    def _doc_terms(row: dict) -> dict[str, float]:
+        weights: dict[str, float] = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for term in tokenize(str(row.get(field) or "")):
+                # الرواية is also found as رواية (Arabic definite article)
+                for t in {term, strip_article(term)}:
+                    weights[t] = max(weights.get(t, 0.0), weight)
+        return weights
+
+    def _add_term(self, term: str):
+        bisect.insort(self._terms, term)
+        if len(term) >= FUZZY_MIN_LEN:
+            for d in _deletes(term):
+                self._deletes.setdefault(d, set()).add(term)
+
+    def _drop_term(self, term: str):
+        i = bisect.bisect_left(self._terms, term)
+        if i < len(self._terms) and self._terms[i] == term:
+            del self._terms[i]
+        if len(term) >= FUZZY_MIN_LEN:
+            for d in _deletes(term):
+                bucket = self._deletes.get(d)
+                if bucket is not None:
+                    bucket.discard(term)
+                    if not bucket:
+                        del self._deletes[d]
+
+    def add(self, row: dict):
+        """Insert or replace one book (id, title, author, code, created_at, image fields)."""
+        book_id = int(row["id"])
+        self.remove(book_id)
+        terms = self._doc_terms(row)
+        for term, weight in terms.items():
+            posting = self._postings.get(term)
+            if posting is None:
+                posting = self._postings[term] = {}
+                self._add_term(term)
+            posting[book_id] = weight
+        self._docs[book_id] = (set(terms), str(row.get("created_at") or ""), _summary(row))
+        self._add_code(book_id, row)
+        self.version += 1
+
+    def _add_code(self, book_id: int, row: dict):
+        code = compact_code(str(row.get("code") or ""))
+        if code:
+            self._codes[book_id] = code
+            for gram in _grams(code):
+                self._code_grams.setdefault(gram, set()).add(book_id)
+
+    def remove(self, book_id: int):
+        code = self._codes.pop(int(book_id), None)
+        for gram in _grams(code or ""):
+            bucket = self._code_grams.get(gram)
+            if bucket is not None:
+                bucket.discard(int(book_id))
+                if not bucket:
+                    del self._code_grams[gram]
+        doc = self._docs.pop(int(book_id), None)
+        if doc is None:
+            return
+        for term in doc[0]:
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(int(book_id), None)
+            if not posting:
+                del self._postings[term]
+                self._drop_term(term)
+        self.version += 1
+
+    @classmethod
+    def build(cls, rows: list[dict]) -> "SearchIndex":
+        """A new index over rows (safe to run in a thread: touches nothing shared)."""
+        index = cls()
+        for row in rows:
+            book_id = int(row["id"])
+            terms = cls._doc_terms(row)
+            for term, weight in terms.items():
+                index._postings.setdefault(term, {})[book_id] = weight
+            index._docs[book_id] = (set(terms), str(row.get("created_at") or ""), _summary(row))
+            index._add_code(book_id, row)
+        index._terms = sorted(index._postings)
+        for term in index._terms:
+            if len(term) >= FUZZY_MIN_LEN:
+                for d in _deletes(term):
+                    index._deletes.setdefault(d, set()).add(term)
+        return index
+
+    def replace_with(self, other: "SearchIndex"):
+        """Swap in a built index (call from the event loop: no await in between => atomic for requests)."""
+        self._postings, self._terms, self._deletes, self._docs, self._codes, self._code_grams = (
+            other._postings, other._terms, other._deletes, other._docs, other._codes, other._code_grams
+        )
+        self.version += 1
+
+    def rebuild(self, rows: list[dict]):
+        self.replace_with(SearchIndex.build(rows))
+
+    # ---------- querying ----------
+    def summaries(self, ids: list[int]) -> list[dict]:
+        docs = self._docs
+        return [docs[i][2] for i in ids if i in docs]
+
+    def _expand(self, token: str) -> dict[str, float]:
+        """token -> {index term: match factor}; a query الرواية also matches a title رواية"""
+        bare = strip_article(token)
+        if bare != token:
+            matches = self._expand(bare)
+            for term, factor in self._expand_one(token).items():
+                matches[term] = max(matches.get(term, 0.0), factor)
+            return matches
+        return self._expand_one(token)
+
+    def _expand_one(self, token: str) -> dict[str, float]:
+        matches: dict[str, float] = {}
+        if token in self._postings:
+            matches[token] = EXACT
+
+        i = bisect.bisect_left(self._terms, token)
+        for term in self._terms[i:i + MAX_PREFIX_TERMS + 1]:
+            if not term.startswith(token):
+                break
+            matches.setdefault(term, PREFIX)
+
+        if len(token) >= FUZZY_MIN_LEN:
+            candidates = set(self._deletes.get(token, ()))
+            for d in _deletes(token):
+                if d in self._postings:
+                    candidates.add(d)
+                candidates |= self._deletes.get(d, set())
+            for term in candidates:
+                if term not in matches and _within_one_edit(token, term):
+                    matches[term] = FUZZY
+        return matches
+
+    def search(self, query: str, limit: int = 200) -> list[int]:
+        """Book ids matching every query word, best first (ties: newest first)."""
+        key = (self.version, query, limit)
+        ids = self._results.get(key)
+        if ids is None:
+            ids = self._search(query, limit)
+            self._results.set(key, ids)
+        return list(ids)
+
+    def _code_matches(self, query: str) -> set[int]:
+        """Books whose code contains the query (separators ignored)."""
+        needle = compact_code(query)
+        if len(needle) < CODE_GRAM:
+            return set()
+        buckets = sorted((self._code_grams.get(g, set()) for g in _grams(needle)), key=len)
+        if not buckets[0]:
+            return set()
+        candidates = set.intersection(*buckets)
+        return {b for b in candidates if needle in self._codes.get(b, "")}
+
+    def _search(self, query: str, limit: int) -> list[int]:
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+
+        scores = self._token_scores(tokens)
+        # a piece of a code: ranked like one matching word in the code field
+        in_code = FIELD_WEIGHTS["code"] * SUBSTRING * len(tokens)
+        for book_id in self._code_matches(query):
+            if in_code > scores.get(book_id, 0.0):
+                scores[book_id] = in_code
+        if not scores:
+            return []
+
+        docs = self._docs
+        return heapq.nlargest(limit, scores, key=lambda b: (scores[b], docs[b][1] if b in docs else "", b))
+
+    def _token_scores(self, tokens: list[str]) -> dict[int, float]:
+        """Books matching every token: summed best field weight x match factor."""
+        scores: dict[int, float] | None = None
+        for token in tokens:
+            token_scores: dict[int, float] = {}
+            for term, factor in self._expand(token).items():
+                for book_id, weight in self._postings.get(term, {}).items():
+                    s = weight * factor
+                    if s > token_scores.get(book_id, 0.0):
+                        token_scores[book_id] = s
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {b: scores[b] + s for b, s in token_scores.items() if b in scores}
+            if not scores:
+                return {}
+        return scores or {}
+
+
+# one per worker
+search_index = SearchIndex()
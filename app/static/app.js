@@ -190,12 +190,243 @@ function initRatings() {
   );
 }
 
+/* =========================
+   Search as you type (/api/books/suggest)
+========================= */
+function initSuggest() {
+  const wrap = document.querySelector("[data-suggest]");
+  if (!wrap) return;
+  const input = wrap.querySelector("[data-suggest-input]");
+  const list = wrap.querySelector("[data-suggest-list]");
+  if (!input || !list) return;
+
+  let timer = null;
+  let controller = null;
+  let active = -1;
+
+  function close() {
+    list.hidden = true;
+    list.replaceChildren();
+    active = -1;
+  }
+
+  function go(item) {
+    // code is unique => the search page shows that book first
+    window.location.href = `/books?q=${encodeURIComponent(item.code || item.title)}`;
+  }
+
+  function highlight(i) {
+    const items = list.querySelectorAll("li");
+    items.forEach((li, k) => li.classList.toggle("active", k === i));
+    active = i;
+  }
+
+  function render(results) {
+    list.replaceChildren();
+    if (!results.length) return close();
+
+    results.forEach((item, i) => {
+      const li = document.createElement("li");
+      li.setAttribute("role", "option");
+
+      const img = document.createElement("img");
+      img.alt = "";
+      img.loading = "lazy";
+      if (item.thumbnail) img.src = item.thumbnail;
+      else img.style.visibility = "hidden";
+
+      const text = document.createElement("div");
+      const title = document.createElement("b");
+      title.textContent = item.title || "";
+      const meta = document.createElement("div");
+      meta.className = "small";
+      meta.textContent = [item.author, item.code].filter(Boolean).join(" · ");
+      text.append(title, meta);
+
+      li.append(img, text);
+      li.addEventListener("mousedown", (e) => {
+        e.preventDefault(); // keep focus, no blur before the click
+        go(item);
+      });
+      li.addEventListener("mouseenter", () => highlight(i));
+      list.appendChild(li);
+    });
+    list.hidden = false;
+    active = -1;
+  }
+
+  async function fetchSuggestions(q) {
+    if (controller) controller.abort(); // only the latest keystroke matters
+    controller = new AbortController();
+    try {
+      const r = await fetch(`/api/books/suggest?q=${encodeURIComponent(q)}`, {
+        signal: controller.signal,
+        headers: { Accept: "application/json" },
+      });
+      if (!r.ok) return close();
+      const data = await r.json();
+      if (input.value.trim() === data.q) render(data.results || []);
+    } catch (e) {
+      if (e.name !== "AbortError") close();
+    }
+  }
+
+  input.addEventListener("input", () => {
+    clearTimeout(timer);
+    const q = input.value.trim();
+    if (q.length < 2) {
+      if (controller) controller.abort();
+      return close();
+    }
+    timer = setTimeout(() => fetchSuggestions(q), 200);
+  });
+
+  input.addEventListener("keydown", (e) => {
+    const items = list.querySelectorAll("li");
+    if (list.hidden || !items.length) return;
+    if (e.key === "ArrowDown") {
+      e.preventDefault();
+      highlight((active + 1) % items.length);
+    } else if (e.key === "ArrowUp") {
+      e.preventDefault();
+      highlight((active - 1 + items.length) % items.length);
+    } else if (e.key === "Enter" && active >= 0) {
+      e.preventDefault();
+      items[active].dispatchEvent(new MouseEvent("mousedown"));
+    } else if (e.key === "Escape") {
+      close();
+    }
+  });
+
+  input.addEventListener("blur", () => setTimeout(close, 100));
+}
+
+/* =========================
+   Live cards: borrow / return / rate without a page reload,
+   + counters pushed by other users' actions (/events/books)
+========================= */
+function showFlash(text) {
+  if (!text) return;
+  const main = document.querySelector("main");
+  if (!main) return;
+  let flash = main.querySelector(":scope > .flash:not(.flash-stale)");
+  if (!flash) {
+    flash = document.createElement("div");
+    flash.className = "flash";
+    main.prepend(flash);
+  }
+  flash.textContent = text;
+}
+
+function patchCard(book, mine) {
+  const card = document.querySelector(`[data-book-id="${book.id}"]`);
+  if (!card) return;
+
+  const total = Number(book.copies_total || 1);
+  const available = Number(book.available_copies ?? total - Number(book.copies_borrowed || 0));
+  const set = (sel, text) => card.querySelectorAll(sel).forEach((el) => (el.textContent = text));
+  set("[data-copies-total]", String(total));
+  set("[data-available]", String(available));
+
+  const avg = Number(book.rating_avg || 0);
+  set("[data-rating-text]", `${avg.toFixed(1)} (${Number(book.rating_count || 0)})`);
+  card.querySelectorAll("[data-rating-stars] .st").forEach((st, i) => st.classList.toggle("on", i + 1 <= Math.floor(avg)));
+
+  const status = card.querySelector("[data-book-status]");
+  if (!status) return;
+  const current = status.querySelector("[data-state]:not([hidden])");
+  let state = current ? current.getAttribute("data-state") : null;
+
+  if (mine) {
+    // my own action: the answer says whether I hold a copy now
+    if (book.my_borrowed) {
+      state = "mine";
+      const due = book.my_due_date || "";
+      status.querySelectorAll("[data-date]").forEach((el) => el.setAttribute("data-date", due));
+      status.querySelectorAll("[data-due]").forEach((el) => el.setAttribute("data-due", due));
+      const dueLine = status.querySelector("[data-due-line]");
+      if (dueLine) dueLine.hidden = !due;
+      updateDates();
+      updateCountdowns();
+    } else if (state === "mine") {
+      state = status.querySelector('[data-state="pending"]') ? "pending" : "available";
+    }
+  }
+  // someone else's change only moves available <-> full
+  if (state === "available" || state === "full") state = available > 0 ? "available" : "full";
+
+  status.querySelectorAll("[data-state]").forEach((el) => {
+    el.hidden = el.getAttribute("data-state") !== state;
+  });
+
+  if (mine && book.my_rating) {
+    const wrap = card.querySelector("[data-rate-wrap]");
+    if (wrap && wrap.querySelector("[data-rate-open]")) {
+      const btn = document.createElement("button");
+      btn.type = "button";
+      btn.className = "rate-btn";
+      btn.disabled = true;
+      btn.title = "You already rated this book";
+      btn.textContent = `⭐ Rated (${book.my_rating}/5)`;
+      wrap.replaceChildren(btn);
+    }
+  }
+}
+
+function initLiveBooks() {
+  if (!document.querySelector("[data-book-id]")) return;
+
+  document.addEventListener("submit", async (e) => {
+    const form = e.target.closest("[data-book-action]");
+    if (!form || !window.fetch) return;
+    e.preventDefault();
+
+    const buttons = form.querySelectorAll("button");
+    buttons.forEach((b) => (b.disabled = true));
+    try {
+      const r = await fetch(form.action, {
+        method: "POST",
+        body: new FormData(form),
+        headers: { Accept: "application/json" },
+      });
+      if (r.status === 401) {
+        window.location.href = "/login";
+        return;
+      }
+      const data = await r.json();
+      if (data.book) patchCard(data.book, true);
+      showFlash(data.message);
+    } catch (err) {
+      form.submit(); // no JSON (network / proxy error): the plain form post still works
+      return;
+    } finally {
+      buttons.forEach((b) => (b.disabled = false));
+    }
+    const pop = form.closest("[data-rate-pop]");
+    if (pop) pop.hidden = true;
+  });
+
+  if (!window.EventSource) return;
+  const source = new EventSource("/events/books");
+  source.addEventListener("book", (e) => {
+    try {
+      patchCard(JSON.parse(e.data), false);
+    } catch (err) {
+      console.warn("bad book event", err);
+    }
+  });
+  // leaving the page: free the connection right away
+  window.addEventListener("pagehide", () => source.close());
+}
+
 /* =========================
    Boot
 ========================= */
 document.addEventListener("DOMContentLoaded", () => {
   initMobileMenu();
   initRatings();
+  initSuggest();
+  initLiveBooks();
   updateDates();
   updateCountdowns();
 
@@ -1,4 +1,10 @@
 import os
+import time
+import random
+import asyncio
+from collections import deque
+from contextvars import ContextVar
+from typing import AsyncIterable, Callable
 from dotenv import load_dotenv
 import httpx
 
@@ -7,10 +13,73 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL", "").rstrip("/")
 SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY", "")
 SECRET_KEY = os.getenv("SECRET_KEY", "dev-secret")
+# optional: only for maintenance jobs/scripts that act on all rows (never sent to browsers)
+SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
 
 if not SUPABASE_URL or not SUPABASE_ANON_KEY:
     raise RuntimeError("Missing SUPABASE_URL or SUPABASE_ANON_KEY in .env")
 
+# HTTP client tuning (one pooled client per worker)
+SUPABASE_HTTP2 = os.getenv("SUPABASE_HTTP2", "1") == "1"
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "30"))
+SUPABASE_CONNECT_TIMEOUT = float(os.getenv("SUPABASE_CONNECT_TIMEOUT", "5"))
+SUPABASE_UPLOAD_TIMEOUT = float(os.getenv("SUPABASE_UPLOAD_TIMEOUT", "60"))
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "100"))
+SUPABASE_MAX_KEEPALIVE = int(os.getenv("SUPABASE_MAX_KEEPALIVE", "20"))
+SUPABASE_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", "30"))
+SUPABASE_FANOUT_TIMEOUT = float(os.getenv("SUPABASE_FANOUT_TIMEOUT", "10"))
+
+# resilience (see _send)
+SUPABASE_GET_RETRIES = int(os.getenv("SUPABASE_GET_RETRIES", "2"))
+SUPABASE_RETRY_BASE = float(os.getenv("SUPABASE_RETRY_BASE", "0.1"))
+SUPABASE_RETRY_CAP = float(os.getenv("SUPABASE_RETRY_CAP", "1.0"))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "10"))
+# hedged reads (off by default: a hedge is extra load): a second identical GET if the
+# first hasn't answered after max(SUPABASE_HEDGE_AFTER, the endpoint's recent p95)
+SUPABASE_HEDGE_AFTER = float(os.getenv("SUPABASE_HEDGE_AFTER", "0"))
+# successful GETs per endpoint the p95 is taken from (no hedging before SUPABASE_HEDGE_MIN_SAMPLES)
+SUPABASE_HEDGE_WINDOW = 200
+SUPABASE_HEDGE_MIN_SAMPLES = 20
+
+_client: httpx.AsyncClient | None = None
+
+
+def _build_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=SUPABASE_URL,
+        http2=SUPABASE_HTTP2,
+        timeout=httpx.Timeout(SUPABASE_TIMEOUT, connect=SUPABASE_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=SUPABASE_MAX_CONNECTIONS,
+            max_keepalive_connections=SUPABASE_MAX_KEEPALIVE,
+            keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Shared keep-alive client for every Supabase call.
+    - opened by the app lifespan (open_client)
+    - created lazily if a helper runs outside the app (scripts)
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+
+async def open_client() -> httpx.AsyncClient:
+    return get_client()
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
 
 def supabase_headers(access_token: str | None = None) -> dict:
     """
@@ -28,36 +97,276 @@ def supabase_headers(access_token: str | None = None) -> dict:
     return headers
 
 
-async def sb_post(path: str, json: dict | None = None, access_token: str | None = None):
-    url = f"{SUPABASE_URL}{path}"
-    async with httpx.AsyncClient(timeout=30) as client:
-        return await client.post(url, headers=supabase_headers(access_token), json=json)
+# =========================
+# Upstream call hooks (tracing / metrics)
+# =========================
+# callback(method, path, status, nbytes, started_at, duration_s) after every Supabase call;
+# status 0 = no response (timeout, connection error, cancelled)
+_call_observers: list[Callable] = []
+
+
+def on_upstream_call(callback: Callable) -> Callable:
+    _call_observers.append(callback)
+    return callback
+
+
+def endpoint_name(path: str) -> str:
+    """Low-cardinality name of a Supabase path: books_with_ratings, rpc/borrow_copy, auth/token, storage/book-images."""
+    path = path.split("?", 1)[0]
+    if path.startswith("/rest/v1/"):
+        return path[len("/rest/v1/"):] or "rest"
+    if path.startswith("/auth/v1/"):
+        return "auth/" + path[len("/auth/v1/"):]
+    if path.startswith("/storage/v1/object/"):
+        rest = path[len("/storage/v1/object/"):].removeprefix("public/")
+        return "storage/" + rest.split("/", 1)[0]
+    return path
+
+
+async def _call(method: str, path: str, **kwargs) -> httpx.Response:
+    """One HTTP round-trip, reported to the observers."""
+    started_at = time.time()
+    t0 = time.perf_counter()
+    status, nbytes = 0, 0
+    try:
+        r = await get_client().request(method, path, **kwargs)
+        status, nbytes = r.status_code, len(r.content)
+        return r
+    finally:
+        duration = time.perf_counter() - t0
+        for callback in _call_observers:
+            try:
+                callback(method, path, status, nbytes, started_at, duration)
+            except Exception:
+                pass
+
+
+# =========================
+# Resilience: request budget, circuit breakers, retries, hedging
+# =========================
+# monotonic deadline of the incoming request (set by the app middleware);
+# no call outlives it, so a slow Supabase can't pile up 30s waits
+_deadline: ContextVar[float | None] = ContextVar("supabase_deadline", default=None)
+
+# worth retrying (idempotent GETs only): gateway/overload answers
+RETRY_STATUSES = {502, 503, 504}
+
+
+def set_request_budget(seconds: float | None):
+    """Calls made in this context must finish within `seconds`; returns a token for reset_request_budget."""
+    return _deadline.set(time.monotonic() + seconds if seconds else None)
+
+
+def reset_request_budget(token):
+    _deadline.reset(token)
+
+
+def _remaining() -> float | None:
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class CircuitBreaker:
+    """
+    Per endpoint (table / rpc / auth / storage bucket):
+    - closed: calls go through; BREAKER_FAILURES failures in a row => open
+    - open: calls fail fast (synthetic 503) for BREAKER_RESET_SECONDS
+    - then one probe call is let through: success closes, failure re-opens
+    """
+
+    def __init__(self):
+        self.failures = 0
+        self.opened_at: float | None = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at >= BREAKER_RESET_SECONDS:
+            # half-open: this caller is the probe; the others keep failing fast
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+    def record(self, ok: bool):
+        if ok:
+            self.failures = 0
+            self.opened_at = None
+        else:
+            self.failures += 1
+            if self.failures >= BREAKER_FAILURES:
+                self.opened_at = time.monotonic()
 
 
-async def sb_get(path: str, access_token: str | None = None):
-    url = f"{SUPABASE_URL}{path}"
-    async with httpx.AsyncClient(timeout=30) as client:
-        return await client.get(url, headers=supabase_headers(access_token))
+_breakers: dict[str, CircuitBreaker] = {}
+
+
+def breaker_states() -> dict[str, bool]:
+    """endpoint -> open? (for /metrics)"""
+    return {name: b.is_open for name, b in _breakers.items()}
+
+
+def _breaker(path: str) -> CircuitBreaker:
+    name = endpoint_name(path)
+    b = _breakers.get(name)
+    if b is None:
+        b = _breakers[name] = CircuitBreaker()
+    return b
+
+
+def _synthetic(method: str, path: str, status: int, message: str) -> httpx.Response:
+    # same shape as a PostgREST error: callers handle it like any other failed call
+    return httpx.Response(status, json={"message": message}, request=httpx.Request(method, SUPABASE_URL + path))
+
+
+def _backoff(attempt: int) -> float:
+    # exponential backoff with full jitter
+    return random.uniform(0, min(SUPABASE_RETRY_CAP, SUPABASE_RETRY_BASE * 2 ** attempt))
+
+
+async def _send(method: str, path: str, retries: int = 0, **kwargs) -> httpx.Response:
+    """
+    _call() behind the circuit breaker and the request budget.
+    - retries (GET only): transport errors and 502/503/504, with backoff
+    - per-call timeout = min(client timeout, what is left of the request budget);
+      an explicit timeout= (uploads) is kept as is
+    """
+    breaker = _breaker(path)
+    explicit_timeout = "timeout" in kwargs
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            return _synthetic(method, path, 503, "circuit open")
+        remaining = None if explicit_timeout else _remaining()
+        if remaining is not None:
+            if remaining <= 0:
+                return _synthetic(method, path, 504, "request budget exhausted")
+            kwargs["timeout"] = httpx.Timeout(
+                min(SUPABASE_TIMEOUT, remaining), connect=min(SUPABASE_CONNECT_TIMEOUT, remaining)
+            )
+
+        try:
+            if remaining is None:
+                r = await _call(method, path, **kwargs)
+            else:
+                # httpx timeouts are per phase (connect/read...); the budget is a total
+                r = await asyncio.wait_for(_call(method, path, **kwargs), remaining)
+        except asyncio.TimeoutError:
+            breaker.record(False)
+            return _synthetic(method, path, 504, "request budget exhausted")
+        except httpx.TransportError:
+            breaker.record(False)
+            if attempt >= retries:
+                raise
+        else:
+            breaker.record(r.status_code < 500)
+            if r.status_code not in RETRY_STATUSES or attempt >= retries:
+                return r
+
+        delay = _backoff(attempt)
+        remaining = _remaining()
+        if remaining is not None and delay >= remaining:
+            return _synthetic(method, path, 504, "request budget exhausted")
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+# endpoint -> recent successful GET durations / [p95, hedge decisions since it was computed]
+_latencies: dict[str, deque] = {}
+_p95: dict[str, list] = {}
+
+
+@on_upstream_call
+def _record_latency(method, path, status, nbytes, started_at, duration):
+    if method != "GET" or not 0 < status < 500:
+        return
+    name = endpoint_name(path)
+    window = _latencies.get(name)
+    if window is None:
+        window = _latencies[name] = deque(maxlen=SUPABASE_HEDGE_WINDOW)
+    window.append(duration)
+
+
+def _hedge_delay(path: str) -> float | None:
+    """When to send the hedge for this GET, or None: not enough samples / breaker not closed."""
+    name = endpoint_name(path)
+    breaker = _breakers.get(name)
+    if breaker is not None and (breaker.is_open or breaker.failures):
+        return None  # degraded / half-open: a second request only adds load
+    window = _latencies.get(name)
+    if not window or len(window) < SUPABASE_HEDGE_MIN_SAMPLES:
+        return None
+    cached = _p95.get(name)
+    if cached is None or cached[1] >= SUPABASE_HEDGE_MIN_SAMPLES:
+        ordered = sorted(window)
+        cached = _p95[name] = [ordered[int(len(ordered) * 0.95) - 1], 0]
+    cached[1] += 1
+    return max(SUPABASE_HEDGE_AFTER, cached[0])
+
+
+async def _hedged(path: str, headers: dict, retries: int) -> httpx.Response:
+    """
+    Start the GET; if it is slower than the endpoint's recent p95 (at least
+    SUPABASE_HEDGE_AFTER), start an identical one and take whichever succeeds
+    first (cuts tail latency). No hedge while the breaker isn't cleanly closed.
+    """
+    delay = _hedge_delay(path)
+    if delay is None:
+        return await _send("GET", path, retries=retries, headers=headers)
+    first = asyncio.ensure_future(_send("GET", path, retries=retries, headers=headers))
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done:
+        return first.result()
+
+    tasks = {first, asyncio.ensure_future(_send("GET", path, headers=headers))}
+    fallback: asyncio.Task | None = None
+    try:
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if t.exception() is None and t.result().status_code < 500:
+                    return t.result()
+                fallback = fallback or t
+        return fallback.result()  # both failed: same outcome as an unhedged call
+    finally:
+        for t in tasks:
+            t.cancel()
+
+
+async def sb_post(path: str, json: dict | list | None = None, access_token: str | None = None, prefer: str | None = None):
+    """prefer: replaces the default Prefer header (e.g. "resolution=ignore-duplicates,return=representation")."""
+    headers = supabase_headers(access_token)
+    if prefer:
+        headers["Prefer"] = prefer
+    return await _send("POST", path, headers=headers, json=json)
+
+
+async def sb_get(path: str, access_token: str | None = None, hedge: bool = False):
+    """GETs are idempotent: retried on transient failures; hedge=True for hot latency-critical reads."""
+    headers = supabase_headers(access_token)
+    if hedge and SUPABASE_HEDGE_AFTER > 0:
+        return await _hedged(path, headers, retries=SUPABASE_GET_RETRIES)
+    return await _send("GET", path, retries=SUPABASE_GET_RETRIES, headers=headers)
 
 
 async def sb_patch(path: str, json: dict | None = None, access_token: str | None = None):
-    url = f"{SUPABASE_URL}{path}"
-    async with httpx.AsyncClient(timeout=30) as client:
-        return await client.patch(url, headers=supabase_headers(access_token), json=json)
+    return await _send("PATCH", path, headers=supabase_headers(access_token), json=json)
 
 
 async def sb_delete(path: str, access_token: str | None = None):
-    url = f"{SUPABASE_URL}{path}"
-    async with httpx.AsyncClient(timeout=30) as client:
-        return await client.delete(url, headers=supabase_headers(access_token))
+    return await _send("DELETE", path, headers=supabase_headers(access_token))
 
 
 async def sb_upload_file(
     bucket: str,
     path: str,
-    file_bytes: bytes,
+    file_bytes: bytes | AsyncIterable[bytes],
     content_type: str,
     access_token: str | None = None,
+    content_length: int | None = None,
 ):
     """
     Upload to Supabase Storage:
@@ -65,8 +374,10 @@ async def sb_upload_file(
 
     Note:
     - Needs Authorization (user token) when bucket has RLS policies (admin upload)
+    - file_bytes can be an async iterator of chunks (streamed, not buffered);
+      without content_length the body goes out chunked
     """
-    url = f"{SUPABASE_URL}/storage/v1/object/{bucket}/{path}"
+    url = f"/storage/v1/object/{bucket}/{path}"
 
     headers = {
         "apikey": SUPABASE_ANON_KEY,
@@ -74,9 +385,38 @@ async def sb_upload_file(
         "Content-Type": content_type,
         "x-upsert": "true",
     }
+    if content_length is not None:
+        headers["Content-Length"] = str(content_length)
+
+    return await _send("POST", url, headers=headers, content=file_bytes, timeout=SUPABASE_UPLOAD_TIMEOUT)
+
+
+async def sb_gather(*calls, timeout: float | None = SUPABASE_FANOUT_TIMEOUT) -> list:
+    """
+    Run independent Supabase reads concurrently (page latency ~ slowest call).
+    - results come back in the same order as the calls
+    - a call that raised or missed the shared deadline gives None
+      (callers keep their usual "empty on error" fallback)
+    - a None call is skipped and also gives None
+    """
+    tasks = [asyncio.ensure_future(c) if c is not None else None for c in calls]
+    live = [t for t in tasks if t is not None]
+    if not live:
+        return [None] * len(tasks)
+
+    done, pending = await asyncio.wait(live, timeout=timeout)
+    for t in pending:
+        t.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
 
-    async with httpx.AsyncClient(timeout=60) as client:
-        return await client.post(url, headers=headers, content=file_bytes)
+    results = []
+    for t in tasks:
+        if t in done and not t.cancelled() and t.exception() is None:
+            results.append(t.result())
+        else:
+            results.append(None)
+    return results
 
 
 def storage_public_url(bucket: str, path: str) -> str:
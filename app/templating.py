@@ -0,0 +1,92 @@
+import os
+import json
+import hashlib
+import tempfile
+
+from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+from app.assets import static_url, ASSETS_VERSION
+from app.cache import TTLCache
+from app.images import srcset, thumb_url, CARD_SIZES
+from app.supabase_client import SUPABASE_URL, SUPABASE_ANON_KEY
+
+TEMPLATES_DIR = "app/templates"
+
+# compiled templates survive worker restarts (cold workers skip the Jinja compile step)
+JINJA_CACHE_DIR = os.getenv("JINJA_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "class-library-jinja")
+# dev: JINJA_AUTO_RELOAD=1 picks up template edits without a restart
+JINJA_AUTO_RELOAD = os.getenv("JINJA_AUTO_RELOAD", "0") == "1"
+
+FRAGMENT_CACHE_SIZE = int(os.getenv("FRAGMENT_CACHE_SIZE", "5000"))
+
+os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+
+templates = Jinja2Templates(
+    directory=TEMPLATES_DIR,
+    bytecode_cache=FileSystemBytecodeCache(JINJA_CACHE_DIR),
+    auto_reload=JINJA_AUTO_RELOAD,
+)
+templates.env.globals["SUPABASE_URL"] = SUPABASE_URL
+templates.env.globals["SUPABASE_ANON_KEY"] = SUPABASE_ANON_KEY
+templates.env.globals["srcset"] = srcset
+templates.env.globals["thumb_url"] = thumb_url
+templates.env.globals["CARD_SIZES"] = CARD_SIZES
+templates.env.globals["static_url"] = static_url
+
+
+def _templates_version() -> str:
+    h = hashlib.blake2b(digest_size=8)
+    for root, _, files in sorted(os.walk(TEMPLATES_DIR)):
+        for name in sorted(files):
+            with open(os.path.join(root, name), "rb") as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+# part of every page ETag: a deploy that changes markup or static assets
+# (pages embed hashed asset URLs) invalidates browser copies
+PAGES_VERSION = f"{_templates_version()}.{ASSETS_VERSION}"
+
+
+def warm_templates():
+    """Compile every template once at startup (fills the bytecode cache)."""
+    for name in templates.env.list_templates(extensions=["html"]):
+        templates.env.get_template(name)
+
+
+# =========================
+# Fragment cache (book cards)
+# =========================
+# rendered user-independent parts of a card; the key is built from every field
+# the fragment shows (cover, texts, copies, ratings), so entries never go stale
+fragment_cache = TTLCache(ttl=24 * 60 * 60, maxsize=FRAGMENT_CACHE_SIZE)
+
+# fragment -> the book fields it renders (keep in sync with the templates)
+FRAGMENT_FIELDS = {
+    "_book_card_cover.html": ("image_url", "image_variants"),
+    "_book_card_info.html": (
+        "title", "author", "description", "code", "copies_total", "copies_borrowed", "available_copies",
+    ),
+    "_book_card_rating.html": ("rating_avg", "rating_count"),
+}
+
+
+def _fragment_key(name: str, book: dict) -> tuple:
+    fields = FRAGMENT_FIELDS.get(name) or sorted(book)
+    raw = json.dumps([book.get(f) for f in fields], sort_keys=True, default=str, ensure_ascii=False)
+    return name, book.get("id"), hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+def card_fragment(name: str, book: dict) -> Markup:
+    """Render `name` with b=book once per book version (use only for user-independent markup)."""
+    key = _fragment_key(name, book)
+    html = fragment_cache.get(key)
+    if html is None:
+        html = Markup(templates.env.get_template(name).render(b=book))
+        fragment_cache.set(key, html)
+    return html
+
+
+templates.env.globals["card_fragment"] = card_fragment
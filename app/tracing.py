@@ -0,0 +1,209 @@
+"""
+Per-request tracing of upstream (Supabase) calls:
+- every sb_* call is recorded (endpoint, status, bytes, duration) under the request id
+- responses carry X-Request-ID and Server-Timing (visible in the browser devtools)
+- one JSON log line per request (the calls themselves when the request is slow)
+- optional OpenTelemetry export when OTEL_EXPORTER_OTLP_ENDPOINT is set
+  and the opentelemetry sdk + otlp exporter are installed
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import logging
+import re
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from app.supabase_client import on_upstream_call, endpoint_name
+
+# log the individual upstream calls of requests slower than this
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "500"))
+# "0" = no per-request log line (events are still logged)
+TRACE_LOG_REQUESTS = os.getenv("TRACE_LOG_REQUESTS", "1") == "1"
+# Server-Timing entries per response (the header stays small)
+SERVER_TIMING_MAX_CALLS = int(os.getenv("SERVER_TIMING_MAX_CALLS", "20"))
+OTEL_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "class-library")
+
+
+@dataclass
+class UpstreamCall:
+    method: str
+    endpoint: str
+    status: int
+    nbytes: int
+    started_at: float  # time.time()
+    duration: float  # seconds
+
+
+@dataclass
+class RequestTrace:
+    request_id: str
+    method: str
+    path: str
+    started_at: float = field(default_factory=time.time)
+    t0: float = field(default_factory=time.perf_counter)
+    calls: list[UpstreamCall] = field(default_factory=list)
+
+    @property
+    def upstream_ms(self) -> float:
+        return sum(c.duration for c in self.calls) * 1000
+
+
+# an incoming X-Request-ID (from a proxy) is reused only if it looks like an id
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+_current: ContextVar[RequestTrace | None] = ContextVar("request_trace", default=None)
+
+
+def current_trace() -> RequestTrace | None:
+    return _current.get()
+
+
+@on_upstream_call
+def _record_call(method, path, status, nbytes, started_at, duration):
+    # sb_gather tasks copy the context => they share the request's trace object
+    trace = _current.get()
+    if trace is not None:
+        trace.calls.append(UpstreamCall(method, endpoint_name(path), status, nbytes, started_at, duration))
+
+
+# =========================
+# JSON logs
+# =========================
+logger = logging.getLogger("app.trace")
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+
+
+def log_event(event: str, level: int = logging.INFO, **fields):
+    """One JSON line: {"ts", "event", "request_id", **fields}."""
+    if not logger.isEnabledFor(level):
+        return
+    trace = _current.get()
+    record = {"ts": round(time.time(), 3), "event": event}
+    if trace is not None:
+        record["request_id"] = trace.request_id
+    record.update(fields)
+    logger.log(level, json.dumps(record, ensure_ascii=False, default=str))
+
+
+# =========================
+# Request lifecycle
+# =========================
+def start_request(method: str, path: str, request_id: str | None = None) -> tuple[RequestTrace, object]:
+    if not request_id or not _REQUEST_ID_RE.match(request_id):
+        request_id = uuid.uuid4().hex
+    trace = RequestTrace(request_id=request_id, method=method, path=path)
+    return trace, _current.set(trace)
+
+
+def finish_request(trace: RequestTrace, token, route: str, status: int) -> float:
+    """Log/export the request; returns its duration in ms."""
+    _current.reset(token)
+    duration_ms = (time.perf_counter() - trace.t0) * 1000
+
+    if TRACE_LOG_REQUESTS:
+        fields = {
+            "request_id": trace.request_id,
+            "method": trace.method,
+            "route": route,
+            "status": status,
+            "duration_ms": round(duration_ms, 1),
+            "upstream_calls": len(trace.calls),
+            "upstream_ms": round(trace.upstream_ms, 1),
+        }
+        if duration_ms >= TRACE_SLOW_MS:
+            fields["calls"] = [
+                {
+                    "method": c.method,
+                    "endpoint": c.endpoint,
+                    "status": c.status,
+                    "bytes": c.nbytes,
+                    "offset_ms": round((c.started_at - trace.started_at) * 1000, 1),
+                    "ms": round(c.duration * 1000, 1),
+                }
+                for c in trace.calls
+            ]
+        log_event("request", **fields)
+
+    if _tracer is not None:
+        _export(trace, route, status)
+    return duration_ms
+
+
+def server_timing(trace: RequestTrace, duration_ms: float) -> str:
+    """app;dur=.., sb;desc="3 calls";dur=.., sb1;desc="GET books_with_ratings 200";dur=.."""
+    parts = [
+        f"app;dur={duration_ms:.1f}",
+        f'sb;desc="{len(trace.calls)} calls";dur={trace.upstream_ms:.1f}',
+    ]
+    for i, c in enumerate(trace.calls[:SERVER_TIMING_MAX_CALLS], start=1):
+        desc = f"{c.method} {c.endpoint} {c.status or 'error'}".replace('"', "'")
+        parts.append(f'sb{i};desc="{desc}";dur={c.duration * 1000:.1f}')
+    return ", ".join(parts)
+
+
+# =========================
+# OpenTelemetry (optional)
+# =========================
+def _setup_otel():
+    if not OTEL_ENDPOINT:
+        return None
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    except ImportError:
+        log_event("otel_disabled", level=logging.WARNING, reason="opentelemetry packages not installed")
+        return None
+
+    provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME}))
+    # the exporter reads OTEL_EXPORTER_OTLP_ENDPOINT itself (e.g. http://localhost:4318)
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    return provider.get_tracer("app.tracing")
+
+
+_tracer = _setup_otel()
+
+
+def _export(trace: RequestTrace, route: str, status: int):
+    # spans are built after the fact from the recorded timestamps (no context plumbing in sb_*)
+    from opentelemetry.trace import set_span_in_context
+
+    def ns(t: float) -> int:
+        return int(t * 1e9)
+
+    end = trace.started_at + (time.perf_counter() - trace.t0)
+    root = _tracer.start_span(
+        f"{trace.method} {route}",
+        start_time=ns(trace.started_at),
+        attributes={
+            "http.request.method": trace.method,
+            "http.route": route,
+            "http.response.status_code": status,
+            "app.request_id": trace.request_id,
+        },
+    )
+    ctx = set_span_in_context(root)
+    for c in trace.calls:
+        span = _tracer.start_span(
+            f"supabase {c.method} {c.endpoint}",
+            context=ctx,
+            start_time=ns(c.started_at),
+            attributes={
+                "http.request.method": c.method,
+                "supabase.endpoint": c.endpoint,
+                "http.response.status_code": c.status,
+                "http.response.body.size": c.nbytes,
+            },
+        )
+        span.end(end_time=ns(c.started_at + c.duration))
+    root.end(end_time=ns(end))
@@ -0,0 +1,67 @@
+import os
+from typing import AsyncIterator
+
+from fastapi import UploadFile
+
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(64 * 1024)))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(5 * 1024 * 1024)))
+
+
+class UploadRejected(Exception):
+    """code is the ?msg= shown on the admin page (too_large / bad_image)."""
+
+    def __init__(self, code: str):
+        super().__init__(code)
+        self.code = code
+
+
+def sniff_image_type(head: bytes) -> tuple[str, str] | None:
+    """(content_type, extension) from the file's magic bytes, or None if not a supported image."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg", "jpg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png", "png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif", "gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp", "webp"
+    if head[4:12] in (b"ftypavif", b"ftypavis"):
+        return "image/avif", "avif"
+    return None
+
+
+async def open_image_upload(
+    upload: UploadFile,
+    max_bytes: int = UPLOAD_MAX_BYTES,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+) -> tuple[str, str, AsyncIterator[bytes], int | None]:
+    """
+    Validate an uploaded image without buffering it.
+    Returns (content_type, extension, body, size):
+    - body yields chunks of at most chunk_size bytes (peak memory ~ one chunk)
+    - body raises UploadRejected("too_large") once more than max_bytes went through
+    - size is the declared size when the client sent one (None otherwise)
+    """
+    size = upload.size
+    if size is not None and size > max_bytes:
+        raise UploadRejected("too_large")
+
+    head = await upload.read(chunk_size)
+    sniffed = sniff_image_type(head)
+    if not sniffed:
+        raise UploadRejected("bad_image")
+    content_type, ext = sniffed
+
+    async def body():
+        total = len(head)
+        yield head
+        while True:
+            chunk = await upload.read(chunk_size)
+            if not chunk:
+                break
+            total += len(chunk)
+            if total > max_bytes:
+                raise UploadRejected("too_large")
+            yield chunk
+
+    return content_type, ext, body(), size
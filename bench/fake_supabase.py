@@ -0,0 +1,453 @@
+"""
+Local stand-in for the Supabase endpoints the app uses (benchmarks only).
+
+    python -m bench.fake_supabase --port 54321 --books 2000 --latency-ms 40
+
+- PostgREST: books, books_with_ratings, ratings, borrow_history, user_profiles,
+  rpc/borrow_copy, rpc/return_copy (select / order / limit / offset,
+  eq neq lt lte gt gte in is like ilike not, or=() / and=() trees)
+- Auth: /auth/v1/token (password + refresh_token), signup, recover, health
+- Storage: /storage/v1/object/<bucket>/<path> (upload + public download)
+- every request sleeps latency +/- jitter; /_bench/stats counts calls per endpoint
+"""
+import os
+import re
+import json
+import time
+import base64
+import random
+import asyncio
+import argparse
+import functools
+from collections import Counter
+from datetime import datetime, timezone, timedelta
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+
+ADMIN_EMAIL = "benzjamal45@gmail.com"
+
+config = {
+    "latency_ms": float(os.getenv("FAKE_LATENCY_MS", "0")),
+    "jitter_ms": float(os.getenv("FAKE_JITTER_MS", "0")),
+}
+calls: Counter = Counter()
+
+app = FastAPI()
+
+
+# =========================
+# Data
+# =========================
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class Store:
+    def __init__(self, books: int = 200, users: int = 50):
+        self.books: list[dict] = []
+        self.ratings: list[dict] = []
+        self.borrows: list[dict] = []
+        self.user_profiles: list[dict] = []
+        self.objects: dict[str, tuple[str, bytes]] = {}
+        # book_id -> [sum, count] (books_with_ratings without rescanning ratings)
+        self.rating_agg: dict[int, list] = {}
+        # bumped on every write; views are rebuilt only when it changes
+        self.version = 0
+        self._views: dict[str, tuple[int, list]] = {}
+        self.seed(books, users)
+
+    def seed(self, books: int, users: int):
+        start = _now() - timedelta(days=books)
+        for i in range(1, books + 1):
+            self.books.append({
+                "id": i,
+                "title": f"Book {i} {random.choice(['Étude', 'الرواية', 'Histoire', 'Guide', 'Notes'])}",
+                "author": f"Author {i % 97}",
+                "code": f"C{i:05d}",
+                "description": "Lorem ipsum dolor sit amet.",
+                "image_url": None,
+                "image_variants": None,
+                "created_at": (start + timedelta(hours=i)).isoformat(),
+                "copies_total": random.randint(1, 4),
+                "copies_borrowed": 0,
+            })
+        self.user_profiles.append(self._profile("admin", ADMIN_EMAIL, approved=True))
+        for i in range(users):
+            self.user_profiles.append(self._profile(f"user-{i}", f"user{i}@bench.local", approved=True))
+
+    @staticmethod
+    def _profile(user_id: str, email: str, approved: bool) -> dict:
+        return {
+            "user_id": user_id,
+            "email": email,
+            "full_name": user_id,
+            "is_approved": approved,
+            "created_at": _now().isoformat(),
+            "approved_at": _now().isoformat() if approved else None,
+        }
+
+    def user_for(self, email: str) -> dict:
+        for p in self.user_profiles:
+            if p["email"] == email:
+                return p
+        p = self._profile(f"user-{len(self.user_profiles)}", email, approved=True)
+        self.user_profiles.append(p)
+        return p
+
+    def books_with_ratings(self) -> list[dict]:
+        out = []
+        for b in self.books:
+            total, count = self.rating_agg.get(b["id"], (0, 0))
+            out.append({
+                **b,
+                "available_copies": max(b["copies_total"] - b["copies_borrowed"], 0),
+                "rating_avg": total / count if count else 0,
+                "rating_count": count,
+            })
+        return out
+
+    def borrow_history(self) -> list[dict]:
+        by_id = {b["id"]: b for b in self.books}
+        out = []
+        for h in self.borrows:
+            b = by_id.get(h["book_id"], {})
+            out.append({
+                **h,
+                "book_title": b.get("title"),
+                "book_author": b.get("author"),
+                "book_code": b.get("code"),
+                "book_description": b.get("description"),
+                "book_image_url": b.get("image_url"),
+            })
+        return out
+
+    def table(self, name: str) -> list[dict]:
+        if name in ("books_with_ratings", "borrow_history"):
+            cached = self._views.get(name)
+            if cached is None or cached[0] != self.version:
+                cached = (self.version, getattr(self, name)())
+                self._views[name] = cached
+            return cached[1]
+        return getattr(self, name)
+
+
+store = Store(books=int(os.getenv("FAKE_BOOKS", "200")))
+
+
+# =========================
+# PostgREST query subset
+# =========================
+def _split_top(s: str) -> list[str]:
+    """Split on commas outside parentheses and double quotes."""
+    parts, cur, depth, quoted = [], "", 0, False
+    for i, ch in enumerate(s):
+        if ch == '"' and (i == 0 or s[i - 1] != "\\"):
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0 and not quoted:
+            parts.append(cur)
+            cur = ""
+        else:
+            cur += ch
+    if cur:
+        parts.append(cur)
+    return parts
+
+
+def _unquote(v: str) -> str:
+    if len(v) >= 2 and v[0] == '"' and v[-1] == '"':
+        return v[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+    return v
+
+
+def _coerce(value, raw: str):
+    if isinstance(value, bool):
+        return raw == "true"
+    if isinstance(value, int):
+        return int(raw)
+    if isinstance(value, float):
+        return float(raw)
+    return raw
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile(expr: str):
+    """Predicate for expr: col.op.value | col.not.op.value | or(...) | and(...) (parsed once)."""
+    for logic in ("or", "and"):
+        if expr.startswith(logic + "("):
+            subs = [_compile(sub) for sub in _split_top(expr[len(logic) + 1:-1])]
+            if logic == "or":
+                return lambda row: any(f(row) for f in subs)
+            return lambda row: all(f(row) for f in subs)
+
+    col, rest = expr.split(".", 1)
+    negate = rest.startswith("not.")
+    if negate:
+        rest = rest[4:]
+    op, raw = rest.split(".", 1)
+    raw = _unquote(raw)
+
+    if op == "is":
+        test = (lambda v: v is None) if raw == "null" else (lambda v: v == (raw == "true"))
+    elif op == "in":
+        allowed = {_unquote(x) for x in _split_top(raw.strip("()"))}
+        test = lambda v: str(v) in allowed
+    elif op in ("like", "ilike"):
+        pattern = re.compile(
+            "^" + re.escape(raw).replace(r"\*", ".*").replace("%", ".*") + "$",
+            re.IGNORECASE if op == "ilike" else 0,
+        )
+        test = lambda v: v is not None and pattern.match(str(v)) is not None
+    else:
+        compare = {
+            "eq": lambda a, b: a == b, "neq": lambda a, b: a != b,
+            "lt": lambda a, b: a < b, "lte": lambda a, b: a <= b,
+            "gt": lambda a, b: a > b, "gte": lambda a, b: a >= b,
+        }[op]
+        test = lambda v: v is not None and compare(v, _coerce(v, raw))
+
+    if negate:
+        return lambda row: not test(row.get(col))
+    return lambda row: test(row.get(col))
+
+
+_RESERVED = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+
+def _filters(params) -> list[str]:
+    out = []
+    for key, value in params.multi_items():
+        if key in _RESERVED:
+            continue
+        out.append(f"{key}{value}" if key in ("or", "and") else f"{key}.{value}")
+    return out
+
+
+def run_query(rows: list[dict], params) -> list[dict]:
+    for expr in _filters(params):
+        predicate = _compile(expr)
+        rows = [r for r in rows if predicate(r)]
+    if "order" in params:
+        for part in reversed(params["order"].split(",")):
+            col, _, direction = part.partition(".")
+            rows = sorted(
+                rows,
+                key=lambda r: (r.get(col) is None, r.get(col)),
+                reverse=direction.startswith("desc"),
+            )
+    offset = int(params.get("offset", 0))
+    rows = rows[offset:]
+    if "limit" in params:
+        rows = rows[: int(params["limit"])]
+    select = params.get("select", "*")
+    if select != "*":
+        cols = select.split(",")
+        rows = [{c: r.get(c) for c in cols} for r in rows]
+    return rows
+
+
+# =========================
+# Endpoints
+# =========================
+def _jwt(user_id: str, email: str, ttl: int = 3600) -> str:
+    def seg(obj) -> str:
+        return base64.urlsafe_b64encode(json.dumps(obj).encode()).rstrip(b"=").decode()
+    return f"{seg({'alg': 'none'})}.{seg({'sub': user_id, 'email': email, 'exp': int(time.time()) + ttl})}.bench"
+
+
+def _token_payload(profile: dict) -> dict:
+    return {
+        "access_token": _jwt(profile["user_id"], profile["email"]),
+        "refresh_token": f"refresh:{profile['email']}",
+        "expires_in": 3600,
+        "user": {"id": profile["user_id"], "email": profile["email"], "user_metadata": {}},
+    }
+
+
+@app.middleware("http")
+async def count_and_delay(request: Request, call_next):
+    if request.method != "GET":
+        store.version += 1
+    if not request.url.path.startswith("/_bench"):
+        endpoint = request.url.path.replace("/rest/v1/", "").replace("/auth/v1/", "auth/")
+        if endpoint.startswith("/storage/v1/object/"):
+            endpoint = "storage"
+        calls[f"{request.method} {endpoint}"] += 1
+        delay = config["latency_ms"] + random.uniform(-config["jitter_ms"], config["jitter_ms"])
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+    return await call_next(request)
+
+
+@app.get("/_bench/stats")
+async def bench_stats():
+    return dict(calls)
+
+
+@app.post("/_bench/reset")
+async def bench_reset():
+    calls.clear()
+    return {}
+
+
+@app.post("/auth/v1/token")
+async def auth_token(request: Request):
+    body = await request.json()
+    if request.query_params.get("grant_type") == "refresh_token":
+        email = (body.get("refresh_token") or "").removeprefix("refresh:")
+    else:
+        email = body.get("email") or ""
+    if not email:
+        return JSONResponse({"error": "invalid_grant"}, status_code=400)
+    return _token_payload(store.user_for(email))
+
+
+@app.post("/auth/v1/signup")
+async def auth_signup(request: Request):
+    body = await request.json()
+    return {"session": _token_payload(store.user_for(body["email"]))}
+
+
+@app.post("/auth/v1/recover")
+async def auth_recover():
+    return {}
+
+
+@app.get("/auth/v1/health")
+async def auth_health():
+    return {"name": "GoTrue", "description": "bench fake"}
+
+
+@app.post("/rest/v1/rpc/borrow_copy")
+async def rpc_borrow(request: Request):
+    body = await request.json()
+    book = next((b for b in store.books if b["id"] == body["p_book_id"]), None)
+    if book is None or book["copies_borrowed"] >= book["copies_total"]:
+        return JSONResponse({"message": "no_copies_left"}, status_code=400)
+    book["copies_borrowed"] += 1
+    store.borrows.append({
+        "id": len(store.borrows) + 1,
+        "book_id": book["id"],
+        "user_id": body["p_user_id"],
+        "status": "borrowed",
+        "borrowed_at": _now().isoformat(),
+        "due_date": (_now() + timedelta(days=14)).isoformat(),
+        "returned_at": None,
+    })
+    return Response(status_code=204)
+
+
+@app.post("/rest/v1/rpc/return_copy")
+async def rpc_return(request: Request):
+    body = await request.json()
+    h = next((h for h in store.borrows
+              if h["book_id"] == body["p_book_id"] and h["user_id"] == body["p_user_id"] and h["status"] == "borrowed"),
+             None)
+    if h is None:
+        return JSONResponse({"message": "not_your_book"}, status_code=400)
+    h["status"] = "returned"
+    h["returned_at"] = _now().isoformat()
+    book = next(b for b in store.books if b["id"] == h["book_id"])
+    book["copies_borrowed"] = max(book["copies_borrowed"] - 1, 0)
+    return Response(status_code=204)
+
+
+@app.get("/rest/v1/")
+async def rest_root():
+    return {"swagger": "2.0"}
+
+
+@app.api_route("/rest/v1/{table}", methods=["GET", "HEAD"])
+async def rest_select(table: str, request: Request):
+    try:
+        rows = store.table(table)
+    except AttributeError:
+        return JSONResponse({"message": f"relation {table} does not exist"}, status_code=404)
+    return JSONResponse(run_query(rows, request.query_params))
+
+
+@app.post("/rest/v1/{table}")
+async def rest_insert(table: str, request: Request):
+    body = await request.json()
+    items = body if isinstance(body, list) else [body]
+    rows = getattr(store, table)
+    if table == "ratings":
+        for it in items:
+            if any(r["book_id"] == it["book_id"] and r["user_id"] == it["user_id"] for r in rows):
+                return JSONResponse({"message": "duplicate key value violates unique constraint"}, status_code=409)
+    if table == "books":
+        codes = {b["code"] for b in rows}
+        for it in items:
+            if it.get("code") in codes:
+                return JSONResponse({"message": "duplicate key value violates unique constraint"}, status_code=409)
+            codes.add(it.get("code"))
+    for it in items:
+        if table == "books":
+            it = {"id": max((b["id"] for b in rows), default=0) + 1, **it}
+        if table == "ratings":
+            agg = store.rating_agg.setdefault(it["book_id"], [0, 0])
+            agg[0] += int(it["rating"])
+            agg[1] += 1
+        rows.append(it)
+    return Response(status_code=201)
+
+
+@app.patch("/rest/v1/{table}")
+async def rest_update(table: str, request: Request):
+    body = await request.json()
+    for row in run_query(getattr(store, table), request.query_params):
+        # run_query copies only when select= is given; PATCH never sends one
+        row.update(body)
+    return Response(status_code=204)
+
+
+@app.delete("/rest/v1/{table}")
+async def rest_delete(table: str, request: Request):
+    rows = getattr(store, table)
+    doomed = {id(r) for r in run_query(rows, request.query_params)}
+    rows[:] = [r for r in rows if id(r) not in doomed]
+    return Response(status_code=204)
+
+
+@app.post("/storage/v1/object/{bucket}/{path:path}")
+async def storage_upload(bucket: str, path: str, request: Request):
+    data = bytearray()
+    async for chunk in request.stream():
+        data += chunk
+    store.objects[f"{bucket}/{path}"] = (request.headers.get("content-type", ""), bytes(data))
+    return {"Key": f"{bucket}/{path}"}
+
+
+@app.get("/storage/v1/object/public/{bucket}/{path:path}")
+async def storage_download(bucket: str, path: str):
+    obj = store.objects.get(f"{bucket}/{path}")
+    if obj is None:
+        return JSONResponse({"message": "not found"}, status_code=404)
+    return Response(obj[1], media_type=obj[0])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fake Supabase for benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--books", type=int, default=200)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    args = parser.parse_args(argv)
+
+    global store
+    store = Store(books=args.books, users=args.users)
+    config["latency_ms"] = args.latency_ms
+    config["jitter_ms"] = args.jitter_ms
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""
+Load test / latency benchmark for app.main:app against bench/fake_supabase.py.
+
+    python -m bench.run --users 20 --duration 30 --books 2000 --latency-ms 40
+
+1) boots the fake Supabase and the app (uvicorn) on local ports
+2) probes each route alone and counts the upstream calls it makes
+3) runs a mixed user load (browse, search, borrow/return, rate, history, admin edits)
+4) prints p50/p95/p99 latency and RPS per route (--json to save the numbers)
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+from collections import defaultdict
+
+import httpx
+
+ADMIN_EMAIL = "benzjamal45@gmail.com"
+
+DEFAULT_MIX = "browse=50,search=20,borrow_return=10,rate=8,history=8,admin_edit=4"
+SEARCH_TERMS = ["book 1", "étude", "author 4", "guide", "c0004", "الرواية", "histoire", "notes 7"]
+FILTERS = ["all", "all", "all", "available", "reserved", "mine"]
+
+
+# =========================
+# Process management
+# =========================
+def _spawn(args: list[str], env: dict) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, *args], env={**os.environ, **env})
+
+
+async def _wait_ready(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"not ready: {url}")
+
+
+# =========================
+# Recording
+# =========================
+class Recorder:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    async def request(self, client: httpx.AsyncClient, route: str, method: str, url: str, **kw) -> httpx.Response | None:
+        start = time.perf_counter()
+        try:
+            r = await client.request(method, url, **kw)
+        except httpx.HTTPError:
+            self.errors[route] += 1
+            return None
+        self.latencies[route].append((time.perf_counter() - start) * 1000)
+        if r.status_code >= 500:
+            self.errors[route] += 1
+        return r
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+# =========================
+# Virtual users
+# =========================
+class VirtualUser:
+    def __init__(self, app_url: str, email: str, rec: Recorder):
+        self.client = httpx.AsyncClient(base_url=app_url, follow_redirects=False, timeout=60)
+        self.email = email
+        self.rec = rec
+        self.book_ids: list[int] = []
+        self.borrowed: set[int] = set()
+
+    async def login(self):
+        await self.rec.request(self.client, "POST /login", "POST", "/login",
+                               data={"email": self.email, "password": "bench"})
+
+    def _remember_books(self, r: httpx.Response | None):
+        if r is not None and r.status_code == 200:
+            ids = [int(x) for x in re.findall(r'action="/borrow/(\d+)"', r.text)]
+            if ids:
+                self.book_ids = ids
+
+    async def browse(self):
+        r = await self.rec.request(self.client, "GET /books", "GET", "/books",
+                                   params={"filter": random.choice(FILTERS)})
+        self._remember_books(r)
+        # sometimes follow the "Next" link
+        m = re.search(r'href="/books\?([^"]*after=[^"]*)"', r.text) if r is not None else None
+        if m and random.random() < 0.3:
+            await self.rec.request(self.client, "GET /books (next page)", "GET",
+                                   "/books?" + m.group(1).replace("&amp;", "&"))
+
+    async def search(self):
+        r = await self.rec.request(self.client, "GET /books?q=", "GET", "/books",
+                                   params={"q": random.choice(SEARCH_TERMS), "filter": "all"})
+        self._remember_books(r)
+
+    async def borrow_return(self):
+        if self.borrowed and random.random() < 0.5:
+            book_id = self.borrowed.pop()
+            await self.rec.request(self.client, "POST /return/{id}", "POST", f"/return/{book_id}")
+            return
+        if not self.book_ids:
+            return await self.browse()
+        book_id = random.choice(self.book_ids)
+        r = await self.rec.request(self.client, "POST /borrow/{id}", "POST", f"/borrow/{book_id}")
+        if r is not None and "msg=borrowed" in r.headers.get("location", ""):
+            self.borrowed.add(book_id)
+
+    async def rate(self):
+        if not self.book_ids:
+            return await self.browse()
+        await self.rec.request(self.client, "POST /rate/{id}", "POST", f"/rate/{random.choice(self.book_ids)}",
+                               data={"rating": str(random.randint(1, 5))})
+
+    async def history(self):
+        await self.rec.request(self.client, "GET /history", "GET", "/history")
+
+    async def admin_edit(self):
+        r = await self.rec.request(self.client, "GET /admin/books", "GET", "/admin/books")
+        ids = re.findall(r'action="/admin/books/(\d+)/copies"', r.text) if r is not None else []
+        if ids:
+            await self.rec.request(self.client, "POST /admin/books/{id}/copies", "POST",
+                                   f"/admin/books/{random.choice(ids)}/copies",
+                                   data={"copies_total": str(random.randint(2, 5))})
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def parse_mix(raw: str) -> list[tuple[str, int]]:
+    mix = []
+    for part in raw.split(","):
+        name, _, weight = part.partition("=")
+        mix.append((name.strip(), int(weight or 1)))
+    return mix
+
+
+async def run_load(app_url: str, users: int, duration: float, mix: list[tuple[str, int]]) -> tuple[Recorder, float]:
+    rec = Recorder()
+    vus = [VirtualUser(app_url, f"user{i}@bench.local", rec) for i in range(users)]
+    admin = VirtualUser(app_url, ADMIN_EMAIL, rec)
+    await asyncio.gather(*(vu.login() for vu in [*vus, admin]))
+    await asyncio.gather(*(vu.browse() for vu in vus))
+
+    names = [n for n, _ in mix]
+    weights = [w for _, w in mix]
+    deadline = time.monotonic() + duration
+
+    async def loop(vu: VirtualUser, is_admin: bool):
+        while time.monotonic() < deadline:
+            name = random.choices(names, weights)[0]
+            if name == "admin_edit" and not is_admin:
+                name = "browse"
+            await getattr(vu, name)()
+
+    start = time.monotonic()
+    await asyncio.gather(*(loop(vu, False) for vu in vus), loop(admin, True))
+    elapsed = time.monotonic() - start
+    await asyncio.gather(*(vu.close() for vu in [*vus, admin]))
+    return rec, elapsed
+
+
+# =========================
+# Upstream calls per route
+# =========================
+async def probe_upstream(app_url: str, fake_url: str, repeat: int = 5) -> dict[str, dict]:
+    """Each route alone, `repeat` times: Supabase calls per request (by endpoint)."""
+    rec = Recorder()
+    user = VirtualUser(app_url, "probe@bench.local", rec)
+    admin = VirtualUser(app_url, ADMIN_EMAIL, rec)
+    await user.login()
+    await admin.login()
+    await user.browse()
+
+    probes = {
+        "GET /books": lambda: user.client.get("/books?filter=all"),
+        "GET /books?q=": lambda: user.client.get("/books", params={"q": random.choice(SEARCH_TERMS)}),
+        "GET /history": lambda: user.client.get("/history"),
+        "POST /borrow + /return": lambda: _borrow_and_return(user),
+        "POST /rate/{id}": lambda: user.client.post(f"/rate/{random.choice(user.book_ids or [1])}", data={"rating": "4"}),
+        "GET /admin/books": lambda: admin.client.get("/admin/books"),
+    }
+
+    out = {}
+    async with httpx.AsyncClient(base_url=fake_url) as fake:
+        for route, fn in probes.items():
+            await fake.post("/_bench/reset")
+            for _ in range(repeat):
+                await fn()
+            stats = (await fake.get("/_bench/stats")).json()
+            out[route] = {k: v / repeat for k, v in sorted(stats.items())}
+    await user.close()
+    await admin.close()
+    return out
+
+
+async def _borrow_and_return(vu: VirtualUser):
+    book_id = random.choice(vu.book_ids or [1])
+    await vu.client.post(f"/borrow/{book_id}")
+    await vu.client.post(f"/return/{book_id}")
+
+
+# =========================
+# Report
+# =========================
+def report(rec: Recorder, elapsed: float, upstream: dict[str, dict]) -> dict:
+    rows = []
+    for route in sorted(rec.latencies):
+        lat = rec.latencies[route]
+        rows.append({
+            "route": route,
+            "requests": len(lat),
+            "rps": round(len(lat) / elapsed, 2),
+            "p50_ms": round(percentile(lat, 50), 1),
+            "p95_ms": round(percentile(lat, 95), 1),
+            "p99_ms": round(percentile(lat, 99), 1),
+            "max_ms": round(max(lat), 1),
+            "errors": rec.errors.get(route, 0),
+        })
+    total = sum(r["requests"] for r in rows)
+
+    print(f"\n== load: {total} requests in {elapsed:.1f}s = {total / elapsed:.1f} req/s ==")
+    print(f"{'route':<32}{'n':>7}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'err':>6}")
+    for r in rows:
+        print(f"{r['route']:<32}{r['requests']:>7}{r['rps']:>8}{r['p50_ms']:>9}{r['p95_ms']:>9}"
+              f"{r['p99_ms']:>9}{r['max_ms']:>9}{r['errors']:>6}")
+
+    print("\n== upstream Supabase calls per request ==")
+    for route, stats in upstream.items():
+        detail = ", ".join(f"{k} x{v:g}" for k, v in stats.items())
+        print(f"{route:<32}{sum(stats.values()):>6g}  {detail}")
+
+    return {"elapsed_s": round(elapsed, 2), "total_requests": total, "routes": rows, "upstream": upstream}
+
+
+async def main_async(args) -> dict:
+    procs = []
+    fake_url = args.supabase_url or f"http://127.0.0.1:{args.fake_port}"
+    app_url = args.app_url or f"http://127.0.0.1:{args.app_port}"
+    try:
+        if not args.supabase_url:
+            procs.append(_spawn(
+                ["-m", "bench.fake_supabase", "--port", str(args.fake_port), "--books", str(args.books),
+                 "--users", str(args.users), "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms)],
+                env={},
+            ))
+            await _wait_ready(f"{fake_url}/_bench/stats")
+        if not args.app_url:
+            procs.append(_spawn(
+                ["-m", "uvicorn", "app.main:app", "--port", str(args.app_port),
+                 "--workers", str(args.workers), "--log-level", "warning"],
+                env={"SUPABASE_URL": fake_url, "SUPABASE_ANON_KEY": "bench-anon", "SECRET_KEY": "bench-secret"},
+            ))
+            await _wait_ready(f"{app_url}/healthz")
+
+        upstream = await probe_upstream(app_url, fake_url)
+        rec, elapsed = await run_load(app_url, args.users, args.duration, parse_mix(args.mix))
+        return report(rec, elapsed, upstream)
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait(timeout=10)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the app against a local fake Supabase.")
+    parser.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of mixed load")
+    parser.add_argument("--books", type=int, default=2000, help="catalog size in the fake")
+    parser.add_argument("--latency-ms", type=float, default=40, help="injected upstream latency")
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"scenario weights (default {DEFAULT_MIX})")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the app")
+    parser.add_argument("--app-port", type=int, default=8765)
+    parser.add_argument("--fake-port", type=int, default=54321)
+    parser.add_argument("--app-url", help="use an already running app instead of booting one")
+    parser.add_argument("--supabase-url", help="use an already running fake instead of booting one")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(main_async(args))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+-- /books pushes its availability filter down to PostgREST
+-- (available_copies=gt.0 / eq.0), so the view exposes the computed column.
+-- Keyset pagination orders by (created_at desc, id desc).
+--
+-- The definition of books_with_ratings lives in the database, not in this repo:
+-- the live view is wrapped as it is (its columns, joins and options kept) and
+-- available_copies is appended. Assumes it exposes copies_total and
+-- copies_borrowed, which the app already selects from it.
+
+do $$
+declare
+  def text;
+  opts text;
+begin
+  if exists (
+    select 1 from information_schema.columns
+    where table_schema = 'public' and table_name = 'books_with_ratings' and column_name = 'available_copies'
+  ) then
+    return;
+  end if;
+
+  def := rtrim(pg_get_viewdef('public.books_with_ratings'::regclass), E'; \n');
+  select coalesce(' with (' || array_to_string(c.reloptions, ', ') || ')', '')
+    into opts
+    from pg_class c
+    where c.oid = 'public.books_with_ratings'::regclass;
+
+  execute format(
+    'create or replace view public.books_with_ratings%s as '
+    'select v.*, greatest(coalesce(v.copies_total, 1) - coalesce(v.copies_borrowed, 0), 0) as available_copies '
+    'from (%s) v',
+    opts, def
+  );
+end $$;
+
+create index if not exists books_created_at_id_idx on public.books (created_at desc, id desc);
@@ -0,0 +1,32 @@
+-- Cover thumbnails generated on upload (and by `python -m app.images`):
+-- {"webp": {"160": url, "320": url, "640": url}, "jpeg": {...}}
+
+alter table public.books add column if not exists image_variants jsonb;
+
+-- books_with_ratings selects b.*, which was expanded when the view was created:
+-- the live view is wrapped as it is (see 20261016000000) and image_variants appended
+do $$
+declare
+  def text;
+  opts text;
+begin
+  if exists (
+    select 1 from information_schema.columns
+    where table_schema = 'public' and table_name = 'books_with_ratings' and column_name = 'image_variants'
+  ) then
+    return;
+  end if;
+
+  def := rtrim(pg_get_viewdef('public.books_with_ratings'::regclass), E'; \n');
+  select coalesce(' with (' || array_to_string(c.reloptions, ', ') || ')', '')
+    into opts
+    from pg_class c
+    where c.oid = 'public.books_with_ratings'::regclass;
+
+  execute format(
+    'create or replace view public.books_with_ratings%s as '
+    'select v.*, b.image_variants '
+    'from (%s) v left join public.books b on b.id = v.id',
+    opts, def
+  );
+end $$;
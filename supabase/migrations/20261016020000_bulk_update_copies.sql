@@ -0,0 +1,34 @@
+-- Bulk copies editor (/admin/books/import): many copies_total changes in one call.
+-- p_updates = [{"code": "C00042", "copies_total": 3}, ...]
+-- One row back per requested code: updated / copies_too_low / not_found.
+-- security invoker: the caller's RLS policies decide who may update books.
+
+create or replace function public.bulk_update_copies(p_updates jsonb)
+returns table (code text, status text)
+language sql
+security invoker
+as $$
+  with req as (
+    select e->>'code' as code, (e->>'copies_total')::int as copies_total
+    from jsonb_array_elements(p_updates) as e
+  ),
+  upd as (
+    update public.books b
+       set copies_total = req.copies_total
+      from req
+     where b.code = req.code
+       and req.copies_total >= 1
+       and req.copies_total >= coalesce(b.copies_borrowed, 0)
+    returning b.code
+  )
+  select req.code,
+         case
+           when upd.code is not null then 'updated'
+           when not exists (select 1 from public.books b where b.code = req.code) then 'not_found'
+           else 'copies_too_low'
+         end
+    from req
+    left join upd on upd.code = req.code;
+$$;
+
+grant execute on function public.bulk_update_copies(jsonb) to authenticated;
@@ -0,0 +1,32 @@
+-- Reminder scheduler (app/reminders.py) pages through active borrows with
+--   status = 'borrowed' and due_date in [a, b) order by due_date, id
+-- A partial index over active borrows keeps each page an index range scan.
+-- borrow_history is a view over the borrows table: the index goes on the
+-- base table(s) behind it (or on borrow_history itself if it is a table).
+
+do $$
+declare
+  t record;
+begin
+  for t in
+    select u.table_schema, u.table_name
+    from information_schema.view_table_usage u
+    where u.view_schema = 'public' and u.view_name = 'borrow_history'
+    union
+    select table_schema, table_name
+    from information_schema.tables
+    where table_schema = 'public' and table_name = 'borrow_history' and table_type = 'BASE TABLE'
+  loop
+    if (
+      select count(*) from information_schema.columns c
+      where c.table_schema = t.table_schema and c.table_name = t.table_name
+        and c.column_name in ('due_date', 'status', 'id')
+    ) = 3 then
+      execute format(
+        'create index if not exists %I on %I.%I (due_date, id) where status = %L',
+        t.table_name || '_active_due_date_idx', t.table_schema, t.table_name, 'borrowed'
+      );
+    end if;
+  end loop;
+end
+$$;
@@ -0,0 +1,18 @@
+-- Bulk import inserts with on_conflict=code (duplicates skipped, not failing the batch):
+-- PostgREST needs a unique constraint / index on books.code for that.
+-- Created only when none exists yet (fails if the table already holds duplicate codes).
+
+do $$
+begin
+  if not exists (
+    select 1
+      from pg_index i
+      join pg_attribute a on a.attrelid = i.indrelid and a.attnum = i.indkey[0]
+     where i.indrelid = 'public.books'::regclass
+       and i.indisunique
+       and i.indnatts = 1
+       and a.attname = 'code'
+  ) then
+    create unique index books_code_key on public.books (code);
+  end if;
+end $$;